@@ -0,0 +1,79 @@
+import datetime
+import pathlib
+import random
+import tempfile
+import time
+
+import click
+
+import logparser
+
+NF_MESSAGES = [
+    'UE Context Release [Action:2]',
+    '[imsi-901700000000001] Registration request',
+    'InitialUEMessage',
+    '[Added] Number of gNB-UEs is now 1',
+    'NF registered [Heartbeat:10s]',
+]
+
+
+def write_synthetic_log(path: pathlib.Path, lines: int, instrumentation_ratio: float):
+    start = datetime.datetime(datetime.datetime.now().year, 1, 1)
+    with path.open('w') as f:
+        f.write('Open5GS daemon v2.4.9\n\n')
+        for i in range(lines):
+            timestamp = (start + datetime.timedelta(milliseconds=i)).strftime('%m/%d %H:%M:%S.%f')[:-3]
+            r = random.random()
+            if r < instrumentation_ratio / 2:
+                message = f'[state]{{ue{i % 100},sess{i % 3},ev{i % 7},message}}'
+            elif r < instrumentation_ratio:
+                message = f'[time]{{key{i % 5},{r:.6f}}}'
+            else:
+                message = random.choice(NF_MESSAGES)
+            f.write(f'{timestamp}: [amf] INFO: {message} (../src/amf/ngap-handler.c:{i % 1000})\n')
+
+
+def bench(name, lines, func):
+    begin = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - begin
+    click.echo(f'{name:<40} {elapsed:8.2f} s {lines / elapsed:14,.0f} lines/s')
+    return elapsed
+
+
+def parse_open5gs_timestamp_strptime(timestamp_str: str) -> datetime.datetime:
+    timestamp = datetime.datetime.strptime(timestamp_str, '%m/%d %H:%M:%S.%f')
+    return timestamp.replace(year=datetime.datetime.now().year)
+
+
+@click.command()
+@click.option('--lines', type=int, default=2_000_000, help='Number of log lines to generate')
+@click.option('--ratio', type=float, default=0.05, help='Share of [state]/[time] lines')
+@click.option('--seed', type=int, default=0)
+def main(lines, ratio, seed):
+    random.seed(seed)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        logfile = pathlib.Path(tmpdir) / 'amf.log'
+        click.echo(f'Generating {lines:,} lines with {ratio:.0%} instrumentation lines...')
+        write_synthetic_log(logfile, lines, ratio)
+        bench('index: scan run headers', lines, lambda: logparser.update_run_index(logfile, rebuild=True))
+        click.echo()
+
+        timestamps = [(datetime.datetime(2000, 1, 1) + datetime.timedelta(milliseconds=i)).strftime('%m/%d %H:%M:%S.%f')[:-3]
+                      for i in range(min(lines, 1_000_000))]
+        slow = bench('timestamp: strptime', len(timestamps),
+                     lambda: [parse_open5gs_timestamp_strptime(t) for t in timestamps])
+        fast = bench('timestamp: slicing + per-second cache', len(timestamps),
+                     lambda: [logparser.parse_open5gs_timestamp(t) for t in timestamps])
+        click.echo(f'speedup: {slow / fast:.1f}x\n')
+
+        slow = bench('parse: all lines through log_line_regex', lines,
+                     lambda: logparser.parse_instrumentation_messages(logparser.read_log_last_run(logfile)))
+        fast = bench('parse: [state]/[time] pre-filter', lines,
+                     lambda: logparser.parse_instrumentation_messages(logparser.read_log_last_run(logfile, instrumentation_only=True)))
+        click.echo(f'speedup: {slow / fast:.1f}x')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import operator
+import pathlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+STATE_TABLE = 'state'
+TIME_TABLE = 'time'
+
+# columns holding repeated strings, stored dictionary-encoded
+STATE_DICTIONARY_COLUMNS = ('domain', 'object', 'child', 'event', 'message')
+TIME_DICTIONARY_COLUMNS = ('domain', 'key')
+
+FILTER_OPERATORS = {
+    '==': operator.eq,
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': np.isin,
+}
+
+
+def _timestamps_ns(timestamps: List[str]) -> np.ndarray:
+    return np.array(timestamps, dtype='datetime64[ns]').astype(np.int64)
+
+
+def instrumentation_to_columns(instrumentation_data: Dict) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+    """Flatten the nested instrumentation data into a state and a time table.
+
+    Child-less state events get an empty child id. Time keys holding a
+    streaming summary instead of raw durations are left out. Timestamps are int64
+    nanoseconds since the epoch (naive local time, as in the logs).
+    """
+    state = {column: [] for column in ('domain', 'object', 'child', 'event', 'timestamp', 'message')}
+    time = {column: [] for column in ('domain', 'key', 'duration', 'timestamp')}
+
+    def add_state_events(domain, obj, child, events):
+        for event in events:
+            state['domain'].append(domain)
+            state['object'].append(obj)
+            state['child'].append(child)
+            state['event'].append(event['event'])
+            state['timestamp'].append(event['timestamp'])
+            state['message'].append(event['message'])
+
+    for domain, nf_data in instrumentation_data.items():
+        if domain == '__run_timestamp':
+            continue
+
+        for obj, obj_data in nf_data['state_changes'].items():
+            add_state_events(domain, obj, '', obj_data['events'])
+            for child, child_events in obj_data['child_events'].items():
+                add_state_events(domain, obj, child, child_events['events'])
+
+        for key, timings in nf_data['time'].items():
+            if not isinstance(timings, list):
+                continue  # streaming summary, see timestats
+
+            for timing in timings:
+                time['domain'].append(domain)
+                time['key'].append(key)
+                time['duration'].append(timing['duration'])
+                time['timestamp'].append(timing['timestamp'])
+
+    state_columns = {column: np.array(values, dtype=str) for column, values in state.items() if column != 'timestamp'}
+    state_columns['timestamp'] = _timestamps_ns(state['timestamp'])
+    time_columns = {column: np.array(values, dtype=str) for column, values in time.items()
+                    if column not in ('duration', 'timestamp')}
+    time_columns['duration'] = np.array(time['duration'], dtype=np.float64)
+    time_columns['timestamp'] = _timestamps_ns(time['timestamp'])
+
+    return state_columns, time_columns
+
+
+def _write_parquet(path: pathlib.Path, columns: Dict[str, np.ndarray], dictionary_columns, run_timestamp):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    arrays = {}
+    for column, values in columns.items():
+        array = pa.array(values)
+        if column in dictionary_columns:
+            array = array.dictionary_encode()
+        arrays[column] = array
+
+    table = pa.table(arrays, metadata={'run_timestamp': str(run_timestamp)})
+    pq.write_table(table, path, use_dictionary=list(dictionary_columns), row_group_size=1 << 20)
+
+
+def _write_npz(path: pathlib.Path, columns: Dict[str, np.ndarray], dictionary_columns, run_timestamp):
+    arrays = {'__run_timestamp': np.array(str(run_timestamp))}
+    for column, values in columns.items():
+        if column in dictionary_columns:
+            categories, codes = np.unique(values, return_inverse=True)
+            arrays[column] = codes.astype(np.int32)
+            arrays[f'{column}.categories'] = categories
+        else:
+            arrays[column] = values
+
+    # uncompressed, so np.load can read single columns without inflating the rest
+    np.savez(path, **arrays)
+
+
+def write_table(path: pathlib.Path, columns: Dict[str, np.ndarray], dictionary_columns=(), run_timestamp=None) -> pathlib.Path:
+    """Write one flat table to path with the suffix of the available format.
+
+    Uses Parquet if pyarrow is installed, uncompressed NumPy .npz otherwise.
+    """
+    try:
+        import pyarrow.parquet  # noqa: F401
+        suffix, write = '.parquet', _write_parquet
+    except ImportError:
+        suffix, write = '.npz', _write_npz
+
+    path = path.with_name(path.name + suffix)
+    write(path, columns, dictionary_columns, run_timestamp)
+
+    return path
+
+
+def write_columnar(instrumentation_data: Dict, outdir: pathlib.Path) -> List[pathlib.Path]:
+    """Write the state and time tables of instrumentation_data to outdir."""
+    run_timestamp = instrumentation_data['__run_timestamp']
+    state_columns, time_columns = instrumentation_to_columns(instrumentation_data)
+
+    paths = []
+    for table, columns, dictionary_columns in ((STATE_TABLE, state_columns, STATE_DICTIONARY_COLUMNS),
+                                               (TIME_TABLE, time_columns, TIME_DICTIONARY_COLUMNS)):
+        paths.append(write_table(outdir / f'instrumentation-{table}-{run_timestamp}', columns, dictionary_columns, run_timestamp))
+
+    return paths
+
+
+def _filter_mask(columns: Dict[str, np.ndarray], filters) -> np.ndarray:
+    length = len(next(iter(columns.values())))
+    mask = np.ones(length, dtype=bool)
+    for column, op, value in filters:
+        mask &= FILTER_OPERATORS[op](columns[column], value)
+
+    return mask
+
+
+def _arrow_to_numpy(column) -> np.ndarray:
+    import pyarrow as pa
+
+    array = column.combine_chunks()
+    if pa.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+
+    return array.to_numpy(zero_copy_only=False)
+
+
+def read_columnar(path, columns=None, filters=None) -> Dict[str, np.ndarray]:
+    """Read a table written by write_columnar into a dict of NumPy arrays.
+
+    Only the given columns are loaded. filters is a list of (column, op, value)
+    tuples that all have to hold, the same form pyarrow.parquet accepts. For
+    Parquet they are pushed down to the reader.
+    """
+    path = pathlib.Path(path)
+    filter_columns = [column for column, _, _ in filters or []]
+
+    if path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, columns=columns, filters=filters or None)
+        return {name: _arrow_to_numpy(table.column(name)) for name in table.column_names}
+
+    with np.load(path) as npz:
+        names = [name for name in npz.files if not name.startswith('__') and not name.endswith('.categories')]
+        wanted = names if columns is None else list(dict.fromkeys(list(columns) + filter_columns))
+
+        data = {}
+        for name in wanted:
+            values = npz[name]
+            if f'{name}.categories' in npz.files:
+                values = npz[f'{name}.categories'][values]
+            data[name] = values
+
+    if filters:
+        mask = _filter_mask(data, filters)
+        data = {name: values[mask] for name, values in data.items()}
+
+    if columns is not None:
+        data = {name: data[name] for name in columns}
+
+    return data
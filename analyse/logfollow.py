@@ -0,0 +1,223 @@
+import errno
+import json
+import os
+import pathlib
+import socket
+import sys
+import time
+from typing import Dict, Optional
+
+import click
+
+from logparser import INSTRUMENTATION_MARKERS, RUN_HEADER_PREFIX, parse_instrumentation_message, parse_log_line
+
+READ_CHUNK_SIZE = 1 << 16
+# longer partial lines are dropped, which bounds the memory per followed log
+MAX_LINE_LENGTH = 1 << 16
+# records are sent to the follow clients in batches of about this size, a client
+# with more unsent data than MAX_CLIENT_BACKLOG is disconnected
+SEND_BATCH_SIZE = 1 << 16
+MAX_CLIENT_BACKLOG = 1 << 20
+
+
+class FollowedLog:
+    """Tail of a single NF log that survives truncation and reopening.
+
+    Reopening (e.g. mongod-style --logRotate reopen or logrotate create) is
+    detected by an inode change of the path, truncation (copytruncate) by the
+    file shrinking below the read offset.
+    """
+
+    def __init__(self, path: pathlib.Path, from_start: bool):
+        self.path = path
+        self.fd = None
+        self.inode = None
+        self.offset = 0
+        self.partial = b''
+        self.open(from_start)
+
+    def open(self, from_start: bool):
+        self.close()
+        self.fd = os.open(self.path, os.O_RDONLY)
+        stat = os.fstat(self.fd)
+        self.inode = stat.st_ino
+        self.offset = 0 if from_start else stat.st_size
+        self.partial = b''
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read_available(self):
+        while chunk := os.pread(self.fd, READ_CHUNK_SIZE, self.offset):
+            self.offset += len(chunk)
+            lines = (self.partial + chunk).split(b'\n')
+            self.partial = lines.pop()
+            if len(self.partial) > MAX_LINE_LENGTH:
+                self.partial = b''
+            for line in lines:
+                yield line + b'\n'
+
+    def poll(self):
+        """Yield the complete lines appended since the last poll."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is not None and stat.st_ino == self.inode and stat.st_size < self.offset:
+            self.offset = 0
+            self.partial = b''
+
+        if self.fd is not None:
+            yield from self._read_available()
+
+        if stat is not None and stat.st_ino != self.inode:
+            # old file drained, continue with the reopened one from its start
+            try:
+                self.open(from_start=True)
+            except FileNotFoundError:
+                # removed again before it could be opened, retried on the next poll
+                return
+            yield from self._read_available()
+
+
+def instrumentation_record(nf: str, line: bytes) -> Optional[Dict]:
+    if line.startswith(RUN_HEADER_PREFIX):
+        return {'type': 'run', 'nf': nf, 'header': line.decode(errors='replace').rstrip('\n')}
+
+    if INSTRUMENTATION_MARKERS[0] not in line and INSTRUMENTATION_MARKERS[1] not in line:
+        return None
+
+    if (values := parse_log_line(line)) is None:
+        return None
+
+    kind, data = parse_instrumentation_message(values['message'])
+    record = {'type': kind, 'nf': nf, 'domain': values['domain'], 'timestamp': values['timestamp'].isoformat()}
+    if kind == 'state':
+        record.update(object=data[0], child=data[1], event=data[2], message=data[3])
+    elif kind == 'time':
+        record.update(key=data[0], duration=float(data[1]))
+    else:
+        return None
+
+    return record
+
+
+class StdoutSink:
+    def send(self, record: Dict):
+        sys.stdout.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        sys.stdout.flush()
+
+    def close(self):
+        self.flush()
+
+
+class UnixSocketSink:
+    """Broadcast NDJSON records to every client connected to a UNIX socket.
+
+    Sockets are non-blocking, records are sent in batches of SEND_BATCH_SIZE
+    and what a client did not take yet is kept for the next flush. Clients
+    that can not keep up are disconnected once more than MAX_CLIENT_BACKLOG
+    is waiting for them.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        if path.is_socket():
+            path.unlink()
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(str(path))
+        self.server.listen()
+        self.server.setblocking(False)
+        # client -> bytes not sent to it yet
+        self.clients: Dict[socket.socket, bytes] = {}
+        self.pending = []
+        self.pending_size = 0
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self.server.accept()
+            except BlockingIOError:
+                return
+            client.setblocking(False)
+            self.clients[client] = b''
+
+    def _drop(self, client):
+        click.echo('Dropping slow or closed follow client', err=True)
+        client.close()
+        del self.clients[client]
+
+    def send(self, record: Dict):
+        line = json.dumps(record) + '\n'
+        self.pending.append(line)
+        self.pending_size += len(line)
+        # e.g. the backlog of --from-start is sent batch by batch instead of all at once
+        if self.pending_size >= SEND_BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self._accept()
+        data = ''.join(self.pending).encode()
+        self.pending = []
+        self.pending_size = 0
+
+        for client in list(self.clients):
+            backlog = self.clients[client] + data
+            if not backlog:
+                continue
+            try:
+                sent = client.send(backlog)
+            except OSError as e:
+                if e.errno == errno.EAGAIN:
+                    sent = 0
+                elif e.errno in (errno.EPIPE, errno.ECONNRESET):
+                    self._drop(client)
+                    continue
+                else:
+                    raise
+            self.clients[client] = backlog[sent:]
+            if len(self.clients[client]) > MAX_CLIENT_BACKLOG:
+                self._drop(client)
+
+    def close(self):
+        for client in self.clients:
+            client.close()
+        self.server.close()
+        self.path.unlink(missing_ok=True)
+
+
+def follow_logs(logdir: pathlib.Path, sink, poll_interval=0.1, from_start=False):
+    """Stream [state]/[time] records of all NF logs in logdir to sink until interrupted.
+
+    Logs present at startup are followed from their end unless from_start is
+    set, logs appearing later are read from their beginning.
+    """
+    followed: Dict[pathlib.Path, FollowedLog] = {}
+    first_scan = True
+
+    try:
+        while True:
+            for logfile in logdir.glob("*.log"):
+                if "mongodb" not in logfile.stem and logfile not in followed:
+                    try:
+                        followed[logfile] = FollowedLog(logfile, from_start=from_start or not first_scan)
+                    except FileNotFoundError:
+                        pass
+            first_scan = False
+
+            for logfile, log in followed.items():
+                for line in log.poll():
+                    if (record := instrumentation_record(logfile.stem, line)) is not None:
+                        sink.send(record)
+
+            sink.flush()
+            time.sleep(poll_interval)
+    finally:
+        for log in followed.values():
+            log.close()
+        sink.close()
@@ -1,61 +1,323 @@
+import concurrent.futures
 import datetime
+import functools
+import hashlib
+import itertools
 import json
+import mmap
 import re
-from typing import Generator, Dict
+from typing import Generator, Dict, List, Optional, Tuple
 
 import click
 import pathlib
 
-run_header_regex = re.compile(r'Open5GS daemon v.+')
+RUN_HEADER_PREFIX = b'Open5GS daemon v'
+INSTRUMENTATION_MARKERS = (b'[state]{', b'[time]{')
+RUN_INDEX_VERSION = 1
+RUN_INDEX_HEAD_LENGTH = 4096
+
 log_line_regex = re.compile(r'(?P<timestamp>[0-9]{2}\/[0-9]{2} [0-9]{2}\:[0-9]{2}\:[0-9]{2}\.[0-9]{3})\: \[(?P<domain>.+?)\] (?P<level>[A-Z]+)\: (?P<message>.+?) \((?P<location>.+\:[0-9]+)\)\n')
 state_data_regex = re.compile(r'\[state\]\{(?P<csv>(.*?\,)+.*?)\}(?P<version>\{.*\})?')
 time_data_regex = re.compile(r'\[time\]\{(?P<csv>(.*?\,)+.*?)\}(?P<version>\{.*\})?')
 
 
+@functools.lru_cache(maxsize=4096)
+def _parse_open5gs_second(second_str: str) -> datetime.datetime:
+    return datetime.datetime(datetime.datetime.now().year, int(second_str[0:2]), int(second_str[3:5]),
+                             int(second_str[6:8]), int(second_str[9:11]), int(second_str[12:14]))
+
+
 def parse_open5gs_timestamp(timestamp_str: str) -> datetime.datetime:
-    timestamp = datetime.datetime.strptime(timestamp_str, '%m/%d %H:%M:%S.%f')
-    timestamp = timestamp.replace(year=datetime.datetime.now().year)
-
-    return timestamp
-
-
-def read_log_last_run(logfile: pathlib.Path, dump=False, run=None) -> Generator[Dict, None, None]:
-    with logfile.open() as f:
-        run_header_position = f.tell()
-        running_position = f.tell()
-        last_was_head = False
-        for line in f:
-            if run_header_regex.match(line):
-                run_header_position = running_position
-                last_was_head = True
-            if dump or run is not None:
-                if last_was_head and (rematch := log_line_regex.match(line)):
-                    timestamp = parse_open5gs_timestamp(rematch.group('timestamp'))
-                    if dump:
-                        click.echo(f"Possible run: {timestamp.strftime('%Y%m%d-%H%M%S')}")
-                    else:
-                        diff = abs(timestamp - run)
-                        if diff < datetime.timedelta(minutes=1):
-                            break
-                    last_was_head = False
-            running_position += len(line)
-
-        f.seek(run_header_position)
-        f.readline()  # skip header line
-
-        for line in f:
-            if rematch := log_line_regex.match(line):
-                values = rematch.groupdict()
-                timestamp = parse_open5gs_timestamp(values['timestamp'])
-                values['timestamp'] = timestamp
-
-                yield values
-
-            elif run_header_regex.match(line):
+    # Fixed layout 'MM/DD HH:MM:SS.mmm', parsed by slicing. Consecutive log lines
+    # mostly share the same second, so that part is cached.
+    timestamp = _parse_open5gs_second(timestamp_str[:14])
+
+    return timestamp.replace(microsecond=int(timestamp_str[15:18]) * 1000)
+
+
+def run_index_path(logfile: pathlib.Path) -> pathlib.Path:
+    return logfile.with_name(logfile.name + '.idx')
+
+
+def map_log(f) -> Optional[mmap.mmap]:
+    """Map an open log file read-only, None for an empty file."""
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        return None
+
+    if hasattr(mm, 'madvise'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+
+    return mm
+
+
+def iter_lines(mm: mmap.mmap, start: int, end: int) -> Generator[Tuple[int, bytes], None, None]:
+    """Yield (offset, line) of the complete lines in mm[start:end]."""
+    position = start
+    while position < end:
+        newline = mm.find(b'\n', position, end)
+        if newline < 0:
+            return
+        yield position, mm[position:newline + 1]
+        position = newline + 1
+
+
+def iter_marked_lines(mm: mmap.mmap, start: int, end: int, markers) -> Generator[Tuple[int, bytes], None, None]:
+    """Yield (offset, line) of the complete lines in mm[start:end] containing any of markers.
+
+    Jumps from marker to marker with find, lines in between are never copied.
+    """
+    next_found = [mm.find(marker, start, end) for marker in markers]
+    while True:
+        candidates = [found for found in next_found if found >= 0]
+        if not candidates:
+            return
+
+        found = min(candidates)
+        line_start = mm.rfind(b'\n', start, found) + 1 or start
+        newline = mm.find(b'\n', found, end)
+        if newline < 0:
+            return
+        yield line_start, mm[line_start:newline + 1]
+
+        start = newline + 1
+        next_found = [mm.find(marker, start, end) if found < start else found
+                      for marker, found in zip(markers, next_found)]
+
+
+def _head_digest(mm: Optional[mmap.mmap], length: int) -> str:
+    return hashlib.sha1(mm[:length] if mm is not None else b'').hexdigest()
+
+
+def _new_run_index() -> Dict:
+    return {'version': RUN_INDEX_VERSION, 'size': 0, 'mtime_ns': 0, 'scanned': 0,
+            'head_length': 0, 'head_digest': None, 'runs': []}
+
+
+def load_run_index(logfile: pathlib.Path) -> Dict:
+    try:
+        with run_index_path(logfile).open() as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return _new_run_index()
+
+    if index.get('version') != RUN_INDEX_VERSION:
+        return _new_run_index()
+
+    return index
+
+
+def store_run_index(logfile: pathlib.Path, index: Dict):
+    path = run_index_path(logfile)
+    tmp_path = path.with_name(path.name + '.tmp')
+    try:
+        with tmp_path.open('w') as f:
+            json.dump(index, f)
+        tmp_path.replace(path)
+    except OSError as e:
+        click.echo(f'Could not store run index for {logfile}: {e}')
+
+
+def _scan_runs(mm: mmap.mmap, position: int, end: int, runs):
+    header_length = len(RUN_HEADER_PREFIX)
+    while position < end:
+        if runs and runs[-1]['timestamp'] is None:
+            # look for the first log line of the pending run line by line
+            newline = mm.find(b'\n', position, end)
+            line = mm[position:newline + 1]
+            if line.startswith(RUN_HEADER_PREFIX):
+                runs.append({'offset': position, 'timestamp': None})
+            elif rematch := log_line_regex.match(line.decode(errors='replace')):
+                runs[-1]['timestamp'] = rematch.group('timestamp')
+            position = newline + 1
+        elif mm[position:position + header_length] == RUN_HEADER_PREFIX:
+            runs.append({'offset': position, 'timestamp': None})
+            position = mm.find(b'\n', position, end) + 1
+        else:
+            header = mm.find(b'\n' + RUN_HEADER_PREFIX, position, end)
+            if header < 0:
+                return
+            position = header + 1
+
+
+def update_run_index(logfile: pathlib.Path, rebuild=False) -> Dict:
+    """Bring the sidecar run index of logfile up to date.
+
+    The index stores the byte offset of every run header together with the raw
+    timestamp of the first log line of that run. Only the part of the log that
+    was appended since the last update is scanned.
+    """
+    index = _new_run_index() if rebuild else load_run_index(logfile)
+    stat = logfile.stat()
+
+    if index['size'] == stat.st_size and index['mtime_ns'] == stat.st_mtime_ns:
+        return index
+
+    with logfile.open('rb') as f:
+        mm = map_log(f)
+        if stat.st_size < index['scanned'] or \
+                (index['head_length'] and _head_digest(mm, index['head_length']) != index['head_digest']):
+            # truncated or replaced, e.g. by log rotation
+            index = _new_run_index()
+
+        if mm is not None:
+            with mm:
+                # only scan complete lines, a partial last line is rescanned on the next update
+                end = mm.rfind(b'\n', index['scanned']) + 1 or index['scanned']
+                _scan_runs(mm, index['scanned'], end, index['runs'])
+                index['scanned'] = end
+                index['head_length'] = min(end, RUN_INDEX_HEAD_LENGTH)
+                index['head_digest'] = _head_digest(mm, index['head_length'])
+
+    index['size'] = stat.st_size
+    index['mtime_ns'] = stat.st_mtime_ns
+    store_run_index(logfile, index)
+
+    return index
+
+
+def select_run(index: Dict, run=None) -> Tuple[int, int]:
+    """Return the byte range (start, end) of the selected run.
+
+    Without run the last run of the log is selected. With run the first run
+    starting within one minute of it, falling back to the last run.
+    """
+    runs = index['runs']
+    if not runs:
+        return 0, index['scanned']
+
+    selected = len(runs) - 1
+    if run is not None:
+        for i, entry in enumerate(runs):
+            if entry['timestamp'] is None:
+                continue
+            diff = abs(parse_open5gs_timestamp(entry['timestamp']) - run)
+            if diff < datetime.timedelta(minutes=1):
+                selected = i
                 break
 
+    end = runs[selected + 1]['offset'] if selected + 1 < len(runs) else index['scanned']
+    return runs[selected]['offset'], end
+
+
+def parse_log_line(line: bytes) -> Optional[Dict]:
+    if rematch := log_line_regex.match(line.decode(errors='replace')):
+        values = rematch.groupdict()
+        values['timestamp'] = parse_open5gs_timestamp(values['timestamp'])
+        return values
+
+    return None
+
+
+def read_run(mm: mmap.mmap, start: int, end: int, instrumentation_only=False) -> Generator[Dict, None, None]:
+    """Yield the parsed log lines of the run with its header at mm[start], up to end."""
+    lines = iter_lines(mm, start, end)
+    next(lines, None)  # skip header line
+
+    for position, line in lines:
+        if line.startswith(RUN_HEADER_PREFIX):
+            return
+
+        if (values := parse_log_line(line)) is not None:
+            yield values
+
+            if instrumentation_only:
+                # the run timestamp is known, skip ahead from marker to marker
+                lines = iter_marked_lines(mm, position + len(line), end, INSTRUMENTATION_MARKERS)
+                break
+
+    for position, line in lines:
+        if (values := parse_log_line(line)) is not None:
+            yield values
+
+
+def read_log_last_run(logfile: pathlib.Path, dump=False, run=None, rebuild_index=False,
+                      instrumentation_only=False) -> Generator[Dict, None, None]:
+    """Yield the parsed log lines of the selected run of logfile.
+
+    With instrumentation_only, only the first log line of the run (needed for
+    the run timestamp) and lines that may hold [state]/[time] data are parsed,
+    everything else is skipped before running log_line_regex.
+    """
+    index = update_run_index(logfile, rebuild=rebuild_index)
+
+    if dump:
+        for entry in index['runs']:
+            if entry['timestamp'] is not None:
+                timestamp = parse_open5gs_timestamp(entry['timestamp'])
+                click.echo(f"Possible run: {timestamp.strftime('%Y%m%d-%H%M%S')}")
+        return
+
+    start, end = select_run(index, run)
+
+    with logfile.open('rb') as f:
+        mm = map_log(f)
+        if mm is None:
+            return
+
+        with mm:
+            yield from read_run(mm, start, end, instrumentation_only=instrumentation_only)
+
+
+def iter_log_runs(logfile: pathlib.Path, rebuild_index=False, instrumentation_only=False) -> Generator[Generator[Dict, None, None], None, None]:
+    """Yield a generator of parsed log lines for every run of logfile, in file order.
 
-def parse_instrumentation_messages(log_generator, instrumentation_data=None) -> Dict:
+    The run generators share one mapping of the log and have to be consumed
+    in order, so the whole log is read once.
+    """
+    index = update_run_index(logfile, rebuild=rebuild_index)
+    runs = index['runs'] or [{'offset': 0}]
+    ends = [entry['offset'] for entry in runs[1:]] + [index['scanned']]
+
+    with logfile.open('rb') as f:
+        mm = map_log(f)
+        if mm is None:
+            return
+
+        with mm:
+            for entry, end in zip(runs, ends):
+                yield read_run(mm, entry['offset'], end, instrumentation_only=instrumentation_only)
+
+
+def run_timestamp_diff(instrumentation_data: Dict, timestamp: datetime.datetime) -> Tuple[datetime.datetime, datetime.timedelta]:
+    run_timestamp = datetime.datetime.strptime(instrumentation_data['__run_timestamp'], '%Y%m%d-%H%M%S')
+    return run_timestamp, abs(timestamp - run_timestamp)
+
+
+def matches_run(instrumentation_data: Dict, timestamp: datetime.datetime) -> bool:
+    run_timestamp, diff = run_timestamp_diff(instrumentation_data, timestamp)
+    if diff > datetime.timedelta(minutes=1):
+        click.echo(f'Log data not matching run of previous analyzed logs! (prev: {run_timestamp}, this: {timestamp}, diff: {diff})')
+        return False
+
+    return True
+
+
+def parse_instrumentation_message(message: str) -> Tuple[Optional[str], Optional[List[str]]]:
+    """Return ('state', [object, child, event, message]), ('time', [key, duration]) or (None, None)."""
+    for kind, regex, fields in (('state', state_data_regex, 4), ('time', time_data_regex, 2)):
+        if match := regex.search(message):
+            data = match.group('csv').split(',')
+            if match.group('version') is not None:
+                click.echo('Unsupported version for state data!', err=True)
+                return None, None
+
+            if len(data) != fields:
+                return None, None
+
+            return kind, data
+
+    return None, None
+
+
+def parse_instrumentation_messages(log_generator, instrumentation_data=None, time_summary=None) -> Dict:
+    """Collect the [state] and [time] data of log_generator into instrumentation_data.
+
+    If time_summary is given, it is called to create one streaming summary per
+    domain and time key (see timestats.TimeSummary) instead of keeping the raw
+    duration list.
+    """
     if instrumentation_data is None:
         instrumentation_data = {'__run_timestamp': None}
 
@@ -63,24 +325,13 @@ def parse_instrumentation_messages(log_generator, instrumentation_data=None) ->
     for line in log_generator:
         if instrumentation_data['__run_timestamp'] is None:
             instrumentation_data['__run_timestamp'] = line['timestamp'].strftime('%Y%m%d-%H%M%S')
-        elif first_line:
-            run_timestamp = datetime.datetime.strptime(instrumentation_data['__run_timestamp'], '%Y%m%d-%H%M%S')
-            diff = abs(line['timestamp'] - run_timestamp)
-            if diff > datetime.timedelta(minutes=1):
-                click.echo(f'Log data not matching run of previous analyzed logs! (prev: {run_timestamp}, this: {line["timestamp"]}, diff: {diff})')
-                return instrumentation_data
+        elif first_line and not matches_run(instrumentation_data, line['timestamp']):
+            return instrumentation_data
 
         first_line = False
 
-        if match := state_data_regex.search(line['message']):
-            data = match.group('csv').split(',')
-            if match.group('version') is not None:
-                click.echo('Unsupported version for state data!')
-                continue
-
-            if len(data) != 4:
-                continue
-
+        kind, data = parse_instrumentation_message(line['message'])
+        if kind == 'state':
             nf_data = instrumentation_data.get(line['domain'], {'time': {}, 'state_changes': {}})
             obj_data = nf_data['state_changes'].get(data[0], {'events': [], 'child_events': {}})
             if data[1] == "":
@@ -93,19 +344,16 @@ def parse_instrumentation_messages(log_generator, instrumentation_data=None) ->
 
             nf_data['state_changes'][data[0]] = obj_data
             instrumentation_data[line['domain']] = nf_data
-        elif match := time_data_regex.search(line['message']):
-            data = match.group('csv').split(',')
-            if match.group('version') is not None:
-                click.echo('Unsupported version for state data!')
-                continue
-
-            if len(data) != 2:
-                continue
-
+        elif kind == 'time':
             nf_data = instrumentation_data.get(line['domain'], {'time': {}, 'state_changes': {}})
-            timings = nf_data['time'].get(data[0], [])
-
-            timings.append({'duration': float(data[1]), 'timestamp': line['timestamp'].isoformat()})
+            if time_summary is None:
+                timings = nf_data['time'].get(data[0], [])
+                timings.append({'duration': float(data[1]), 'timestamp': line['timestamp'].isoformat()})
+            else:
+                timings = nf_data['time'].get(data[0])
+                if timings is None:
+                    timings = time_summary()
+                timings.add(float(data[1]), line['timestamp'].isoformat())
 
             nf_data['time'][data[0]] = timings
             instrumentation_data[line['domain']] = nf_data
@@ -113,14 +361,178 @@ def parse_instrumentation_messages(log_generator, instrumentation_data=None) ->
     return instrumentation_data
 
 
+def read_log_segments(segments: List[pathlib.Path], dump=False, run=None, rebuild_index=False,
+                      instrumentation_only=False) -> Generator[Dict, None, None]:
+    """read_log_last_run for the segments of one NF log as found by logsegments.find_log_segments.
+
+    A single uncompressed log goes through the run index, rotated or
+    compressed segments are streamed as one continuous log.
+    """
+    from logsegments import is_plain_log, read_segments_last_run
+
+    if is_plain_log(segments):
+        return read_log_last_run(segments[0], dump=dump, run=run, rebuild_index=rebuild_index,
+                                 instrumentation_only=instrumentation_only)
+
+    return read_segments_last_run(segments, dump=dump, run=run, instrumentation_only=instrumentation_only)
+
+
+def parse_logfile(segments: List[pathlib.Path], run=None, rebuild_index=False, time_summary=None) -> Tuple[Optional[datetime.datetime], Dict]:
+    """Parse a single log on its own, for merging with merge_instrumentation_data.
+
+    Returns the timestamp of the first log line of the run, which is needed to
+    repeat the run consistency check against the previously merged logs.
+    """
+    log_generator = read_log_segments(segments, run=run, rebuild_index=rebuild_index, instrumentation_only=True)
+    first_line = next(log_generator, None)
+    if first_line is None:
+        return None, {'__run_timestamp': None}
+
+    return first_line['timestamp'], parse_instrumentation_messages(itertools.chain([first_line], log_generator),
+                                                                   time_summary=time_summary)
+
+
+def merge_instrumentation_data(instrumentation_data, first_timestamp, file_data) -> Dict:
+    """Merge the result of parse_logfile into instrumentation_data.
+
+    Produces the same result as threading instrumentation_data through
+    parse_instrumentation_messages for the logs in the same order.
+    """
+    if instrumentation_data is None:
+        instrumentation_data = {'__run_timestamp': None}
+
+    if first_timestamp is None:
+        return instrumentation_data
+
+    if instrumentation_data['__run_timestamp'] is None:
+        instrumentation_data['__run_timestamp'] = file_data['__run_timestamp']
+    elif not matches_run(instrumentation_data, first_timestamp):
+        return instrumentation_data
+
+    for domain, file_nf_data in file_data.items():
+        if domain == '__run_timestamp':
+            continue
+
+        nf_data = instrumentation_data.get(domain)
+        if nf_data is None:
+            instrumentation_data[domain] = file_nf_data
+            continue
+
+        for key, timings in file_nf_data['time'].items():
+            if key not in nf_data['time']:
+                nf_data['time'][key] = timings
+            elif isinstance(timings, list):
+                nf_data['time'][key].extend(timings)
+            else:
+                nf_data['time'][key].merge(timings)
+
+        for obj, file_obj_data in file_nf_data['state_changes'].items():
+            obj_data = nf_data['state_changes'].get(obj)
+            if obj_data is None:
+                nf_data['state_changes'][obj] = file_obj_data
+                continue
+
+            obj_data['events'].extend(file_obj_data['events'])
+            for child, file_child_events in file_obj_data['child_events'].items():
+                child_events = obj_data['child_events'].setdefault(child, {'events': []})
+                child_events['events'].extend(file_child_events['events'])
+
+    return instrumentation_data
+
+
+def parse_log_runs(segments: List[pathlib.Path], rebuild_index=False, time_summary=None) -> List[Tuple[datetime.datetime, Dict]]:
+    """Parse every run of one NF log in a single read, see parse_logfile for the result of each run."""
+    from logsegments import is_plain_log, iter_segment_runs
+
+    if is_plain_log(segments):
+        runs = iter_log_runs(segments[0], rebuild_index=rebuild_index, instrumentation_only=True)
+    else:
+        runs = iter_segment_runs(segments, instrumentation_only=True)
+
+    parsed_runs = []
+    for log_generator in runs:
+        first_line = next(log_generator, None)
+        if first_line is None:
+            continue
+
+        parsed_runs.append((first_line['timestamp'],
+                            parse_instrumentation_messages(itertools.chain([first_line], log_generator), time_summary=time_summary)))
+
+    return parsed_runs
+
+
+def align_runs(nf_runs: List[List[Tuple[datetime.datetime, Dict]]]) -> List[Dict]:
+    """Merge the runs of all NF logs whose first log lines are within one minute of each other.
+
+    Returns the merged instrumentation data of every run, ordered by time.
+    """
+    aligned = []
+    for runs in nf_runs:
+        for first_timestamp, run_data in runs:
+            for instrumentation_data in aligned:
+                if run_timestamp_diff(instrumentation_data, first_timestamp)[1] <= datetime.timedelta(minutes=1):
+                    merge_instrumentation_data(instrumentation_data, first_timestamp, run_data)
+                    break
+            else:
+                aligned.append(merge_instrumentation_data(None, first_timestamp, run_data))
+
+    return sorted(aligned, key=lambda instrumentation_data: instrumentation_data['__run_timestamp'])
+
+
+def write_instrumentation_data(instrumentation_data: Dict, outdir: pathlib.Path, output_format='json', json_default=None):
+    if output_format == 'columnar':
+        from columnar import write_columnar
+
+        for path in write_columnar(instrumentation_data, outdir):
+            click.echo(f'Wrote parsed state and time data to {path}')
+
+        if json_default is not None:
+            with (outdir / f'instrumentation-stats-{instrumentation_data["__run_timestamp"]}.json').open('w') as f:
+                json.dump({domain: {'time': nf_data['time'], 'state_changes': {}} if domain != '__run_timestamp' else nf_data
+                           for domain, nf_data in instrumentation_data.items()}, f, default=json_default)
+                click.echo(f'Wrote time summaries to {f.name}')
+    else:
+        with (outdir / f'instrumentation-data-{instrumentation_data["__run_timestamp"]}.json').open('w') as f:
+            json.dump(instrumentation_data, f, default=json_default)
+            click.echo(f'Wrote parsed state and time date to {f.name}')
+
+
 @click.command()
 @click.option('--dump/--no-dump', default=False)
 @click.option('--run', type=str, required=False)
+@click.option('--all-runs/--single-run', default=False, help='Parse every run of the logs in one pass and write one output per run')
+@click.option('--reindex/--no-reindex', default=False, help='Rebuild the sidecar run index of every log')
+@click.option('--jobs', '-j', type=click.IntRange(min=1), default=1, help='Number of logs parsed in parallel')
+@click.option('--format', 'output_format', type=click.Choice(['json', 'columnar']), default='json',
+              help='Nested JSON or flat state/time tables (Parquet if pyarrow is installed, .npz otherwise)')
+@click.option('--follow/--no-follow', default=False, help='Stream [state]/[time] records of all logs as NDJSON while they are written')
+@click.option('--socket', 'socket_path', type=click.Path(dir_okay=False), required=False,
+              help='With --follow, serve the records on this UNIX socket instead of stdout')
+@click.option('--from-start/--from-end', default=False, help='With --follow, also emit what is already in the logs')
+@click.option('--stats/--no-stats', default=False,
+              help='Keep streaming summaries (count, mean, variance, min/max, quantiles) of [time] durations instead of raw lists')
+@click.option('--stats-alpha', type=float, default=0.01, help='Relative accuracy of the quantile sketches')
+@click.option('--histogram-buckets', type=str, required=False,
+              help='With --stats, comma separated bucket edges of an additional fixed-bucket histogram')
 @click.argument('logdir', type=click.Path(exists=True, file_okay=False))
 @click.argument('outdir', type=click.Path(exists=True, file_okay=False), required=False)
-def main(dump, run, logdir, outdir=None):
+def main(dump, run, all_runs, reindex, jobs, output_format, follow, socket_path, from_start, stats, stats_alpha, histogram_buckets,
+         logdir, outdir=None):
     logdir = pathlib.Path(logdir)
 
+    if follow:
+        from logfollow import StdoutSink, UnixSocketSink, follow_logs
+
+        sink = UnixSocketSink(pathlib.Path(socket_path)) if socket_path else StdoutSink()
+        try:
+            follow_logs(logdir, sink, from_start=from_start)
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if all_runs and (dump or run is not None):
+        raise click.UsageError('--all-runs can not be combined with --dump or --run')
+
     if outdir is None:
         outdir = pathlib.Path.cwd()
     else:
@@ -131,20 +543,45 @@ def main(dump, run, logdir, outdir=None):
     if run is not None:
         run = datetime.datetime.strptime(run, '%Y%m%d-%H%M%S')
 
-    for logfile in logdir.glob("*.log"):
-        if "mongodb" in logfile.stem:
-            continue
-
-        if dump:
-            list(read_log_last_run(logfile, dump=dump))
-            break
-
-        instrumentation_data = parse_instrumentation_messages(read_log_last_run(logfile, run=run), instrumentation_data=instrumentation_data)
+    time_summary = None
+    json_default = None
+    if stats:
+        from timestats import TimeSummary, summary_json_default
+
+        histogram_edges = [float(edge) for edge in histogram_buckets.split(',')] if histogram_buckets else None
+        time_summary = functools.partial(TimeSummary, alpha=stats_alpha, histogram_edges=histogram_edges)
+        json_default = summary_json_default
+
+    from logsegments import find_log_segments
+
+    logfiles = list(find_log_segments(logdir).values())
+
+    if all_runs:
+        parse = functools.partial(parse_log_runs, rebuild_index=reindex, time_summary=time_summary)
+        if jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+                nf_runs = list(executor.map(parse, logfiles))
+        else:
+            nf_runs = [parse(segments) for segments in logfiles]
+
+        for run_data in align_runs(nf_runs):
+            write_instrumentation_data(run_data, outdir, output_format=output_format, json_default=json_default)
+    elif dump:
+        if logfiles:
+            list(read_log_segments(logfiles[0], dump=dump, rebuild_index=reindex))
+    elif jobs > 1:
+        parse = functools.partial(parse_logfile, run=run, rebuild_index=reindex, time_summary=time_summary)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            # map keeps the order of logfiles, so merging is deterministic
+            for first_timestamp, file_data in executor.map(parse, logfiles):
+                instrumentation_data = merge_instrumentation_data(instrumentation_data, first_timestamp, file_data)
+    else:
+        for segments in logfiles:
+            instrumentation_data = parse_instrumentation_messages(read_log_segments(segments, run=run, rebuild_index=reindex, instrumentation_only=True),
+                                                                  instrumentation_data=instrumentation_data, time_summary=time_summary)
 
     if instrumentation_data is not None:
-        with (outdir / f'instrumentation-data-{instrumentation_data["__run_timestamp"]}.json').open('w') as f:
-            json.dump(instrumentation_data, f)
-            click.echo(f'Wrote parsed state and time date to {f.name}')
+        write_instrumentation_data(instrumentation_data, outdir, output_format=output_format, json_default=json_default)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+import bz2
+import datetime
+import gzip
+import lzma
+import pathlib
+import queue
+import re
+import threading
+from typing import Dict, Generator, List
+
+import click
+
+from logparser import INSTRUMENTATION_MARKERS, RUN_HEADER_PREFIX, parse_log_line
+
+# amf.log, amf.log.1, amf.log.2.gz, amf.log-20261001.zst, ...
+segment_regex = re.compile(r'(?P<nf>.+?)\.log(?:\.(?P<number>[0-9]+)|-(?P<date>[0-9]{8,}))?(?P<compression>\.gz|\.zst|\.bz2|\.xz)?')
+
+READ_CHUNK_SIZE = 1 << 20
+# decompressed chunks buffered ahead of the parser
+PREFETCH_CHUNKS = 8
+
+
+def _segment_order(match: re.Match):
+    if match.group('date') is not None:
+        return 0, match.group('date')
+    if match.group('number') is not None:
+        return 1, -int(match.group('number'))
+    return 2, 0
+
+
+def find_log_segments(logdir: pathlib.Path) -> Dict[str, List[pathlib.Path]]:
+    """Group the live, rotated and compressed segments of each NF log, oldest first.
+
+    Numbered rotations count up with age (amf.log.2 is older than amf.log.1),
+    dated rotations count up with time and are older than numbered ones.
+    """
+    # seed with the live logs so the NF order matches logdir.glob("*.log")
+    candidates = list(logdir.glob("*.log")) + sorted(path for path in logdir.iterdir() if not path.name.endswith('.log'))
+
+    segments = {}
+    for path in candidates:
+        match = segment_regex.fullmatch(path.name)
+        if match is None or not path.is_file() or "mongodb" in match.group('nf'):
+            continue
+        segments.setdefault(match.group('nf'), []).append((_segment_order(match), path))
+
+    return {nf: [path for _, path in sorted(nf_segments)] for nf, nf_segments in segments.items()}
+
+
+def is_plain_log(segments: List[pathlib.Path]) -> bool:
+    return len(segments) == 1 and segments[0].suffix == '.log'
+
+
+def open_segment(path: pathlib.Path):
+    if path.suffix == '.gz':
+        return gzip.open(path, 'rb')
+    if path.suffix == '.bz2':
+        return bz2.open(path, 'rb')
+    if path.suffix == '.xz':
+        return lzma.open(path, 'rb')
+    if path.suffix == '.zst':
+        import zstandard
+
+        return zstandard.ZstdDecompressor().stream_reader(path.open('rb'), read_across_frames=True, closefd=True)
+
+    return path.open('rb')
+
+
+def iter_segment_chunks(segments: List[pathlib.Path], chunk_size=READ_CHUNK_SIZE) -> Generator[bytes, None, None]:
+    """Yield the decompressed content of segments in order, in chunks.
+
+    Reading and decompressing happens in a background thread a few chunks
+    ahead (zlib, bz2, lzma and zstd release the GIL while decompressing), so
+    it overlaps with parsing in the consuming thread.
+    """
+    chunks = queue.Queue(maxsize=PREFETCH_CHUNKS)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for segment in segments:
+                with open_segment(segment) as f:
+                    while chunk := f.read(chunk_size):
+                        if not put(chunk):
+                            return
+            put(None)
+        except Exception as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while (item := chunks.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+
+def iter_segment_lines(segments: List[pathlib.Path]) -> Generator[bytes, None, None]:
+    """Yield the lines of segments as one continuous log."""
+    partial = b''
+    for chunk in iter_segment_chunks(segments):
+        lines = (partial + chunk).split(b'\n')
+        partial = lines.pop()
+        for line in lines:
+            yield line + b'\n'
+
+    if partial:
+        yield partial
+
+
+def read_segments_last_run(segments: List[pathlib.Path], dump=False, run=None,
+                           instrumentation_only=False) -> Generator[Dict, None, None]:
+    """Same as logparser.read_log_last_run for a log made of rotated and compressed segments.
+
+    The segments are read once as one stream, so runs spanning a rotation are
+    continuous. Only the parsed lines of the current candidate run are held:
+    the run matching run is streamed as soon as its first log line is seen,
+    otherwise the last run is yielded at the end.
+    """
+    buffered = []
+    matched = False
+    seen_first = False
+
+    for line in iter_segment_lines(segments):
+        if line.startswith(RUN_HEADER_PREFIX):
+            if matched:
+                return
+            buffered = []
+            seen_first = False
+            continue
+
+        if instrumentation_only and seen_first and \
+                INSTRUMENTATION_MARKERS[0] not in line and INSTRUMENTATION_MARKERS[1] not in line:
+            continue
+
+        if (values := parse_log_line(line)) is None:
+            continue
+
+        if not seen_first:
+            seen_first = True
+            if dump:
+                click.echo(f"Possible run: {values['timestamp'].strftime('%Y%m%d-%H%M%S')}")
+            elif run is not None and abs(values['timestamp'] - run) < datetime.timedelta(minutes=1):
+                matched = True
+
+        if dump:
+            continue
+
+        if matched:
+            yield values
+        else:
+            buffered.append(values)
+
+    if not dump and not matched:
+        yield from buffered
+
+
+def iter_segment_runs(segments: List[pathlib.Path], instrumentation_only=False) -> Generator[Generator[Dict, None, None], None, None]:
+    """Yield a generator of parsed log lines for every run in segments, in order.
+
+    Lines before the first run header (the header was rotated away) form a
+    run of their own. The run generators share one stream and have to be
+    consumed in order.
+    """
+    lines = iter_segment_lines(segments)
+    more = True
+
+    def run_lines():
+        nonlocal more
+        seen_first = False
+        for line in lines:
+            if line.startswith(RUN_HEADER_PREFIX):
+                return
+
+            if instrumentation_only and seen_first and \
+                    INSTRUMENTATION_MARKERS[0] not in line and INSTRUMENTATION_MARKERS[1] not in line:
+                continue
+
+            if (values := parse_log_line(line)) is not None:
+                seen_first = True
+                yield values
+        more = False
+
+    while more:
+        run = run_lines()
+        yield run
+        # drain what the caller left over, the next run starts after the header
+        for _ in run:
+            pass
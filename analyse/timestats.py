@@ -0,0 +1,289 @@
+import bisect
+import json
+import math
+import pathlib
+from typing import Dict, List, Optional
+
+import click
+
+QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99, 'p99.9': 0.999}
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative accuracy alpha (DDSketch).
+
+    Values are counted in logarithmically sized buckets, so any quantile is
+    within alpha relative error of the exact one and two sketches with the
+    same alpha merge by adding bucket counts.
+    """
+
+    def __init__(self, alpha=0.01, max_bins=2048):
+        self.alpha = alpha
+        self.max_bins = max_bins
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.zero_count = 0
+        self.bins: Dict[int, int] = {}
+
+    def add(self, value: float, count=1):
+        if value <= 0:
+            self.zero_count += count
+            return
+
+        index = math.ceil(math.log(value) / self.log_gamma)
+        self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def _collapse(self):
+        # fold the lowest buckets together, keeps accuracy for the upper quantiles
+        indices = sorted(self.bins)
+        excess = len(indices) - self.max_bins
+        target = indices[excess]
+        for index in indices[:excess]:
+            self.bins[target] += self.bins.pop(index)
+
+    def merge(self, other: 'QuantileSketch'):
+        if other.alpha != self.alpha:
+            raise ValueError(f'Can not merge sketches with different accuracy ({self.alpha} != {other.alpha})')
+
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+        if len(self.bins) > self.max_bins:
+            self._collapse()
+
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.zero_count + sum(self.bins.values())
+        if total == 0:
+            return None
+
+        rank = q * (total - 1)
+        cumulative = self.zero_count
+        if cumulative > rank:
+            return 0.0
+
+        for index in sorted(self.bins):
+            cumulative += self.bins[index]
+            if cumulative > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict:
+        return {'alpha': self.alpha, 'zero_count': self.zero_count,
+                'bins': {str(index): count for index, count in sorted(self.bins.items())}}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        sketch = cls(alpha=data['alpha'])
+        sketch.zero_count = data['zero_count']
+        sketch.bins = {int(index): count for index, count in data['bins'].items()}
+        return sketch
+
+
+class Histogram:
+    """Fixed-bucket histogram, counts[i] holds values in [edges[i - 1], edges[i]).
+
+    counts[0] and counts[-1] are the under- and overflow buckets.
+    """
+
+    def __init__(self, edges: List[float]):
+        self.edges = sorted(edges)
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_right(self.edges, value)] += 1
+
+    def merge(self, other: 'Histogram'):
+        if other.edges != self.edges:
+            raise ValueError('Can not merge histograms with different bucket edges')
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+
+    def to_dict(self) -> Dict:
+        return {'edges': self.edges, 'counts': self.counts}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Histogram':
+        histogram = cls(data['edges'])
+        histogram.counts = list(data['counts'])
+        return histogram
+
+
+class TimeSummary:
+    """Streaming summary of the [time] durations of one (domain, key).
+
+    Mean and variance are kept with Welford's algorithm and merged with the
+    parallel variant by Chan et al., so no raw samples are held.
+    """
+
+    def __init__(self, alpha=0.01, histogram_edges: Optional[List[float]] = None):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.first_timestamp = None
+        self.last_timestamp = None
+        self.sketch = QuantileSketch(alpha=alpha)
+        self.histogram = Histogram(histogram_edges) if histogram_edges else None
+
+    def add(self, duration: float, timestamp: Optional[str] = None):
+        self.count += 1
+        delta = duration - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (duration - self.mean)
+        self.min = min(self.min, duration)
+        self.max = max(self.max, duration)
+        if timestamp is not None:
+            if self.first_timestamp is None:
+                self.first_timestamp = timestamp
+            self.last_timestamp = timestamp
+
+        self.sketch.add(duration)
+        if self.histogram is not None:
+            self.histogram.add(duration)
+
+    def merge(self, other: 'TimeSummary'):
+        if other.count == 0:
+            return
+
+        if self.count == 0 and other.histogram is not None:
+            self.histogram = Histogram(other.histogram.edges)
+        if self.histogram is not None and other.histogram is not None:
+            self.histogram.merge(other.histogram)
+        else:
+            # a histogram of the samples of one side only would undercount the buckets
+            self.histogram = None
+
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self.first_timestamp is None or (other.first_timestamp is not None and other.first_timestamp < self.first_timestamp):
+            self.first_timestamp = other.first_timestamp
+        if self.last_timestamp is None or (other.last_timestamp is not None and other.last_timestamp > self.last_timestamp):
+            self.last_timestamp = other.last_timestamp
+
+        self.sketch.merge(other.sketch)
+
+    @property
+    def variance(self) -> Optional[float]:
+        return self.m2 / (self.count - 1) if self.count > 1 else None
+
+    def to_dict(self) -> Dict:
+        data = {
+            'count': self.count,
+            'mean': self.mean if self.count else None,
+            'variance': self.variance,
+            'm2': self.m2,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+            'first_timestamp': self.first_timestamp,
+            'last_timestamp': self.last_timestamp,
+            'quantiles': {name: self.quantile(q) for name, q in QUANTILES.items()},
+            'sketch': self.sketch.to_dict(),
+        }
+        if self.histogram is not None:
+            data['histogram'] = self.histogram.to_dict()
+
+        return data
+
+    def quantile(self, q: float) -> Optional[float]:
+        value = self.sketch.quantile(q)
+        # the sketch only guarantees relative error, the exact extremes are known
+        return None if value is None else min(max(value, self.min), self.max)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'TimeSummary':
+        summary = cls(alpha=data['sketch']['alpha'])
+        summary.count = data['count']
+        summary.mean = data['mean'] or 0.0
+        summary.m2 = data['m2']
+        summary.min = data['min'] if data['min'] is not None else math.inf
+        summary.max = data['max'] if data['max'] is not None else -math.inf
+        summary.first_timestamp = data['first_timestamp']
+        summary.last_timestamp = data['last_timestamp']
+        summary.sketch = QuantileSketch.from_dict(data['sketch'])
+        if 'histogram' in data:
+            summary.histogram = Histogram.from_dict(data['histogram'])
+        return summary
+
+    @classmethod
+    def from_timings(cls, timings, **kwargs) -> 'TimeSummary':
+        """Summarize a raw duration list of the JSON output."""
+        summary = cls(**kwargs)
+        for timing in timings:
+            summary.add(timing['duration'], timing['timestamp'])
+        return summary
+
+
+def summary_json_default(obj):
+    if isinstance(obj, TimeSummary):
+        return obj.to_dict()
+
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def load_summaries(path: pathlib.Path, **kwargs) -> Dict[str, Dict[str, TimeSummary]]:
+    """Load the [time] summaries per domain and key from a logparser JSON output.
+
+    Raw duration lists of outputs written without --stats are summarized on the fly.
+    """
+    with path.open() as f:
+        instrumentation_data = json.load(f)
+
+    summaries = {}
+    for domain, nf_data in instrumentation_data.items():
+        if domain == '__run_timestamp':
+            continue
+
+        for key, timings in nf_data['time'].items():
+            if isinstance(timings, list):
+                summary = TimeSummary.from_timings(timings, **kwargs)
+            else:
+                summary = TimeSummary.from_dict(timings)
+            summaries.setdefault(domain, {})[key] = summary
+
+    return summaries
+
+
+@click.command()
+@click.option('--output', '-o', type=click.Path(dir_okay=False), required=False, help='Write the merged summaries as JSON')
+@click.option('--alpha', type=float, default=0.01, help='Relative accuracy for summarizing raw duration lists')
+@click.argument('inputs', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+def main(output, alpha, inputs):
+    """Merge the [time] summaries of several logparser outputs (files or runs)."""
+    merged: Dict[str, Dict[str, TimeSummary]] = {}
+    for path in inputs:
+        for domain, summaries in load_summaries(pathlib.Path(path), alpha=alpha).items():
+            for key, summary in summaries.items():
+                if key in merged.setdefault(domain, {}):
+                    merged[domain][key].merge(summary)
+                else:
+                    merged[domain][key] = summary
+
+    click.echo(f'{"domain":<10} {"key":<40} {"count":>8} {"mean":>10} {"p50":>10} {"p95":>10} {"p99":>10} {"p99.9":>10} {"max":>10}')
+    for domain, summaries in merged.items():
+        for key, summary in summaries.items():
+            quantiles = [summary.quantile(q) for q in QUANTILES.values()]
+            click.echo(f'{domain:<10} {key:<40} {summary.count:>8} {summary.mean:>10.4g} '
+                       + ' '.join(f'{q:>10.4g}' for q in quantiles) + f' {summary.max:>10.4g}')
+
+    if output is not None:
+        # same layout as the logparser output, so merged summaries can be merged again
+        merged_data = {'__run_timestamp': None}
+        for domain, summaries in merged.items():
+            merged_data[domain] = {'time': summaries, 'state_changes': {}}
+
+        with open(output, 'w') as f:
+            json.dump(merged_data, f, default=summary_json_default)
+            click.echo(f'Wrote merged summaries to {f.name}')
+
+
+if __name__ == "__main__":
+    main()
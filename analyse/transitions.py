@@ -0,0 +1,197 @@
+import json
+import pathlib
+from typing import Dict, List, Tuple
+
+import click
+import numpy as np
+
+from columnar import instrumentation_to_columns, read_columnar, write_table
+
+STATE_COLUMNS = ['domain', 'object', 'child', 'event', 'timestamp']
+TRANSITION_DICTIONARY_COLUMNS = ('domain', 'object', 'child', 'from_state', 'to_state')
+DISTRIBUTION_QUANTILES = {'p50': 0.5, 'p95': 0.95, 'p99': 0.99}
+
+
+def load_state_events(path: pathlib.Path) -> Dict[str, np.ndarray]:
+    """Load the state events of a logparser JSON output or columnar state table."""
+    if path.suffix in ('.parquet', '.npz'):
+        return read_columnar(path, columns=STATE_COLUMNS)
+
+    with path.open() as f:
+        state_columns, _ = instrumentation_to_columns(json.load(f))
+
+    return {column: state_columns[column] for column in STATE_COLUMNS}
+
+
+def _sort_by_object(events: Dict[str, np.ndarray]) -> Tuple[Dict[str, np.ndarray], np.ndarray]:
+    """Sort events by (domain, object, child, timestamp), return them with a group id per row."""
+    codes = [np.unique(events[column], return_inverse=True)[1] for column in ('domain', 'object', 'child')]
+    order = np.lexsort((events['timestamp'], codes[2], codes[1], codes[0]))
+    codes = [c[order] for c in codes]
+
+    new_group = np.ones(len(order), dtype=bool)
+    if len(order):
+        new_group[1:] = (codes[0][1:] != codes[0][:-1]) | (codes[1][1:] != codes[1][:-1]) | (codes[2][1:] != codes[2][:-1])
+
+    return {column: values[order] for column, values in events.items()}, np.cumsum(new_group) - 1
+
+
+def reconstruct_transitions(events: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Connect consecutive state events of each object (and child) into transitions.
+
+    duration is the dwell time in from_state in nanoseconds, timestamp the
+    time from_state was entered.
+    """
+    events, group = _sort_by_object(events)
+    same = group[1:] == group[:-1]
+    first, second = np.flatnonzero(same), np.flatnonzero(same) + 1
+
+    return {
+        'domain': events['domain'][first],
+        'object': events['object'][first],
+        'child': events['child'][first],
+        'from_state': events['event'][first],
+        'to_state': events['event'][second],
+        'duration': events['timestamp'][second] - events['timestamp'][first],
+        'timestamp': events['timestamp'][first],
+    }
+
+
+def _grouped_distribution(keys: List[np.ndarray], durations: np.ndarray) -> Tuple[List[np.ndarray], Dict[str, np.ndarray]]:
+    """count, mean, min, max and quantiles of durations for each unique combination of keys."""
+    if len(durations) == 0:
+        return [key[:0] for key in keys], {name: np.array([]) for name in ['count', 'mean', 'min', 'max', *DISTRIBUTION_QUANTILES]}
+
+    codes = [np.unique(key, return_inverse=True)[1] for key in keys]
+    order = np.lexsort((durations, *reversed(codes)))
+    codes = [c[order] for c in codes]
+    durations = durations[order]
+
+    new_group = np.ones(len(order), dtype=bool)
+    new_group[1:] = np.any([c[1:] != c[:-1] for c in codes], axis=0)
+    starts = np.flatnonzero(new_group)
+    counts = np.diff(np.append(starts, len(order)))
+
+    stats = {
+        'count': counts,
+        'mean': np.add.reduceat(durations, starts) / counts,
+        'min': durations[starts],
+        'max': durations[starts + counts - 1],
+    }
+    for name, q in DISTRIBUTION_QUANTILES.items():
+        stats[name] = durations[starts + np.floor(q * (counts - 1)).astype(np.int64)]
+
+    return [key[order][starts] for key in keys], stats
+
+
+def transition_matrices(transitions: Dict[str, np.ndarray]) -> Dict[str, Dict]:
+    """Per domain (NF) count and mean dwell time matrix over from_state x to_state."""
+    matrices = {}
+    for domain in np.unique(transitions['domain']):
+        mask = transitions['domain'] == domain
+        states, codes = np.unique(np.concatenate([transitions['from_state'][mask], transitions['to_state'][mask]]),
+                                  return_inverse=True)
+        from_codes, to_codes = codes[:mask.sum()], codes[mask.sum():]
+        flat = from_codes * len(states) + to_codes
+
+        counts = np.bincount(flat, minlength=len(states) ** 2).reshape(len(states), len(states))
+        total = np.bincount(flat, weights=transitions['duration'][mask], minlength=len(states) ** 2).reshape(counts.shape)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(counts > 0, total / counts, np.nan)
+
+        matrices[str(domain)] = {
+            'states': states.tolist(),
+            'counts': counts.tolist(),
+            'mean_duration': [[None if np.isnan(v) else float(v) for v in row] for row in mean],
+        }
+
+    return matrices
+
+
+def procedure_latencies(events: Dict[str, np.ndarray], start_event: str, end_event: str) -> Dict[str, np.ndarray]:
+    """Latency from each start_event to the next end_event of the same object (and child).
+
+    A start that is followed by another start before the end is superseded
+    by the later one, every start is paired with at most one end.
+    """
+    events, group = _sort_by_object(events)
+    index = np.arange(len(group))
+
+    last_start = np.maximum.accumulate(np.where(events['event'] == start_event, index, -1))
+    ends = np.flatnonzero((events['event'] == end_event) & (last_start >= 0))
+    ends = ends[group[last_start[ends]] == group[ends]]
+    # only the first end after a start completes the procedure
+    _, first = np.unique(last_start[ends], return_index=True)
+    ends = np.sort(ends[first])
+    starts = last_start[ends]
+
+    return {
+        'domain': events['domain'][starts],
+        'object': events['object'][starts],
+        'child': events['child'][starts],
+        'duration': events['timestamp'][ends] - events['timestamp'][starts],
+        'timestamp': events['timestamp'][starts],
+    }
+
+
+def _distribution_records(keys: List[np.ndarray], stats: Dict[str, np.ndarray], names: List[str]) -> List[Dict]:
+    records = []
+    for i in range(len(stats['count'])):
+        record = {name: str(key[i]) for name, key in zip(names, keys)}
+        record.update({stat: values[i].item() for stat, values in stats.items()})
+        records.append(record)
+
+    return records
+
+
+def parse_procedure(ctx, param, values) -> List[Tuple[str, str, str]]:
+    procedures = []
+    for value in values:
+        try:
+            name, events = value.split('=', 1)
+            start_event, end_event = events.split(':', 1)
+        except ValueError:
+            raise click.BadParameter(f'{value!r} is not of the form name=start_event:end_event')
+        procedures.append((name, start_event, end_event))
+
+    return procedures
+
+
+@click.command()
+@click.option('--procedure', '-p', multiple=True, callback=parse_procedure,
+              help='Procedure latency from one state event to another, as name=start_event:end_event')
+@click.argument('input', type=click.Path(exists=True, dir_okay=False))
+@click.argument('outdir', type=click.Path(exists=True, file_okay=False), required=False)
+def main(procedure, input, outdir=None):
+    """Reconstruct state transitions from a logparser JSON or columnar state output."""
+    input = pathlib.Path(input)
+    outdir = pathlib.Path.cwd() if outdir is None else pathlib.Path(outdir)
+    stem = input.name.split('.')[0].replace('instrumentation-data-', '').replace('instrumentation-state-', '')
+
+    events = load_state_events(input)
+    transitions = reconstruct_transitions(events)
+    path = write_table(outdir / f'transitions-{stem}', transitions, TRANSITION_DICTIONARY_COLUMNS)
+    click.echo(f'Wrote {len(transitions["duration"])} transitions to {path}')
+
+    names = ['domain', 'from_state', 'to_state']
+    keys, stats = _grouped_distribution([transitions[name] for name in names], transitions['duration'])
+    summary = {
+        'duration_unit': 'ns',
+        'transition_matrices': transition_matrices(transitions),
+        'transition_durations': _distribution_records(keys, stats, names),
+        'procedures': {},
+    }
+
+    for name, start_event, end_event in procedure:
+        latencies = procedure_latencies(events, start_event, end_event)
+        keys, stats = _grouped_distribution([latencies['domain']], latencies['duration'])
+        summary['procedures'][name] = {'start_event': start_event, 'end_event': end_event,
+                                       'latencies': _distribution_records(keys, stats, ['domain'])}
+
+    with (outdir / f'transitions-summary-{stem}.json').open('w') as f:
+        json.dump(summary, f)
+        click.echo(f'Wrote transition matrices and latency distributions to {f.name}')
+
+
+if __name__ == "__main__":
+    main()
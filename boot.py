@@ -0,0 +1,130 @@
+"""
+About: Readiness probes for booting the emulation instead of fixed sleeps.
+
+A probe is a callable returning whether a component is ready. BootTimer
+polls the probes of a phase until all of them are and records how long
+each one took, so startup latency can be tracked across runs.
+"""
+
+import json
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# NFs registering at the NRF, the UPF is only known to the SMF (PFCP)
+g_nrf_nfs = ("amf", "smf", "ausf", "udm", "udr", "pcf", "bsf", "nssf")
+g_nrf_registered = "NF registered"
+g_pfcp_associated = "PFCP associated"
+g_ng_setup = "NG Setup procedure is successful"
+
+
+class LogProbe:
+    """Ready once pattern is written to the log count times after the probe was created.
+
+    Logs are appended to across runs, so only what is written after the
+    probe was created counts. A log that shrank was rotated and is read
+    from the start.
+    """
+
+    def __init__(self, path, pattern, count=1):
+        self.path = path
+        self.pattern = pattern.encode()
+        self.count = count
+        self.found = 0
+        self.offset = os.path.getsize(path) if os.path.exists(path) else 0
+        self.tail = b""
+
+    def __call__(self):
+        if not os.path.exists(self.path):
+            return False
+        if os.path.getsize(self.path) < self.offset:
+            self.offset = 0
+
+        with open(self.path, "rb") as fin:
+            fin.seek(self.offset)
+            data = self.tail + fin.read()
+        self.offset += len(data) - len(self.tail)
+
+        self.found += data.count(self.pattern)
+        # A match may be split over two reads, the kept tail is too short to count one twice
+        self.tail = data[-(len(self.pattern) - 1):] if len(self.pattern) > 1 else b""
+        return self.found >= self.count
+
+
+def container_run(container, cmd):
+    return subprocess.run(["docker", "exec", container, "bash", "-c", cmd],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+
+def container_succeeds(container, cmd):
+    return container_run(container, cmd) == 0
+
+
+def port_probe(container, host, port):
+    """Ready once host:port accepts TCP connections from inside the container (e.g. an SBI port)."""
+    return lambda: container_succeeds(container, f"exec 3<>/dev/tcp/{host}/{port}")
+
+
+def interface_probe(container, prefix, count=1):
+    """Ready once count interfaces starting with prefix exist in the container (uesimtun0, 1, ...)."""
+    return lambda: container_succeeds(container, f"[ $(ls /sys/class/net | grep -c '^{prefix}') -ge {count} ]")
+
+
+class BootTimer:
+    """Waits for the probes of one boot phase after the other and records the times."""
+
+    def __init__(self, max_workers=16):
+        self.start = time.monotonic()
+        self.phases = list()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def wait(self, phase, probes, timeout=60, interval=0.1):
+        """Poll the probes (name -> probe) until all are ready, raises TimeoutError after timeout seconds.
+
+        The pending probes are polled concurrently, docker exec probes of many
+        containers would add up otherwise.
+        """
+        start = time.monotonic()
+        pending = dict(probes)
+        ready = dict()
+        while True:
+            results = list(self.pool.map(lambda probe: probe(), pending.values()))
+            now = time.monotonic()
+            for name, result in zip(list(pending), results):
+                if result:
+                    ready[name] = now - start
+                    del pending[name]
+
+            if not pending:
+                break
+            if now - start > timeout:
+                raise TimeoutError(f"{phase}: {', '.join(pending)} not ready after {timeout} s")
+            time.sleep(interval)
+
+        return self.record(phase, start, ready)
+
+    def record(self, phase, start, ready=None):
+        """Record a phase that started at the time.monotonic() start and ends now."""
+        self.phases.append({"phase": phase, "start": start - self.start, "duration": time.monotonic() - start,
+                            "ready": ready or dict()})
+        return self.phases[-1]["duration"]
+
+    def total(self):
+        return sum(phase["duration"] for phase in self.phases)
+
+    def report(self):
+        lines = [f"{'phase':<10} {'duration [s]':>12} {'slowest':>20}"]
+        for phase in self.phases:
+            slowest = max(phase["ready"], key=phase["ready"].get) if phase["ready"] else "-"
+            lines.append(f"{phase['phase']:<10} {phase['duration']:>12.2f} {slowest:>20}")
+        lines.append(f"{'total':<10} {self.total():>12.2f}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, **meta):
+        """Append the boot times of this run as one NDJSON record."""
+        with open(path, "a") as fout:
+            fout.write(json.dumps({"ts": time.time(), **meta, "total": self.total(), "phases": self.phases}) + "\n")
+
+    def close(self):
+        self.pool.shutdown()
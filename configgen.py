@@ -0,0 +1,187 @@
+"""
+About: Render per-node UERANSIM and open5gs configs for topo.py from the checked-in ones.
+
+The templates are edited line by line, so their comments survive and the
+rendered files diff cleanly against them.
+"""
+
+import os
+import re
+
+# Subnet of the emulated network, the core keeps .111, UPF host i gets .112 + i, gNB i gets .131 + 2i and its
+# UE host the address after it
+g_subnet = "192.168.0"
+g_subnet_prefix = 24
+g_core_ip = f"{g_subnet}.111"
+g_first_upf_ip = 112
+g_first_ran_ip = 131
+g_max_upfs = g_first_ran_ip - g_first_upf_ip
+g_max_gnbs = (254 - g_first_ran_ip + 1) // 2
+
+
+def upf_ip(i):
+    return f"{g_subnet}.{g_first_upf_ip + i}"
+
+
+def gnb_ip(i):
+    return f"{g_subnet}.{g_first_ran_ip + 2 * i}"
+
+
+def ue_ip(i):
+    return f"{g_subnet}.{g_first_ran_ip + 2 * i + 1}"
+
+
+def node_name(kind, i):
+    # The first node keeps the plain name, ssmm.py and fleet.py exec into "gnb" and "ue"
+    return kind if i == 0 else f"{kind}{i + 1}"
+
+
+def nci(i, id_length=32):
+    """NR Cell Identity of cell 0 of gNB i: the gNB ID (i + 1) in the upper id_length of 36 bits."""
+    return f"0x{(i + 1) << (36 - id_length):09x}"
+
+
+def set_scalar(text, key, value):
+    """Replace the value of a top level key: value line, keeping its quoting and comment."""
+    def replace(m):
+        quote = "'" if m.group(2).startswith("'") else ""
+        return f"{m.group(1)}{quote}{value}{quote}{m.group(3)}"
+
+    text, count = re.subn(rf"^({re.escape(key)}:\s*)('[^']*'|\S+)(.*)$", replace, text, count=1, flags=re.M)
+    if count == 0:
+        raise KeyError(f"{key} not in template")
+    return text
+
+
+def set_list(text, key, items):
+    """Replace the '- item' lines of a top level list."""
+    m = re.search(rf"^{re.escape(key)}:[^\n]*\n((?:[ \t]+- [^\n]*\n?)+)", text, flags=re.M)
+    if m is None:
+        raise KeyError(f"{key} not in template")
+    indent = re.match(r"[ \t]+", m.group(1)).group(0)
+    lines = "".join(f"{indent}- {item}\n" for item in items)
+    return text[:m.start(1)] + lines + text[m.end(1):]
+
+
+def set_addrs(text, section, key, addrs):
+    """Replace the list under section: key: (e.g. upf: pfcp:) by one '- addr:' entry per address."""
+    lines = text.splitlines(keepends=True)
+    in_section = False
+    for i, line in enumerate(lines):
+        if re.match(r"\S", line):
+            in_section = line.startswith(f"{section}:")
+            continue
+
+        m = re.match(rf"([ \t]+){re.escape(key)}:\s*$", line)
+        if in_section and m:
+            end = i + 1
+            while end < len(lines) and lines[end].strip() and len(lines[end]) - len(lines[end].lstrip()) > len(m.group(1)):
+                end += 1
+            items = "".join(f"{m.group(1)}  - addr: {addr}\n" for addr in addrs)
+            return "".join(lines[:i + 1]) + items + "".join(lines[end:])
+
+    raise KeyError(f"{section}.{key} not in template")
+
+
+def id_length_of(template):
+    return int(re.search(r"^idLength:\s*(\d+)", template, flags=re.M).group(1))
+
+
+def render_gnb(template, i, amf_ip=g_core_ip):
+    ip = gnb_ip(i)
+    text = set_scalar(template, "nci", nci(i, id_length_of(template)))
+    for key in ("linkIp", "ngapIp", "gtpIp"):
+        text = set_scalar(text, key, ip)
+    return re.sub(r"^(\s*- address:\s*)\S+", rf"\g<1>{amf_ip}", text, count=1, flags=re.M)
+
+
+def render_ue(template, i, imsi):
+    text = set_scalar(template, "supi", f"imsi-{imsi:015d}")
+    return set_list(text, "gnbSearchList", [gnb_ip(i)])
+
+
+def imsi_of(template):
+    return int(re.search(r"^supi:\s*'imsi-(\d+)'", template, flags=re.M).group(1))
+
+
+def render_ran(config_dir, num_gnbs, ues_per_gnb, out_dir="generated"):
+    """Write gnb<i>.yaml and ue<i>.yaml for every gNB and its UE host to config_dir/out_dir.
+
+    The UE host of gNB i runs ues_per_gnb UEs (nr-ue -n) with consecutive
+    SUPIs, the first UE of the template's SUPI comes first. Returns the
+    paths relative to config_dir and the SUPI range of every node.
+    """
+    if num_gnbs > g_max_gnbs:
+        raise ValueError(f"at most {g_max_gnbs} gNBs fit into {g_subnet}.0/{g_subnet_prefix}")
+
+    with open(os.path.join(config_dir, "open5gs-gnb.yaml")) as fin:
+        gnb_template = fin.read()
+    with open(os.path.join(config_dir, "open5gs-ue.yaml")) as fin:
+        ue_template = fin.read()
+    imsi_base = imsi_of(ue_template)
+
+    os.makedirs(os.path.join(config_dir, out_dir), exist_ok=True)
+    nodes = list()
+    for i in range(num_gnbs):
+        gnb_config = os.path.join(out_dir, f"gnb{i + 1}.yaml")
+        ue_config = os.path.join(out_dir, f"ue{i + 1}.yaml")
+        first_imsi = imsi_base + i * ues_per_gnb
+        with open(os.path.join(config_dir, gnb_config), "w") as fout:
+            fout.write(render_gnb(gnb_template, i))
+        with open(os.path.join(config_dir, ue_config), "w") as fout:
+            fout.write(render_ue(ue_template, i, first_imsi))
+
+        nodes.append({
+            "gnb": node_name("gnb", i),
+            "gnb_ip": gnb_ip(i),
+            "gnb_config": gnb_config,
+            "nci": nci(i, id_length_of(gnb_template)),
+            "ue": node_name("ue", i),
+            "ue_ip": ue_ip(i),
+            "ue_config": ue_config,
+            "imsi": [first_imsi, first_imsi + ues_per_gnb - 1],
+        })
+
+    return nodes
+
+
+def render_upf(template, i, log_dir="/open5gs/install/var/log/open5gs"):
+    ip = upf_ip(i)
+    text = re.sub(r"^(\s+file:\s*)\S+", rf"\g<1>{log_dir}/{node_name('upf', i)}.log", template, count=1, flags=re.M)
+    text = set_addrs(text, "upf", "pfcp", [ip])
+    return set_addrs(text, "upf", "gtpu", [ip])
+
+
+def render_smf(template, num_upfs):
+    # PFCP leaves the container, so the SMF listens on the core's address instead of the loopback
+    text = set_addrs(template, "smf", "pfcp", [g_core_ip])
+    return set_addrs(text, "upf", "pfcp", [upf_ip(i) for i in range(num_upfs)])
+
+
+def render_core(config_dir, num_upfs, out_dir="generated"):
+    """Write smf.yaml and upf<i>.yaml for UPFs on num_upfs hosts of their own to config_dir/out_dir.
+
+    The SMF gets all UPFs as PFCP peers, every UPF its own PFCP and GTP-U
+    address and log. Returns the paths relative to config_dir.
+    """
+    if num_upfs > g_max_upfs:
+        raise ValueError(f"at most {g_max_upfs} UPFs fit between the core and the gNBs")
+
+    with open(os.path.join(config_dir, "smf.yaml")) as fin:
+        smf_template = fin.read()
+    with open(os.path.join(config_dir, "upf.yaml")) as fin:
+        upf_template = fin.read()
+
+    os.makedirs(os.path.join(config_dir, out_dir), exist_ok=True)
+    smf_config = os.path.join(out_dir, "smf.yaml")
+    with open(os.path.join(config_dir, smf_config), "w") as fout:
+        fout.write(render_smf(smf_template, num_upfs))
+
+    upfs = list()
+    for i in range(num_upfs):
+        upf_config = os.path.join(out_dir, f"upf{i + 1}.yaml")
+        with open(os.path.join(config_dir, upf_config), "w") as fout:
+            fout.write(render_upf(upf_template, i))
+        upfs.append({"upf": node_name("upf", i), "upf_ip": upf_ip(i), "upf_config": upf_config})
+
+    return smf_config, upfs
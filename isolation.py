@@ -0,0 +1,130 @@
+"""
+About: CPU and memory isolation of the emulation's containers and NFs (topo.py --cpuset, --cpus, --mem).
+
+Limits apply to a target, either a Docker host (5gc, upf, gnb, ue2, ...) or
+an NF (amf, smf, ...). In the 5GC container an NF can only be pinned to
+cores (taskset in start_open5gs.sh). With --nf-containers every NF runs in
+a container of its own that shares the network namespace of the 5GC host,
+so the loopback addresses of the configs stay valid and quota and memory
+limits apply per NF as well.
+"""
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boot
+
+g_nfs = ("nrf", "amf", "smf", "ausf", "udm", "udr", "pcf", "bsf", "nssf", "upf")
+# Start order of the NF containers: the NRF and UPF first, the others once the NRF answers
+g_first_nfs = ("nrf", "upf")
+g_nrf_sbi = ("127.0.0.10", 7777)
+
+
+def parse_cpus(cpus):
+    """Cores of a cpuset list like 2-5,8."""
+    cores = list()
+    for part in str(cpus).split(","):
+        first, _, last = part.partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return cores
+
+
+def spread(nfs, cpus):
+    """One core of cpus per NF in order, round robin if there are fewer cores than NFs."""
+    cores = parse_cpus(cpus)
+    return {nf: str(cores[i % len(cores)]) for i, nf in enumerate(nfs)}
+
+
+def resolve(resources, nfs, nf_cores=None):
+    """Layout of all targets: the explicit limits, NFs without a cpuset get one core of nf_cores each."""
+    layout = {target: dict(spec) for target, spec in resources.items()}
+    if nf_cores:
+        unpinned = [nf for nf in nfs if "cpuset" not in layout.get(nf, dict())]
+        for nf, core in spread(unpinned, nf_cores).items():
+            layout.setdefault(nf, dict())["cpuset"] = core
+    return layout
+
+
+def check(layout, hosts, nfs, nf_containers):
+    for target, spec in layout.items():
+        if target not in hosts and target not in nfs:
+            raise ValueError(f"unknown target {target}, choose from {', '.join(list(hosts) + list(nfs))}")
+        if target in nfs and not nf_containers and set(spec) - {"cpuset"}:
+            raise ValueError(f"{target}: CPU quota and memory limits of single NFs need --nf-containers")
+
+
+def docker_args(spec):
+    """Docker run arguments of the limits of one target."""
+    args = dict()
+    if "cpuset" in spec:
+        args["cpuset_cpus"] = spec["cpuset"]
+    if "cpus" in spec:
+        args["nano_cpus"] = int(spec["cpus"] * 1e9)
+    if "mem" in spec:
+        # No swap on top, swapping would add the jitter the limits are meant to remove
+        args["mem_limit"] = spec["mem"]
+        args["memswap_limit"] = spec["mem"]
+    return args
+
+
+def nf_cpuset(layout, nfs):
+    """NF_CPUSET of start_open5gs.sh, e.g. amf=2 smf=3-4."""
+    return " ".join(f"{nf}={layout[nf]['cpuset']}" for nf in nfs if "cpuset" in layout.get(nf, dict()))
+
+
+def write_layout(path, layout, nf_containers, **meta):
+    with open(path, "w") as fout:
+        json.dump({"ts": time.time(), "host_cpus": os.cpu_count(), "nf_containers": nf_containers, **meta,
+                   "targets": layout}, fout, indent=2)
+        fout.write("\n")
+
+
+class NfContainers:
+    """The NFs of the 5GC, each in a container of its own in the network namespace of the 5GC host."""
+
+    def __init__(self, core_name, layout, volumes, image="open5gs"):
+        import docker
+
+        self.client = docker.from_env()
+        self.core_name = core_name
+        self.layout = layout
+        self.volumes = volumes
+        self.image = image
+        self.containers = dict()
+
+    def name(self, nf):
+        return f"{self.core_name}-{nf}"
+
+    def start(self, nf, args=()):
+        # The UPF opens ogstun, which start_open5gs.sh created in the shared namespace
+        extra = {"cap_add": ["NET_ADMIN"], "devices": ["/dev/net/tun:/dev/net/tun:rwm"]} if nf == "upf" else dict()
+        self.containers[nf] = self.client.containers.run(self.image, [f"./install/bin/open5gs-{nf}d", *args],
+                                                         name=self.name(nf),
+                                                         network_mode=f"container:{self.core_name}",
+                                                         volumes=self.volumes,
+                                                         working_dir="/open5gs",
+                                                         detach=True,
+                                                         **extra,
+                                                         **docker_args(self.layout.get(nf, dict())))
+
+    def boot(self, timer, nfs, nf_args, timeout=60):
+        """Start the NFs, the ones depending on the NRF once its SBI port answers.
+
+        MongoDB is up already, start_open5gs.sh waits for it before it exits.
+        """
+        with ThreadPoolExecutor(max_workers=len(nfs)) as pool:
+            first = [nf for nf in nfs if nf in g_first_nfs]
+            list(pool.map(lambda nf: self.start(nf, nf_args.get(nf, ())), first))
+            timer.wait("nrf", {"nrf": boot.port_probe(self.core_name, *g_nrf_sbi)}, timeout)
+            rest = [nf for nf in nfs if nf not in g_first_nfs]
+            list(pool.map(lambda nf: self.start(nf, nf_args.get(nf, ())), rest))
+
+    def remove(self):
+        """Kill and remove the NF containers, also ones left over from an aborted run."""
+        names = [self.name(nf) for nf in g_nfs]
+        containers = [c for c in self.client.containers.list(all=True) if c.name in names]
+        with ThreadPoolExecutor(max_workers=max(len(containers), 1)) as pool:
+            list(pool.map(lambda c: c.remove(force=True), containers))
+        self.containers = dict()
@@ -1,3 +1,9 @@
 #!/bin/bash
 
-iperf3 -s -D -B 10.45.0.1
+# Receiver for the ssmm.py/fleet.py traffic, TRAFFIC_SERVER=iperf3 starts iperf3 -s instead,
+# TRAFFIC_LOG=1 logs every received packet to traffic.ndjson next to the NF logs
+if [ "$TRAFFIC_SERVER" = "iperf3" ] || [ ! -f /traffic/trafficgen.py ]; then
+    iperf3 -s -D -B 10.45.0.1
+else
+    python3 /traffic/trafficgen.py -B 10.45.0.1 ${TRAFFIC_LOG:+-o /open5gs/install/var/log/open5gs/traffic.ndjson} > /dev/null &
+fi
@@ -2,27 +2,99 @@
 
 export DB_URI="mongodb://localhost/open5gs"
 
-mongod --smallfiles --dbpath /var/lib/mongodb --logpath /open5gs/install/var/log/open5gs/mongodb.log --logRotate reopen --logappend &
+BOOT_START=$(date +%s%N)
 
-sleep 6 && cd /open5gs/webui && npm run dev &
+# Prints how long a phase took since its start (ns) and since the script started
+boot_phase() {
+    local now=$(date +%s%N)
+    printf "[boot] %-10s %6d ms (%6d ms since start)\n" "$1" $(((now - $2) / 1000000)) $(((now - BOOT_START) / 1000000))
+}
 
-if ! grep "ogstun" /proc/net/dev > /dev/null; then
-    ip tuntap add name ogstun mode tun
-    ip addr add 10.45.0.1/16 dev ogstun
-    ip link set ogstun up
-    iptables -t nat -A POSTROUTING -s 10.45.0.1/16 ! -o ogstun -j MASQUERADE
+# Polls until a TCP port accepts connections instead of sleeping a fixed time: wait_for_port <name> <host> <port> [timeout s]
+wait_for_port() {
+    local start=$(date +%s%N)
+    local deadline=$((SECONDS + ${4:-60}))
+    until (exec 3<>/dev/tcp/$2/$3) 2> /dev/null; do
+        if [ $SECONDS -ge $deadline ]; then
+            echo "[boot] $1 not ready after ${4:-60} s" >&2
+            return 1
+        fi
+        sleep 0.05
+    done
+    boot_phase "$1" $start
+}
+
+# Starts an NF in the background, pinned to its cores in NF_CPUSET ("amf=2 smf=3-4") if any: start_nf <nf> [args]
+start_nf() {
+    local nf=$1
+    shift
+    local cpus=$(echo " $NF_CPUSET " | grep -o " $nf=[^ ]*" | cut -d= -f2)
+    if [ -n "$cpus" ]; then
+        taskset -c $cpus ./install/bin/open5gs-${nf}d "$@" &
+    else
+        ./install/bin/open5gs-${nf}d "$@" &
+    fi
+}
+
+# MongoDB, WebUI and the traffic receiver survive a warm reset (topo.py --warm), only the NFs are started again
+if ! pgrep -x mongod > /dev/null; then
+    mongod --smallfiles --dbpath /var/lib/mongodb --logpath /open5gs/install/var/log/open5gs/mongodb.log --logRotate reopen --logappend &
+fi
+
+# With UPF_REMOTE=1 (topo.py --upfs) the user plane and its traffic receiver run on UPF hosts (start_upf.sh)
+if [ "$UPF_REMOTE" != "1" ]; then
+    if ! grep "ogstun" /proc/net/dev > /dev/null; then
+        ip tuntap add name ogstun mode tun
+        ip addr add 10.45.0.1/16 dev ogstun
+        ip link set ogstun up
+        iptables -t nat -A POSTROUTING -s 10.45.0.1/16 ! -o ogstun -j MASQUERADE
+    fi
+
+    # Receiver for the ssmm.py/fleet.py traffic, TRAFFIC_SERVER=iperf3 starts iperf3 -s instead,
+    # TRAFFIC_LOG=1 logs every received packet to traffic.ndjson next to the NF logs
+    if ! pgrep -f "[i]perf3 -s|[t]rafficgen.py" > /dev/null; then
+        if [ "$TRAFFIC_SERVER" = "iperf3" ] || [ ! -f /traffic/trafficgen.py ]; then
+            iperf3 -s -D -B 10.45.0.1
+        else
+            python3 /traffic/trafficgen.py -B 10.45.0.1 ${TRAFFIC_LOG:+-o /open5gs/install/var/log/open5gs/traffic.ndjson} > /dev/null &
+        fi
+    fi
+fi
+
+# With NF_CONTAINERS=1 (topo.py --nf-containers) topo.py starts every NF in a container of its own
+if [ "$NF_CONTAINERS" = "1" ]; then
+    wait_for_port mongodb 127.0.0.1 27017 || exit 1
+    if ! pgrep -f "[n]pm run dev" > /dev/null; then
+        (cd /open5gs/webui && npm run dev) &
+    fi
+    boot_phase started $BOOT_START
+    exit 0
+fi
+
+# The UPF depends on nothing but ogstun, the SBI NFs on the NRF and udr, pcf and bsf also on MongoDB
+if [ "$UPF_REMOTE" != "1" ]; then
+    start_nf upf
+    MAIN_PID=$!
+fi
+start_nf nrf
+
+wait_for_port nrf 127.0.0.10 7777 || exit 1
+# SMF_CONFIG points the SMF to the UPF hosts
+start_nf smf ${SMF_CONFIG:+-c $SMF_CONFIG}
+MAIN_PID=${MAIN_PID:-$!}
+start_nf amf
+start_nf ausf
+start_nf udm
+start_nf nssf
+
+wait_for_port mongodb 127.0.0.1 27017 || exit 1
+if ! pgrep -f "[n]pm run dev" > /dev/null; then
+    (cd /open5gs/webui && npm run dev) &
 fi
+start_nf udr
+start_nf pcf
+start_nf bsf
+boot_phase started $BOOT_START
 
-iperf3 -s -D -B 10.45.0.1
-
-./install/bin/open5gs-nrfd & 
-sleep 3
-./install/bin/open5gs-smfd &
-./install/bin/open5gs-amfd & 
-./install/bin/open5gs-ausfd &
-./install/bin/open5gs-udmd &
-./install/bin/open5gs-udrd &
-./install/bin/open5gs-pcfd &
-./install/bin/open5gs-bsfd &
-./install/bin/open5gs-nssfd &
-./install/bin/open5gs-upfd
+# Runs as long as the UPF (or the SMF without a local UPF), a warm reset stops it with the NFs
+wait $MAIN_PID
@@ -0,0 +1,24 @@
+#!/bin/bash
+
+# UPF on a host of its own (topo.py --upfs): start_upf.sh <upf config> <name>
+UPF_CONFIG=${1:-/open5gs/install/etc/open5gs/upf.yaml}
+NAME=${2:-upf}
+
+if ! grep "ogstun" /proc/net/dev > /dev/null; then
+    ip tuntap add name ogstun mode tun
+    ip addr add 10.45.0.1/16 dev ogstun
+    ip link set ogstun up
+    iptables -t nat -A POSTROUTING -s 10.45.0.1/16 ! -o ogstun -j MASQUERADE
+fi
+
+# Receiver for the ssmm.py/fleet.py traffic, the user plane ends here and no longer in the 5GC container,
+# TRAFFIC_LOG=1 logs every received packet to traffic-<name>.ndjson
+if ! pgrep -f "[i]perf3 -s|[t]rafficgen.py" > /dev/null; then
+    if [ "$TRAFFIC_SERVER" = "iperf3" ] || [ ! -f /traffic/trafficgen.py ]; then
+        iperf3 -s -D -B 10.45.0.1
+    else
+        python3 /traffic/trafficgen.py -B 10.45.0.1 ${TRAFFIC_LOG:+-o /open5gs/install/var/log/open5gs/traffic-$NAME.ndjson} > /dev/null &
+    fi
+fi
+
+./install/bin/open5gs-upfd -c $UPF_CONFIG
@@ -2,12 +2,19 @@
 # -*- coding: utf-8 -*-
 
 """
-About: Simple networkwork topology with one host running the 5GC (Cp and UP),
-another host is running the GNB, and the last one the UE.
+About: Simple networkwork topology with one host running the 5GC (Cp and, unless
+UPF hosts are added behind a switch of their own, UP), a number of hosts running a GNB each, and behind every GNB a host running its UEs.
 """
 
-import time
 import argparse
+import os
+import shlex
+import time
+
+import boot
+import configgen
+import isolation
+import warm
 
 from comnetsemu.cli import CLI, spawnXtermDocker
 from comnetsemu.net import Containernet, VNFManager
@@ -16,6 +23,12 @@ from mininet.log import error, info, setLogLevel
 from mininet.link import TCLink
 from mininet.node import Controller
 
+# Links that can be shaped separately: core to s1, UE and gNB hosts to their switch, access switches to s1,
+# UPF hosts to s2 and s1 to s2
+g_link_kinds = ("core", "gnb", "ue", "trunk", "upf", "s1-s2")
+# Subdirectory of the log directory for the gNB and UE output
+g_ran_log_dir = "ran"
+
 def spawnTmuxWindow(dcontainer_name: str, cmd: str = None):
     """Spawn the xterm and attach to a Docker container with docker exec -it
         container. Bash is used as the interactive shell.
@@ -55,184 +68,301 @@ def spawnWindow(dcontainer_name: str, cmd: str = None):
             warn("*** spawnWindow with cmd is not supported for xterm window")
         spawnXtermDocker(dcontainer_name)
 
-def getTopo(interactive):
+def coreVolumes(bind_dir, parent_dir):
+    """Volumes of the 5GC host, also mounted into the NF containers."""
+    return {
+        parent_dir + "/open5gs/open5gs/src": {
+            "bind": "/open5gs/src",
+            "mode": "rw",
+        },
+        parent_dir + "/open5gs/open5gs/lib": {
+            "bind": "/open5gs/lib",
+            "mode": "rw",
+        },
+        bind_dir + "/log" : {
+            "bind": "/open5gs/install/var/log/open5gs",
+            "mode": "rw",
+        },
+        bind_dir + "/mongodbdata": {
+            "bind": "/var/lib/mongodb",
+            "mode": "rw",
+        },
+        parent_dir + "/open5gs/config": {
+            "bind": "/open5gs/install/etc/open5gs",
+            "mode": "rw",
+        },
+        parent_dir + "/traffic": {
+            "bind": "/traffic",
+            "mode": "ro",
+        },
+        "/etc/timezone": {
+            "bind": "/etc/timezone",
+            "mode": "ro",
+        },
+        "/etc/localtime": {
+            "bind": "/etc/localtime",
+            "mode": "ro",
+        },
+    }
+
+def addCore(net, bind_dir, parent_dir, resources):
+    return net.addDockerHost("5gc",
+                            dimage="open5gs",
+                            ip=f"{configgen.g_core_ip}/{configgen.g_subnet_prefix}",
+                            docker_args={
+                                "ports": { "3000/tcp": 3000 },
+                                "volumes": coreVolumes(bind_dir, parent_dir),
+                                "cap_add": ["NET_ADMIN"],
+                                "sysctls": {"net.ipv4.ip_forward": 1},
+                                "devices": "/dev/net/tun:/dev/net/tun:rwm",
+                                **isolation.docker_args(resources),
+                            })
+
+def addUpf(net, name, ip, bind_dir, parent_dir, resources):
+    return net.addDockerHost(name,
+                            dimage="open5gs",
+                            ip=f"{ip}/{configgen.g_subnet_prefix}",
+                            docker_args={
+                                "volumes": {
+                                    bind_dir + "/log" : {
+                                        "bind": "/open5gs/install/var/log/open5gs",
+                                        "mode": "rw",
+                                    },
+                                    parent_dir + "/open5gs/config": {
+                                        "bind": "/open5gs/install/etc/open5gs",
+                                        "mode": "rw",
+                                    },
+                                    parent_dir + "/traffic": {
+                                        "bind": "/traffic",
+                                        "mode": "ro",
+                                    },
+                                    "/etc/timezone": {
+                                        "bind": "/etc/timezone",
+                                        "mode": "ro",
+                                    },
+                                    "/etc/localtime": {
+                                        "bind": "/etc/localtime",
+                                        "mode": "ro",
+                                    },
+                                },
+                                "cap_add": ["NET_ADMIN"],
+                                "sysctls": {"net.ipv4.ip_forward": 1},
+                                "devices": "/dev/net/tun:/dev/net/tun:rwm",
+                                **isolation.docker_args(resources),
+                            })
+
+def addRanHost(net, name, ip, bind_dir, parent_dir, resources, traffic=False):
+    """gNB or UE host, both run the ueransim image with the configs under /mnt/ueransim."""
+    volumes = {
+        parent_dir + "/ueransim/config": {
+            "bind": "/mnt/ueransim",
+            "mode": "rw",
+        },
+        bind_dir + "/log": {
+            "bind": "/mnt/log",
+            "mode": "rw",
+        },
+        "/etc/timezone": {
+            "bind": "/etc/timezone",
+            "mode": "ro",
+        },
+        "/etc/localtime": {
+            "bind": "/etc/localtime",
+            "mode": "ro",
+        },
+        "/dev": {"bind": "/dev", "mode": "rw"},
+    }
+    if traffic:
+        volumes[parent_dir + "/traffic"] = {
+            "bind": "/traffic",
+            "mode:": "rw",
+        }
+
+    return net.addDockerHost(name,
+                            dimage="ueransim",
+                            ip=f"{ip}/{configgen.g_subnet_prefix}",
+                            docker_args={
+                                "volumes": volumes,
+                                "cap_add": ["NET_ADMIN"],
+                                "devices": "/dev/net/tun:/dev/net/tun:rwm",
+                                **isolation.docker_args(resources),
+                            })
+
+def addRanSwitches(net, conf, s1):
+    """Switch of every gNB/UE pair.
+
+    As long as the core and all RAN hosts fit on fanout ports everything
+    hangs off s1, otherwise access switches s3, s4, ... with fanout ports
+    each (a gNB and its UE host stay on the same one) are trunked to s1.
+    """
+    num_gnbs = conf["gnbs"]
+    if 2 * num_gnbs + 1 <= conf["fanout"]:
+        return [s1] * num_gnbs
+
+    pairs_per_switch = max(conf["fanout"] // 2, 1)
+    switches = list()
+    for k in range(0, num_gnbs, pairs_per_switch):
+        name = f"s{3 + len(switches)}"
+        switch = net.addSwitch(name)
+        net.addLink(switch, s1, intfName1=f"{name}-s1", intfName2=f"s1-{name}", **conf["links"]["trunk"])
+        switches.append(switch)
+
+    return [switches[i // pairs_per_switch] for i in range(num_gnbs)]
+
+def bootRun(timer, core, upfs, gnbs, ues, nodes, upf_nodes, nf_containers, conf, log_dir):
+    """Start core and UPFs, gNBs and UEs, each step once the one before is ready."""
+    info("*** booting 5G core\n")
+    # Probes take the current end of the logs, so they are created before the components start
+    probes = {nf: boot.LogProbe(f"{log_dir}/{nf}.log", boot.g_nrf_registered) for nf in boot.g_nrf_nfs}
+    probes["upf"] = boot.LogProbe(f"{log_dir}/smf.log", boot.g_pfcp_associated, count=max(len(upfs), 1))
+    traffic_log = "TRAFFIC_LOG=1 " if conf["traffic_log"] else ""
+    for upf, node in zip(upfs, upf_nodes):
+        upf.sendCmd(f"{traffic_log}./install/etc/open5gs/start_upf.sh /open5gs/install/etc/open5gs/{node['upf_config']} {node['upf']}")
+
+    env = dict()
+    if conf["traffic_log"]:
+        env["TRAFFIC_LOG"] = 1
+    if upfs:
+        env["UPF_REMOTE"] = 1
+        env["SMF_CONFIG"] = f"/open5gs/install/etc/open5gs/{conf['smf_config']}"
+    if nf_containers is not None:
+        env["NF_CONTAINERS"] = 1
+    elif isolation.nf_cpuset(conf["layout"], conf["nfs"]):
+        env["NF_CPUSET"] = isolation.nf_cpuset(conf["layout"], conf["nfs"])
+    core.sendCmd(" ".join([f"{key}={shlex.quote(str(value))}" for key, value in env.items()] + ["./install/etc/open5gs/start_open5gs.sh"]))
+
+    if nf_containers is not None:
+        # start_open5gs.sh returns once MongoDB is up, the NFs are started from here
+        core.waitOutput()
+        nf_args = {"smf": ["-c", env["SMF_CONFIG"]]} if upfs else dict()
+        nf_containers.boot(timer, conf["nfs"], nf_args, conf["boot_timeout"])
+    timer.wait("core", probes, conf["boot_timeout"])
+
+    info("*** starting gNBs\n")
+    # The RAN logs go to a subdirectory, the log parser takes every *.log of the log directory for an NF log
+    os.makedirs(f"{log_dir}/{g_ran_log_dir}", exist_ok=True)
+    probes = {node["gnb"]: boot.LogProbe(f"{log_dir}/{g_ran_log_dir}/{node['gnb']}.log", boot.g_ng_setup) for node in nodes}
+    for gnb, node in zip(gnbs, nodes):
+        gnb.sendCmd(f"./nr-gnb -c /mnt/ueransim/{node['gnb_config']} 2>&1 | tee /mnt/log/{g_ran_log_dir}/{node['gnb']}.log")
+    timer.wait("gnb", probes, conf["boot_timeout"])
+
+    info("*** connecting UEs\n")
+    for ue, node in zip(ues, nodes):
+        ue.sendCmd(f"./nr-ue -c /mnt/ueransim/{node['ue_config']} -n {conf['ues_per_gnb']} 2>&1 | tee /mnt/log/{g_ran_log_dir}/{node['ue']}.log")
+    timer.wait("ue", {node["ue"]: boot.interface_probe(node["ue"], "uesimtun", conf["ues_per_gnb"]) for node in nodes},
+               conf["boot_timeout"])
+
+def getTopo(interactive, conf):
     bind_dir = "/home/vagrant"
     parent_dir = "/home/vagrant/comnetsemu/comnetsemu_open5gs"
 
+    # Per-node UERANSIM configs, mounted at /mnt/ueransim/generated
+    nodes = configgen.render_ran(parent_dir + "/ueransim/config", conf["gnbs"], conf["ues_per_gnb"])
+    # SMF and UPF configs for UPFs on hosts of their own, mounted at /open5gs/install/etc/open5gs/generated
+    upf_nodes = list()
+    if conf["upfs"]:
+        conf["smf_config"], upf_nodes = configgen.render_core(parent_dir + "/open5gs/config", conf["upfs"])
+
+    # The UPF host takes the place of the UPF NF as a target
+    conf["nfs"] = tuple(nf for nf in isolation.g_nfs if not (upf_nodes and nf == "upf"))
+    host_names = ["5gc"] + [node["upf"] for node in upf_nodes] + [node[kind] for node in nodes for kind in ("gnb", "ue")]
+    layout = conf["layout"] = isolation.resolve(conf["resources"], conf["nfs"], conf["nf_cores"])
+    isolation.check(layout, host_names, conf["nfs"], conf["nf_containers"])
+    isolation.write_layout(bind_dir + "/log/layout.json", layout, conf["nf_containers"], upfs=conf["upfs"], gnbs=conf["gnbs"],
+                           ues_per_gnb=conf["ues_per_gnb"])
+
     net = Containernet(controller=Controller, link=TCLink)
+    nf_containers = None
 
     try:
         info("*** adding 5GC\n")
-        core = net.addDockerHost("5gc",
-                                dimage="open5gs",
-                                ip="192.168.0.111/24",
-                                docker_args={
-                                    "ports": { "3000/tcp": 3000 },
-                                    "volumes": {
-                                        parent_dir + "/open5gs/open5gs/src": {
-                                            "bind": "/open5gs/src",
-                                            "mode": "rw",
-                                        },
-                                        parent_dir + "/open5gs/open5gs/lib": {
-                                            "bind": "/open5gs/lib",
-                                            "mode": "rw",
-                                        },
-                                        bind_dir + "/log" : {
-                                            "bind": "/open5gs/install/var/log/open5gs",
-                                            "mode": "rw",
-                                        },
-                                        bind_dir + "/mongodbdata": {
-                                            "bind": "/var/lib/mongodb",
-                                            "mode": "rw",
-                                        },
-                                        parent_dir + "/open5gs/config": {
-                                            "bind": "/open5gs/install/etc/open5gs",
-                                            "mode": "rw",
-                                        },
-                                        "/etc/timezone": {
-                                            "bind": "/etc/timezone",
-                                            "mode": "ro",
-                                        },
-                                        "/etc/localtime": {
-                                            "bind": "/etc/localtime",
-                                            "mode": "ro",
-                                        },
-                                    },
-                                    "cap_add": ["NET_ADMIN"],
-                                    "sysctls": {"net.ipv4.ip_forward": 1},
-                                    "devices": "/dev/net/tun:/dev/net/tun:rwm"
-                                })
-
-        # info("*** adding UPF\n")
-        # upf = net.addDockerHost("upf",
-                                # dimage="open5gs",
-                                # ip="192.168.0.112/24",
-                                # docker_args={
-                                    # "volumes": {
-                                        # bind_dir + "/log" : {
-                                            # "bind": "/open5gs/install/var/log/open5gs",
-                                            # "mode": "rw",
-                                        # },
-                                        # parent_dir + "/open5gs/config": {
-                                            # "bind": "/open5gs/install/etc/open5gs",
-                                            # "mode": "rw",
-                                        # },
-                                        # "/etc/timezone": {
-                                            # "bind": "/etc/timezone",
-                                            # "mode": "ro",
-                                        # },
-                                        # "/etc/localtime": {
-                                            # "bind": "/etc/localtime",
-                                            # "mode": "ro",
-                                        # },
-                                    # },
-                                    # "cap_add": ["NET_ADMIN"],
-                                    # "sysctls": {"net.ipv4.ip_forward": 1},
-                                    # "devices": "/dev/net/tun:/dev/net/tun:rwm"
-                                # })
-
-        info("*** adding gNB\n")
-        gnb = net.addDockerHost("gnb",
-                                dimage="ueransim",
-                                ip="192.168.0.131/24",
-                                docker_args={
-                                    "volumes": {
-                                        parent_dir + "/ueransim/config": {
-                                            "bind": "/mnt/ueransim",
-                                            "mode": "rw",
-                                        },
-                                        bind_dir + "/log": {
-                                            "bind": "/mnt/log",
-                                            "mode": "rw",
-                                        },
-                                        "/etc/timezone": {
-                                            "bind": "/etc/timezone",
-                                            "mode": "ro",
-                                        },
-                                        "/etc/localtime": {
-                                            "bind": "/etc/localtime",
-                                            "mode": "ro",
-                                        },
-                                        "/dev": {"bind": "/dev", "mode": "rw"},
-                                    },
-                                    "cap_add": ["NET_ADMIN"],
-                                    "devices": "/dev/net/tun:/dev/net/tun:rwm"
-                                })
-
-        info ("*** adding UE\n")
-        ue = net.addDockerHost("ue",
-                                dimage="ueransim",
-                                ip="192.168.0.132/24",
-                                docker_args={
-                                    "volumes": {
-                                        parent_dir + "/ueransim/config": {
-                                            "bind": "/mnt/ueransim",
-                                            "mode": "rw",
-                                        },
-                                        parent_dir + "/traffic": {
-                                            "bind": "/traffic",
-                                            "mode:": "rw",
-                                        },
-                                        bind_dir + "/log": {
-                                            "bind": "/mnt/log",
-                                            "mode": "rw",
-                                        },
-                                        "/etc/timezone": {
-                                            "bind": "/etc/timezone",
-                                            "mode": "ro",
-                                        },
-                                        "/etc/localtime": {
-                                            "bind": "/etc/localtime",
-                                            "mode": "ro",
-                                        },
-                                        "/dev": {"bind": "/dev", "mode": "rw"},
-                                    },
-                                    "cap_add": ["NET_ADMIN"],
-                                    "devices": "/dev/net/tun:/dev/net/tun:rwm"
-                                })
+        core = addCore(net, bind_dir, parent_dir, layout.get("5gc", dict()))
+        if conf["nf_containers"]:
+            nf_containers = isolation.NfContainers(core.name, layout, coreVolumes(bind_dir, parent_dir))
+            nf_containers.remove()
+
+        upfs = list()
+        for node in upf_nodes:
+            info(f"*** adding UPF {node['upf']}\n")
+            upfs.append(addUpf(net, node["upf"], node["upf_ip"], bind_dir, parent_dir, layout.get(node["upf"], dict())))
+
+        gnbs = list()
+        ues = list()
+        for node in nodes:
+            info(f"*** adding gNB {node['gnb']} (nci {node['nci']})\n")
+            gnbs.append(addRanHost(net, node["gnb"], node["gnb_ip"], bind_dir, parent_dir, layout.get(node["gnb"], dict())))
+
+            info(f"*** adding UE host {node['ue']} (imsi {node['imsi'][0]}-{node['imsi'][1]})\n")
+            ues.append(addRanHost(net, node["ue"], node["ue_ip"], bind_dir, parent_dir, layout.get(node["ue"], dict()),
+                                  traffic=True))
 
         info("*** adding controller\n")
         net.addController("c0")
 
         info("*** adding switches\n")
         s1 = net.addSwitch("s1")
-        # s2 = net.addSwitch("s2")
 
         info("*** adding links\n")
-        # net.addLink(s1, s2,bw=1000, delay="10ms", intfName1="s1-s2", intfName2="s2-s1")
+        net.addLink(core, s1, intfName1="core1-s1", intfName2="s1-core1", **conf["links"]["core"])
 
-        net.addLink(ue, s1, bw=1000, delay="1ms", intfName1="ue1-s1", intfName2="s1-ue1")
-        net.addLink(gnb, s1, bw=1000, delay="1ms", intfName1="gnb1-s1", intfName2="s1-gnb1")
-        net.addLink(core, s1, bw=1000, delay="1ms", intfName1="core1-s1", intfName2="s1-core1")
+        # The user plane has a switch of its own, N3 and N4 traffic crosses the s1-s2 link
+        if upfs:
+            s2 = net.addSwitch("s2")
+            net.addLink(s1, s2, intfName1="s1-s2", intfName2="s2-s1", **conf["links"]["s1-s2"])
+            for i, upf in enumerate(upfs):
+                net.addLink(upf, s2, intfName1=f"upf{i + 1}-s2", intfName2=f"s2-upf{i + 1}", **conf["links"]["upf"])
 
-        # net.addLink(core, s2, bw=1000, delay="1ms", inftName1="core1-s2", intfName2="s2-core1")
-        # net.addLink(upf, s2, bw=1000, delay="1ms", intfName1="upf1-s2", intfName2="s2-upf1")
+        for i, (gnb, ue, switch) in enumerate(zip(gnbs, ues, addRanSwitches(net, conf, s1))):
+            net.addLink(ue, switch, intfName1=f"ue{i + 1}-{switch.name}", intfName2=f"{switch.name}-ue{i + 1}",
+                        **conf["links"]["ue"])
+            net.addLink(gnb, switch, intfName1=f"gnb{i + 1}-{switch.name}", intfName2=f"{switch.name}-gnb{i + 1}",
+                        **conf["links"]["gnb"])
 
         info("*** starting network")
         net.start()
-        net.pingAll()
+        if not conf["no_ping"]:
+            net.pingAll()
 
         if interactive:
+            # One window per container gets out of hand with many gNBs, the others are reachable with docker exec
             spawnWindow("5gc")
-            spawnWindow("gnb")
-            spawnWindow("ue")
+            if upf_nodes:
+                spawnWindow(upf_nodes[0]["upf"])
+            spawnWindow(nodes[0]["gnb"])
+            spawnWindow(nodes[0]["ue"])
 
             CLI(net)
         else:
-            info("*** booting 5G core\n")
-            core.sendCmd("./install/etc/open5gs/start_open5gs.sh")
-            time.sleep(10)
-
-            info("*** starting gNB\n")
-            gnb.sendCmd("./nr-gnb -c /mnt/ueransim/open5gs-gnb.yaml")
-            time.sleep(2)
-
-            info("*** connecting UE\n")
-            ue.sendCmd("./nr-ue -c /mnt/ueransim/open5gs-ue.yaml")
-            # spawnWindow("ue")
-            time.sleep(1)
-
-            input("Emulation setup ready. Press enter to terminate ")
+            log_dir = bind_dir + "/log"
+            run = 0
+            timer = boot.BootTimer()
+            while True:
+                bootRun(timer, core, upfs, gnbs, ues, nodes, upf_nodes, nf_containers, conf, log_dir)
+                info("*** boot times\n" + timer.report())
+                timer.write(f"{log_dir}/boot.ndjson", run=run, warm=conf["warm"], upfs=conf["upfs"], gnbs=conf["gnbs"],
+                            ues_per_gnb=conf["ues_per_gnb"], nf_containers=conf["nf_containers"], layout=layout)
+                timer.close()
+
+                if not conf["warm"]:
+                    input("Emulation setup ready. Press enter to terminate ")
+                    break
+
+                if run == 0:
+                    warm.snapshot_db(core.name)
+                if input("Emulation setup ready. Press enter to reset for the next run, q and enter to terminate ").strip() == "q":
+                    break
+
+                info("*** resetting NFs, gNBs, UEs and database\n")
+                run += 1
+                timer = boot.BootTimer()
+                if nf_containers is not None:
+                    start = time.monotonic()
+                    nf_containers.remove()
+                    timer.record("stop-nfs", start)
+                # UPF hosts only run NFs, so they are stopped like the core
+                running = [(core, "core")] + [(upf, "core") for upf in upfs] + [(gnb, "gnb") for gnb in gnbs] + [(ue, "ue") for ue in ues]
+                logs = warm.g_nf_logs + tuple(node["upf"] for node in upf_nodes) if conf["clear_logs"] else None
+                warm.reset(timer, running, core, log_dir, conf["boot_timeout"], logs)
 
 
     except Exception as e:
@@ -246,6 +376,8 @@ def getTopo(interactive):
 
     finally:
         info("*** stopping network\n")
+        if nf_containers is not None:
+            nf_containers.remove()
         if interactive:
             net.stop()
         cleanup()
@@ -273,9 +405,108 @@ if __name__ == "__main__":
                         type=bool,
                         nargs="?",
                         help="Use tmux instead of xterm")
+    parser.add_argument("--gnbs",
+                        default=1,
+                        type=int,
+                        help=f"number of gNB hosts, each with its own UE host (at most {configgen.g_max_gnbs})")
+    parser.add_argument("--upfs",
+                        default=0,
+                        type=int,
+                        help=f"UPF hosts behind their own switch s2 (at most {configgen.g_max_upfs}), 0 runs the UPF in the 5GC container")
+    parser.add_argument("--ues-per-gnb",
+                        default=1,
+                        type=int,
+                        help="UEs run by the UE host of every gNB, SUPIs are consecutive from the one in open5gs-ue.yaml")
+    parser.add_argument("--fanout",
+                        default=16,
+                        type=int,
+                        help="ports per switch, more hosts are spread over access switches trunked to s1")
+    parser.add_argument("--bw",
+                        default=1000,
+                        type=float,
+                        help="bandwidth of all links [Mbit/s]")
+    parser.add_argument("--delay",
+                        default="1ms",
+                        type=str,
+                        help="delay of all links")
+    parser.add_argument("--link",
+                        nargs=3,
+                        action="append",
+                        default=[],
+                        metavar=("LINK", "BW", "DELAY"),
+                        help=f"bandwidth [Mbit/s] and delay of one kind of link ({', '.join(g_link_kinds)}), may be repeated")
+    parser.add_argument("--boot-timeout",
+                        default=60,
+                        type=float,
+                        help="seconds to wait for the core, gNBs or UEs to get ready before giving up")
+    parser.add_argument("--traffic-log",
+                        action="store_true",
+                        help="log every packet the traffic receiver gets to traffic.ndjson next to the NF logs")
+    parser.add_argument("--warm",
+                        action="store_true",
+                        help="keep the topology up after a run and only reset NFs, gNBs, UEs and the database for the next")
+    parser.add_argument("--clear-logs",
+                        action="store_true",
+                        help="with --warm, truncate the NF logs between runs instead of appending the next run")
+    parser.add_argument("--cpuset",
+                        nargs=2,
+                        action="append",
+                        default=[],
+                        metavar=("TARGET", "CPUS"),
+                        help="pin a container (5gc, upf, gnb, ue2, ...) or an NF (amf, smf, ...) to cores, e.g. 2-3, may be repeated")
+    parser.add_argument("--cpus",
+                        nargs=2,
+                        action="append",
+                        default=[],
+                        metavar=("TARGET", "CPUS"),
+                        help="CPU quota of a container or NF in cores, e.g. 1.5, may be repeated")
+    parser.add_argument("--mem",
+                        nargs=2,
+                        action="append",
+                        default=[],
+                        metavar=("TARGET", "LIMIT"),
+                        help="memory limit of a container or NF, e.g. 512m, may be repeated")
+    parser.add_argument("--nf-containers",
+                        action="store_true",
+                        help="run every NF in a container of its own sharing the 5GC host's network, "
+                             "needed for quota and memory limits of single NFs")
+    parser.add_argument("--nf-cores",
+                        default=None,
+                        type=str,
+                        help="give every NF without a --cpuset a dedicated core of these, e.g. 2-11")
+    parser.add_argument("--no-ping",
+                        action="store_true",
+                        help="skip the pingAll after start, which takes long with many hosts")
 
     args = parser.parse_args()
 
+    links = {kind: {"bw": args.bw, "delay": args.delay} for kind in g_link_kinds}
+    for kind, bw, delay in args.link:
+        if kind not in links:
+            parser.error(f"unknown link {kind}, choose from {', '.join(g_link_kinds)}")
+        links[kind] = {"bw": float(bw), "delay": delay}
+
+    resources = dict()
+    for key, specs, kind in (("cpuset", args.cpuset, str), ("cpus", args.cpus, float), ("mem", args.mem, str)):
+        for target, value in specs:
+            resources.setdefault(target, dict())[key] = kind(value)
+
+    conf = {
+        "upfs": args.upfs,
+        "gnbs": args.gnbs,
+        "ues_per_gnb": args.ues_per_gnb,
+        "fanout": args.fanout,
+        "links": links,
+        "no_ping": args.no_ping,
+        "boot_timeout": args.boot_timeout,
+        "traffic_log": args.traffic_log,
+        "warm": args.warm,
+        "clear_logs": args.clear_logs,
+        "resources": resources,
+        "nf_cores": args.nf_cores,
+        "nf_containers": args.nf_containers,
+    }
+
     if args.d:
         setLogLevel("debug")
     else:
@@ -284,4 +515,4 @@ if __name__ == "__main__":
     global use_tmux
     use_tmux = args.t
 
-    getTopo(args.i)
\ No newline at end of file
+    getTopo(args.i, conf)
\ No newline at end of file
@@ -0,0 +1,182 @@
+import asyncio
+import collections
+import itertools
+import shlex
+import threading
+import time
+
+# Marks the start and end of a command in the output of a session
+g_marker = "__ssmm_control__"
+
+
+class CommandResult:
+    def __init__(self, returncode, output, submitted, started, finished):
+        self.returncode = returncode
+        self.output = output
+        # time from handing the command to the channel until it starts in the shell
+        self.dispatch_latency = started - submitted
+        self.duration = finished - started
+        self.total = finished - submitted
+
+    def latency(self):
+        return {
+            "dispatch": self.dispatch_latency,
+            "duration": self.duration,
+        }
+
+
+class ShellSession:
+    """A long-lived bash in a container (docker exec -i) or on the host.
+
+    Commands are written to the shell's stdin right away and run one after
+    the other, so commands are pipelined without waiting for the previous
+    result. Each command is wrapped in start and end markers which attribute
+    the output and return code to the waiting caller.
+    """
+
+    def __init__(self, container=None):
+        self.container = container
+        self.proc = None
+        self.reader = None
+        self.starting = None
+        self.pending = collections.OrderedDict()
+        self.ids = itertools.count()
+
+    async def start(self):
+        if self.container is None:
+            cmd = ["bash"]
+        else:
+            cmd = ["docker", "exec", "-i", self.container, "bash"]
+
+        self.proc = await asyncio.create_subprocess_exec(*cmd, stdin=asyncio.subprocess.PIPE,
+                                                         stdout=asyncio.subprocess.PIPE,
+                                                         stderr=asyncio.subprocess.STDOUT)
+        self.reader = asyncio.ensure_future(self.read())
+
+    async def ensure_started(self):
+        # concurrent first commands share one start, a dead session is restarted
+        if self.starting is None or (self.starting.done() and not self.alive()):
+            self.starting = asyncio.ensure_future(self.start())
+        await self.starting
+
+    def alive(self):
+        return self.proc is not None and self.proc.returncode is None
+
+    async def read(self):
+        loop = asyncio.get_event_loop()
+        current = None
+        try:
+            while line := await self.proc.stdout.readline():
+                line = line.decode(errors="replace")
+                if not line.startswith(g_marker):
+                    if current is not None:
+                        current["output"].append(line)
+                    continue
+
+                fields = line.split()
+                command = self.pending.get(int(fields[1]))
+                if command is None:
+                    continue
+
+                if fields[2] == "start":
+                    command["started"] = loop.time()
+                    current = command
+                else:
+                    del self.pending[int(fields[1])]
+                    current = None
+                    result = CommandResult(int(fields[3]), "".join(command["output"]), command["submitted"],
+                                           command["started"], loop.time())
+                    if not command["future"].done():
+                        command["future"].set_result(result)
+        finally:
+            for command in self.pending.values():
+                if not command["future"].done():
+                    command["future"].set_exception(ConnectionError(f"control session to {self.container or 'host'} closed"))
+            self.pending.clear()
+
+    async def run(self, cmd, workdir=None):
+        await self.ensure_started()
+
+        loop = asyncio.get_event_loop()
+        command_id = next(self.ids)
+        if workdir is not None:
+            cmd = f"cd {shlex.quote(workdir)} && {cmd}"
+
+        command = {
+            "future": loop.create_future(),
+            "submitted": loop.time(),
+            "started": None,
+            "output": [],
+        }
+        self.pending[command_id] = command
+
+        # subshell so cd and exit don't leak into the session, stdin closed so the command can't eat the next ones
+        self.proc.stdin.write((f"printf '%s %d start\\n' {g_marker} {command_id}\n"
+                               f"( {cmd}\n) </dev/null 2>&1\n"
+                               f"printf '%s %d end %d\\n' {g_marker} {command_id} $?\n").encode())
+        await self.proc.stdin.drain()
+
+        return await command["future"]
+
+    async def close(self):
+        if self.alive():
+            self.proc.stdin.close()
+            await self.proc.wait()
+        if self.reader is not None:
+            await self.reader
+
+
+class ControlChannel:
+    """Pool of shell sessions per container, a command goes to the least busy session."""
+
+    def __init__(self, sessions_per_container=1):
+        self.sessions_per_container = sessions_per_container
+        self.sessions = dict()
+
+    async def run(self, container, cmd, workdir=None):
+        sessions = self.sessions.setdefault(container, [ShellSession(container) for _ in range(self.sessions_per_container)])
+        session = min(sessions, key=lambda s: len(s.pending))
+        return await session.run(cmd, workdir=workdir)
+
+    async def close(self):
+        for sessions in self.sessions.values():
+            for session in sessions:
+                await session.close()
+
+
+class ThreadedControlChannel:
+    """Blocking front end of a ControlChannel, for the synchronous ssmm.py.
+
+    The channel lives on an event loop in a background thread.
+    """
+
+    def __init__(self, sessions_per_container=1):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.channel = ControlChannel(sessions_per_container)
+
+    def run(self, container, cmd, workdir=None):
+        future = asyncio.run_coroutine_threadsafe(self.channel.run(container, cmd, workdir=workdir), self.loop)
+        return future.result()
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.channel.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+if __name__ == "__main__":
+    # Compare the dispatch latency of the persistent session with forking a process per command
+    import subprocess
+
+    channel = ThreadedControlChannel()
+    channel.run(None, "true")
+    latencies = [channel.run(None, "true").total for _ in range(100)]
+    channel.close()
+    print(f"control channel: {sum(latencies) / len(latencies) * 1000:.3f} ms per command")
+
+    start = time.monotonic()
+    for _ in range(100):
+        subprocess.run(["bash", "-c", "true"])
+    print(f"fork per command: {(time.monotonic() - start) / 100 * 1000:.3f} ms per command")
@@ -0,0 +1,66 @@
+import json
+import os
+import queue
+import threading
+
+
+class EventLog:
+    """Append-only NDJSON event log written by a background thread.
+
+    append only hands the record to the writer thread. The writer batches
+    what is queued into a buffered file and flushes whenever the queue runs
+    empty, so a crash or Ctrl+C loses at most the records in flight and the
+    log never has to be held in memory.
+    """
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.records = queue.SimpleQueue()
+        self.file = open(path, "w", buffering=1 << 16)
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def append(self, record):
+        self.records.put(record)
+
+    def write(self):
+        while (record := self.records.get()) is not None:
+            self.file.write(json.dumps(record) + "\n")
+            if self.records.empty():
+                self.flush()
+
+        self.flush()
+        self.file.close()
+
+    def flush(self):
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        self.records.put(None)
+        self.thread.join()
+
+
+def read_events(path):
+    """Yield the events of a NDJSON event log one by one.
+
+    Event logs of older runs (one JSON list) are read as a whole. A record
+    cut off by a crash at the end of the log is skipped.
+    """
+    with open(path, "r") as fin:
+        first = fin.read(1)
+        fin.seek(0)
+        if first == "[":
+            yield from json.load(fin)
+            return
+
+        for line in fin:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith("\n"):
+                    raise
@@ -0,0 +1,598 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import random
+import re
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import control
+import eventlog
+import loadprofile
+import schedule
+import ssmm
+import trafficgen
+import trajectory
+
+def parse_ps_list(output):
+    """PSI -> address of the sessions in the output of nr-cli ps-list."""
+    sessions = dict()
+    psi = None
+    for line in output.splitlines():
+        if m := re.match(r"PDU Session(\d+):", line):
+            psi = int(m.group(1))
+        elif psi is not None and (m := re.match(r"\s+address:\s*(\S+)", line)):
+            sessions[psi] = m.group(1)
+    return sessions
+
+
+class UE:
+    """State of one simulated MTC UE: its Markov chain, PU timer and deadline statistics."""
+
+    def __init__(self, index, conf, seed):
+        self.index = index
+        # UERANSIM numbers the UEs of one nr-ue process from 1 in the order of their IMSIs
+        self.ue_id = index + 1
+        self.imsi = f"imsi-{conf['imsi_base'] + index:015d}"
+        # Whether the UE has a PDU session, it comes up with the one of its config
+        self.session = True
+        # PSI and address of the PDU session, from nr-cli ps-list once needed
+        self.psi = None
+        self.tun_ip = None
+        self.sender = None
+        self.rng = random.Random(seed)
+        self.registered = True
+        self.state = 0
+        self.next_state = None
+        self.iteration = 0
+        self.next_pu = None
+        self.dispatch_ns = None
+        # Set while a state or a load profile operation runs on the UE
+        self.busy = False
+        # States skipped because a load profile operation was running on the UE
+        self.skipped = 0
+        # Spread the PU timers, otherwise all UEs update at the same instant
+        self.first_pu = (self.rng.uniform(0, 1) if conf["stagger"] else 1.0) * conf["sojourn_time_pu"]
+
+        self.deadlines = 0
+        self.missed = 0
+        self.missed_pu = 0
+        self.lateness_sum = 0.0
+        self.lateness_max = 0.0
+
+    def record_lateness(self, lateness, tolerance):
+        self.deadlines += 1
+        self.lateness_sum += max(lateness, 0.0)
+        self.lateness_max = max(self.lateness_max, lateness)
+        if lateness > tolerance:
+            self.missed += 1
+
+    def stats(self):
+        return {
+            "ue": self.imsi,
+            "iterations": self.iteration,
+            "deadlines": self.deadlines,
+            "missed": self.missed,
+            "missed_pu": self.missed_pu,
+            "skipped": self.skipped,
+            "mean_lateness": self.lateness_sum / self.deadlines if self.deadlines else 0.0,
+            "max_lateness": self.lateness_max,
+        }
+
+
+class Fleet:
+    """Runs the ssmm state machine of many UEs on one asyncio event loop.
+
+    Every UE sleeps until the deadline of its next state (the next PU, or the
+    exponential ED sojourn). The deadlines of all UEs are kept in one timer
+    heap, the loop wakes up for the earliest one and starts the state's action
+    as a task, so slow registrations or transmissions of one UE never delay
+    the timers of the others.
+    """
+
+    def __init__(self, P, conf, event_log, replay_schedule=None):
+        self.P = P
+        self.conf = conf
+        self.event_log = event_log
+        self.timers = list()
+        self.sequence = itertools.count()
+        self.active = set()
+        self.ues = [UE(i, conf, conf["seed"] + i) for i in range(conf["num_ues"])]
+        # States, ED sojourns and IMIX lengths of all UEs, sampled up front or taken from a schedule
+        self.replay_schedule = replay_schedule
+        if replay_schedule is not None:
+            self.trajectories = replay_schedule.trajectories
+        else:
+            self.trajectories = trajectory.sample_trajectories(P, conf["num_ues"], conf["num_it"], conf["lam_ed"], conf["seed"])
+        self.control = None if conf["fork"] else control.ControlChannel(conf["sessions"])
+
+    def log_event(self, ue, event, bytes, latency=None, packets=None, error=None):
+        mono_ns = time.monotonic_ns()
+        event_data = {
+            "event": event,
+            "ts": time.time(),
+            "mono_ns": mono_ns,
+            "bytes": bytes,
+            "ue": ue.imsi,
+            # Harness latency from dispatching the state until its event [s]
+            "dispatch_ns": ue.dispatch_ns,
+            "harness_latency": (mono_ns - ue.dispatch_ns) / 1e9,
+        }
+        # Harness overhead of the commands behind the event [s]
+        if latency is not None:
+            event_data["latency"] = latency
+        # Send timestamps of the packets of the native traffic generator
+        if packets is not None:
+            event_data["packets"] = packets
+        if error is not None:
+            event_data["error"] = error
+
+        self.event_log.append(event_data)
+
+    def schedule(self, deadline, ue):
+        heapq.heappush(self.timers, (deadline, next(self.sequence), ue))
+        self.wakeup.set()
+
+    def plan(self, ue):
+        loop = asyncio.get_event_loop()
+        ue.next_state = int(self.trajectories.states[ue.index, ue.iteration])
+        now = loop.time()
+        # An ED clipped to the next PU ends just after the PU's deadline, only a PU later than the tolerance is missed
+        missed = now - self.conf["deadline_tolerance"]
+
+        if self.replay_schedule is not None:
+            deadline = self.start + float(self.replay_schedule.offsets[ue.index, ue.iteration])
+            if ue.next_state == 1 and deadline < missed:
+                ue.missed_pu += 1
+                print(f"{ue.imsi}: missed pu by {now - deadline} seconds")
+        elif ue.next_state == 1:
+            deadline = ue.next_pu
+            if deadline < missed:
+                ue.missed_pu += 1
+                print(f"{ue.imsi}: missed pu by {now - deadline} seconds")
+            ue.next_pu += self.conf["sojourn_time_pu"]
+        elif ue.next_state == 2:
+            # Don't miss an entire PU because of an ED
+            sojourn_ed = min(float(self.trajectories.sojourn_ed[ue.index, ue.iteration]), ue.next_pu - now)
+            deadline = now + max(sojourn_ed, 0.0)
+        else:
+            deadline = now
+
+        self.schedule(deadline, ue)
+
+    def rate(self, ue, key):
+        if self.replay_schedule is not None:
+            return int(self.replay_schedule.rates[ue.index, ue.iteration])
+        return self.conf[key]
+
+    def compile(self):
+        """Compile the workload of the fleet into a schedule."""
+        return schedule.compile_schedule(self.trajectories, self.conf, [ue.first_pu for ue in self.ues])
+
+    async def run_command(self, container, cmd, workdir=None, capture=False):
+        """Run a shell command in a container, returns its dispatch latency, duration and return code.
+
+        With capture the command's output is returned as well.
+        """
+        if self.control is not None:
+            result = await self.control.run(container, cmd, workdir=workdir)
+            latency = dict(result.latency(), returncode=result.returncode)
+            return (latency, result.output) if capture else latency
+
+        args = ["docker", "exec"] + (["-w", workdir] if workdir is not None else []) + [container, "/bin/bash", "-c", cmd]
+        start = time.monotonic()
+        if capture:
+            proc = await asyncio.create_subprocess_exec(*args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+            output = (await proc.communicate())[0].decode(errors="replace")
+        else:
+            proc = await asyncio.create_subprocess_exec(*args)
+            await proc.wait()
+        latency = {
+            "dispatch": None,
+            "duration": time.monotonic() - start,
+            "returncode": proc.returncode,
+        }
+        return (latency, output) if capture else latency
+
+    async def establish_command(self, ue):
+        cmd = f"./nr-cli {ue.imsi} --exec 'ps-establish IPv4 --sst 1 --sd 1 --dnn internet'"
+        return await self.run_command("ue", cmd, workdir="/UERANSIM/build")
+
+    async def release_command(self, ue):
+        cmd = f"./nr-cli {shlex.quote(self.conf['gnb_name'])} -e 'ue-release {ue.ue_id}'"
+        return await self.run_command("gnb", cmd, workdir="/UERANSIM/build")
+
+    async def ps_release_command(self, ue):
+        if ue.psi is None and not self.conf["dry_run"]:
+            await self.get_tun_ip(ue)
+        cmd = f"./nr-cli {ue.imsi} -e 'ps-release {ue.psi}'"
+        return await self.run_command("ue", cmd, workdir="/UERANSIM/build")
+
+    def session_closed(self, ue):
+        """Forget the UE's PDU session, its address and the sender bound to it."""
+        ue.session = False
+        ue.psi = None
+        ue.tun_ip = None
+        if ue.sender is not None:
+            ue.sender.close()
+            ue.sender = None
+
+    async def sessions(self, ue):
+        """PDU sessions of the UE with an address, PSI -> address."""
+        _, output = await self.run_command("ue", f"./nr-cli {ue.imsi} -e ps-list", workdir="/UERANSIM/build", capture=True)
+        return parse_ps_list(output)
+
+    async def get_tun_ip(self, ue):
+        # UERANSIM numbers the tun interfaces in the order the sessions come up, so the address is asked for by IMSI
+        while ue.tun_ip is None:
+            sessions = await self.sessions(ue)
+            if sessions:
+                ue.psi = min(sessions)
+                ue.tun_ip = sessions[ue.psi]
+                print(f"{ue.imsi}: PDU session {ue.psi} is up at {ue.tun_ip}")
+            else:
+                await asyncio.sleep(1)
+
+        return ue.tun_ip
+
+    async def transmit(self, ue, transmit_rate, transmit_bytes):
+        """Send transmit_bytes from the UE, returns the harness latency and the packet send timestamps."""
+        if self.conf["dry_run"]:
+            return None, None
+        if not ue.session:
+            # Released by a ps-release load profile and not established again yet
+            self.log_event(ue, "send-error", transmit_bytes, error="no PDU session")
+            return None, None
+
+        tun_ip = await self.get_tun_ip(ue)
+        if self.conf["iperf"]:
+            cmd = f"iperf3 -c {self.conf['server_addr']} -B {tun_ip} -n {transmit_bytes} -b {transmit_rate}"
+            return await self.run_command("ue", cmd), None
+
+        if ue.sender is None:
+            ue.sender = trafficgen.TrafficSender(tun_ip, self.conf["server_addr"], self.conf["server_port"], self.conf["protocol"])
+
+        # The sender paces with sleeps, keep it off the event loop
+        start = time.monotonic()
+        try:
+            timestamps = await asyncio.get_event_loop().run_in_executor(self.senders, ue.sender.send, transmit_bytes, transmit_rate)
+        except OSError as e:
+            # E.g. ECONNREFUSED while the receiver restarts, the sender connects again on the next burst
+            print(f"{ue.imsi}: sending {transmit_bytes} bytes failed: {e}")
+            ue.sender.close()
+            self.log_event(ue, "send-error", transmit_bytes, error=str(e))
+            return None, None
+        return {"dispatch": None, "duration": time.monotonic() - start}, timestamps
+
+    async def off(self, ue):
+        latency = None
+        if not self.conf["dry_run"] and ue.registered:
+            latency = await self.release_command(ue)
+            ue.registered = False
+
+        self.log_event(ue, "off", None, latency)
+
+    async def periodic_update(self, ue):
+        ue.registered = True
+        bursts = self.trajectories.bursts(ue.index, ue.iteration)
+        transmit_bytes = int(bursts[0]) if len(bursts) else self.conf["bytes_pu"]
+        latency, packets = await self.transmit(ue, self.rate(ue, "rate_pu"), transmit_bytes)
+        self.log_event(ue, "pu", transmit_bytes, latency, packets)
+
+    async def event_driven(self, ue):
+        ue.registered = True
+        transmit_bytes = int(self.trajectories.bursts(ue.index, ue.iteration)[0])
+        latency, packets = await self.transmit(ue, self.rate(ue, "rate_ed"), transmit_bytes)
+        self.log_event(ue, "ed", transmit_bytes, latency, packets)
+
+    async def payload_exchange(self, ue):
+        ue.registered = True
+        transmit_bytes_list = list()
+        latency_list = list()
+        packets_list = list()
+        for transmit_bytes in self.trajectories.bursts(ue.index, ue.iteration).tolist():
+            transmit_bytes_list.append(transmit_bytes)
+            latency, packets = await self.transmit(ue, self.rate(ue, "rate_pe"), transmit_bytes)
+            latency_list.append(latency)
+            packets_list.append(packets)
+
+        if self.conf["dry_run"]:
+            self.log_event(ue, "pe", transmit_bytes_list)
+        else:
+            self.log_event(ue, "pe", transmit_bytes_list, latency_list, None if self.conf["iperf"] else packets_list)
+
+    async def step(self, ue):
+        try:
+            # A load profile operation owns the UE, skip the action but keep the timers going
+            if not ue.busy:
+                ue.busy = True
+                try:
+                    async with self.inflight:
+                        ue.dispatch_ns = time.monotonic_ns()
+                        await self.state_table[ue.next_state](ue)
+                finally:
+                    ue.busy = False
+            else:
+                ue.skipped += 1
+
+            ue.state = ue.next_state
+            ue.iteration += 1
+            if ue.iteration < self.conf["num_it"]:
+                self.plan(ue)
+            elif ue.registered and not ue.busy:
+                ue.busy = True
+                try:
+                    async with self.inflight:
+                        ue.dispatch_ns = time.monotonic_ns()
+                        await self.off(ue)
+                finally:
+                    ue.busy = False
+        except Exception as e:
+            print(f"{ue.imsi}: state {schedule.g_state_names[ue.next_state]} failed: {e}")
+
+    def step_done(self, task):
+        self.active.discard(task)
+        self.wakeup.set()
+
+    async def run(self, load=None):
+        """Run the state machines of all UEs, and the load profiles of load (a loadprofile.LoadController) on top."""
+        loop = asyncio.get_event_loop()
+        self.wakeup = asyncio.Event()
+        self.inflight = asyncio.Semaphore(self.conf["max_inflight"])
+        # Every running action may be sending, the default executor has only a few threads per core
+        self.senders = ThreadPoolExecutor(max_workers=self.conf["max_inflight"])
+        self.state_table = {
+            0: self.off,
+            1: self.periodic_update,
+            2: self.event_driven,
+            3: self.payload_exchange,
+        }
+
+        self.start = loop.time()
+        if self.conf["num_it"] > 0:
+            for ue in self.ues:
+                ue.next_pu = self.start + ue.first_pu
+                self.plan(ue)
+
+        try:
+            if load is not None:
+                await asyncio.gather(self.run_states(), load.run(self))
+            else:
+                await self.run_states()
+        finally:
+            self.senders.shutdown()
+
+        if self.control is not None:
+            await self.control.close()
+        for ue in self.ues:
+            if ue.sender is not None:
+                ue.sender.close()
+
+    async def run_states(self):
+        loop = asyncio.get_event_loop()
+        while self.timers or self.active:
+            self.wakeup.clear()
+            if not self.timers:
+                await self.wakeup.wait()
+                continue
+
+            timeout = self.timers[0][0] - loop.time()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            deadline, _, ue = heapq.heappop(self.timers)
+            ue.record_lateness(loop.time() - deadline, self.conf["deadline_tolerance"])
+
+            task = asyncio.ensure_future(self.step(ue))
+            self.active.add(task)
+            task.add_done_callback(self.step_done)
+
+    def stats(self):
+        return [ue.stats() for ue in self.ues]
+
+
+def print_stats(stats):
+    print(f"{'ue':<22} {'iterations':>10} {'deadlines':>10} {'missed':>8} {'missed pu':>10} {'mean late [ms]':>15} {'max late [ms]':>14}")
+    for s in stats:
+        print(f"{s['ue']:<22} {s['iterations']:>10} {s['deadlines']:>10} {s['missed']:>8} {s['missed_pu']:>10} "
+              f"{s['mean_lateness'] * 1000:>15.3f} {s['max_lateness'] * 1000:>14.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many ssmm UEs concurrently in one process")
+
+    parser.add_argument("-n",
+                        default=10,
+                        const=10,
+                        nargs="?",
+                        type=int,
+                        help="number of UEs")
+    parser.add_argument("-i",
+                        default=20,
+                        const=20,
+                        nargs="?",
+                        type=int,
+                        help="number of iterations per UE")
+    parser.add_argument("-t_pu",
+                        default=10.0,
+                        const=10.0,
+                        nargs="?",
+                        type=float,
+                        help="sojourn time between PUs [s]")
+    parser.add_argument("-r_pu",
+                        default=10000,
+                        const=10000,
+                        nargs="?",
+                        type=int,
+                        help="rate for PU traffic [bit/s]")
+    parser.add_argument("-r_ed",
+                        default=10000,
+                        const=10000,
+                        nargs="?",
+                        type=int,
+                        help="rate for ED traffic [bit/s]")
+    parser.add_argument("-r_pe",
+                        default=1000000,
+                        const=1000000,
+                        nargs="?",
+                        type=int,
+                        help="rate for PE traffic [bit/s]")
+    parser.add_argument("-b_pu",
+                        default=100,
+                        const=100,
+                        nargs="?",
+                        type=int,
+                        help="number of bytes to tranmit for a peridoc update")
+    parser.add_argument("-l_ed",
+                        default=0.3,
+                        const=0.3,
+                        nargs="?",
+                        type=float,
+                        help="lambda for sojourn time before ED")
+    parser.add_argument("-s",
+                        default="10.45.0.1",
+                        const="10.45.0.1",
+                        nargs="?",
+                        type=str,
+                        help="ipv4 address of the traffic receiver (trafficgen.py or iperf3 server)")
+    parser.add_argument("-p",
+                        default=5201,
+                        type=int,
+                        help="port of the traffic receiver")
+    parser.add_argument("--tcp",
+                        action="store_true",
+                        help="send the native traffic over TCP instead of UDP")
+    parser.add_argument("--iperf",
+                        action="store_true",
+                        help="start an iperf3 client per transmission instead of the native traffic generator")
+    parser.add_argument("--imsi-base",
+                        default=901700000000001,
+                        type=int,
+                        help="IMSI of the first UE, the others follow consecutively (nr-ue -n)")
+    parser.add_argument("--gnb",
+                        default="UERANSIM-gnb-901-70-1",
+                        type=str,
+                        help="node name of the gNB for nr-cli")
+    parser.add_argument("--seed",
+                        default=None,
+                        type=int,
+                        help="seed of the UE trajectories and PU offsets (default: time)")
+    parser.add_argument("--max-inflight",
+                        default=64,
+                        type=int,
+                        help="maximum number of concurrently running UE actions")
+    parser.add_argument("--tolerance",
+                        default=0.01,
+                        type=float,
+                        help="lateness after which a deadline counts as missed [s]")
+    parser.add_argument("--no-stagger",
+                        action="store_true",
+                        help="start the PU timers of all UEs at the same time")
+    parser.add_argument("-o",
+                        default="events_fleet.ndjson",
+                        const="events_fleet.ndjson",
+                        nargs="?",
+                        type=str,
+                        help="path to the event log (NDJSON, written while running)")
+    parser.add_argument("--stats",
+                        default="fleet_stats.json",
+                        type=str,
+                        help="path to the per UE deadline statistics")
+    parser.add_argument("--sessions",
+                        default=4,
+                        type=int,
+                        help="persistent control sessions per container, commands to one container are pipelined over them")
+    parser.add_argument("--fork",
+                        action="store_true",
+                        help="start a docker exec per command instead of using persistent control sessions")
+    parser.add_argument("--export-schedule",
+                        default=None,
+                        type=str,
+                        help="only compile the workload of all UEs into a schedule file (.npz or .ndjson) and exit")
+    parser.add_argument("--replay",
+                        default=None,
+                        type=str,
+                        help="replay a schedule file (-n and -i are taken from it)")
+    parser.add_argument("--profile",
+                        nargs=3,
+                        action="append",
+                        default=[],
+                        metavar=("PROCEDURE", "KIND", "POINTS"),
+                        help="target rate profile of ps-establish or ps-release on top of the state machines, "
+                             "KIND is step, ramp or poisson, POINTS t:rate,t:rate,... in [s] and [1/s], e.g. "
+                             "--profile ps-establish ramp 0:0,300:200 (use -i 0 for the profiles alone)")
+    parser.add_argument("--profile-duration",
+                        default=300.0,
+                        type=float,
+                        help="duration of the load profiles [s]")
+    parser.add_argument("--load-report",
+                        default="fleet_load.json",
+                        type=str,
+                        help="path to the target and achieved operations per second of the load profiles")
+    parser.add_argument("--dry-run",
+                        action='store_true',
+                        help="don't perform registration and transmission")
+    args = parser.parse_args()
+
+    conf = {
+        "num_ues": args.n,
+        "num_it": args.i,
+        "sojourn_time_pu": args.t_pu,
+        "rate_pu": args.r_pu,
+        "rate_ed": args.r_ed,
+        "rate_pe": args.r_pe,
+        "bytes_pu": args.b_pu,
+        "lam_ed": args.l_ed,
+        "server_addr": args.s,
+        "server_port": args.p,
+        "protocol": "tcp" if args.tcp else "udp",
+        "iperf": args.iperf,
+        "imsi_base": args.imsi_base,
+        "gnb_name": args.gnb,
+        "seed": args.seed if args.seed is not None else int(time.time()),
+        "max_inflight": args.max_inflight,
+        "deadline_tolerance": args.tolerance,
+        "stagger": not args.no_stagger,
+        "sessions": args.sessions,
+        "fork": args.fork,
+        "dry_run": args.dry_run,
+    }
+
+    replay_schedule = None
+    if args.replay is not None:
+        replay_schedule = schedule.read_schedule(args.replay)
+        conf["num_ues"] = replay_schedule.num_ues
+        conf["num_it"] = replay_schedule.num_it
+
+    if args.export_schedule is not None:
+        fleet = Fleet(ssmm.g_transition_matrix, conf, None, replay_schedule)
+        schedule.write_schedule(args.export_schedule, fleet.compile())
+        print(f"wrote schedule of {conf['num_ues']} UEs to {args.export_schedule}")
+        raise SystemExit(0)
+
+    load = None
+    if args.profile:
+        try:
+            profiles = {procedure: loadprofile.parse_profile(procedure, kind, points) for procedure, kind, points in args.profile}
+        except ValueError as e:
+            parser.error(f"--profile: {e}")
+        load = loadprofile.LoadController(profiles, args.profile_duration, seed=conf["seed"])
+
+    event_log = eventlog.EventLog(args.o)
+    fleet = Fleet(ssmm.g_transition_matrix, conf, event_log, replay_schedule)
+
+    try:
+        asyncio.run(fleet.run(load))
+    finally:
+        event_log.close()
+        ssmm.store_list_as_json(args.stats, fleet.stats())
+        print_stats(fleet.stats())
+        if load is not None:
+            ssmm.store_list_as_json(args.load_report, load.report())
+            loadprofile.print_report(load.report())
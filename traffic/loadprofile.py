@@ -0,0 +1,257 @@
+import asyncio
+import time
+
+import numpy as np
+
+g_procedures = ("ps-establish", "ps-release")
+g_profile_kinds = ("step", "ramp", "poisson")
+
+
+class RateProfile:
+    """Target rate of one control plane procedure over time [1/s].
+
+    step holds the rate of each point until the next point, ramp
+    interpolates linearly between the points, poisson is a step profile
+    with Poisson instead of evenly spaced arrivals. Before the first and
+    after the last point the rate of that point holds.
+    """
+
+    def __init__(self, kind, points):
+        if kind not in g_profile_kinds:
+            raise ValueError(f"unknown profile {kind}, choose from {', '.join(g_profile_kinds)}")
+        points = sorted(points)
+        if points[0][0] > 0:
+            points.insert(0, (0.0, points[0][1]))
+
+        self.kind = kind
+        self.times = np.array([t for t, _ in points], dtype=float)
+        self.rates = np.array([r for _, r in points], dtype=float)
+
+        # Slope of the rate in each segment, the last one extends to infinity
+        self.slopes = np.zeros(len(self.times))
+        if kind == "ramp":
+            self.slopes[:-1] = np.diff(self.rates) / np.maximum(np.diff(self.times), 1e-9)
+
+        lengths = np.diff(self.times)
+        self.cumulative_at_points = np.concatenate([[0.0], np.cumsum(self.rates[:-1] * lengths + self.slopes[:-1] * lengths ** 2 / 2)])
+
+    def segment(self, t):
+        return np.clip(np.searchsorted(self.times, t, side="right") - 1, 0, len(self.times) - 1)
+
+    def rate(self, t):
+        i = self.segment(t)
+        return self.rates[i] + self.slopes[i] * (t - self.times[i])
+
+    def cumulative(self, t):
+        """Expected number of operations in [0, t]."""
+        i = self.segment(t)
+        dt = np.asarray(t) - self.times[i]
+        return self.cumulative_at_points[i] + self.rates[i] * dt + self.slopes[i] * dt ** 2 / 2
+
+    def arrivals(self, duration, rng):
+        """Target times of the operations in [0, duration).
+
+        The k-th operation is due when the cumulative rate reaches k (or the
+        k-th point of a unit rate Poisson process, for poisson), the inverse
+        of the cumulative rate is interpolated on a fine grid.
+        """
+        total = float(self.cumulative(duration))
+        if self.kind == "poisson":
+            targets = np.cumsum(rng.exponential(1.0, int(total + 10 * np.sqrt(total) + 10)))
+        else:
+            targets = np.arange(1, int(total) + 1, dtype=float)
+        targets = targets[targets < total]
+
+        grid = np.linspace(0.0, duration, max(int(duration * 100), 1000) + 1)
+        return np.interp(targets, self.cumulative(grid), grid)
+
+
+def parse_profile(procedure, kind, points):
+    """Build a profile from the command line, points as t:rate,t:rate,..."""
+    if procedure not in g_procedures:
+        raise ValueError(f"unknown procedure {procedure}, choose from {', '.join(g_procedures)}")
+
+    parsed = list()
+    for point in points.split(","):
+        t, rate = point.split(":")
+        parsed.append((float(t), float(rate)))
+
+    return RateProfile(kind, parsed)
+
+
+class ProcedureStats:
+    """Targets, issued, completed and failed operations of one procedure per time bin."""
+
+    def __init__(self, arrivals, duration, bin_width):
+        self.bin_width = bin_width
+        num_bins = int(np.ceil(duration / bin_width))
+        self.target = np.bincount((arrivals / bin_width).astype(np.int64), minlength=num_bins)[:num_bins]
+        self.issued = np.zeros(num_bins, dtype=np.int64)
+        self.completed = np.zeros(num_bins, dtype=np.int64)
+        self.failed = np.zeros(num_bins, dtype=np.int64)
+        self.latency_sum = np.zeros(num_bins)
+        self.succeeded = 0
+        self.inflight = 0
+        self.starved = 0
+
+    def bin(self, t):
+        return min(int(t / self.bin_width), len(self.target) - 1)
+
+    def report(self):
+        # Positive lag means the achieved operations are behind the target
+        lag = np.cumsum(self.target) - np.cumsum(self.completed)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            latency = np.where(self.completed > 0, self.latency_sum / self.completed, np.nan)
+
+        return {
+            "bin_width": self.bin_width,
+            "target": self.target.tolist(),
+            "issued": self.issued.tolist(),
+            "completed": self.completed.tolist(),
+            "failed": self.failed.tolist(),
+            "lag": lag.tolist(),
+            "mean_latency": [None if np.isnan(v) else float(v) for v in latency],
+            "summary": {
+                "target": int(self.target.sum()),
+                "completed": int(self.completed.sum()),
+                "failed": int(self.failed.sum()),
+                "starved": self.starved,
+                "mean_abs_error_per_s": float(np.abs(self.completed - self.target).mean() / self.bin_width),
+                "max_lag": int(lag.max()) if len(lag) else 0,
+            },
+        }
+
+
+class LoadController:
+    """Drives ps-establish and ps-release at target rates over the UEs of a fleet.
+
+    A UE has at most one PDU session: ps-establish works on UEs without one,
+    ps-release releases the session of a UE by its PSI.
+
+    The load is open loop: operations are started when they are due, not
+    when the previous one completed. Every tick the controller compares the
+    operations due so far with the succeeded plus running ones and starts
+    the difference, so failed operations and operations that found no UE in
+    the right state are made up for as soon as possible.
+    """
+
+    def __init__(self, profiles, duration, bin_width=1.0, interval=0.05, max_burst=100, seed=None):
+        self.profiles = profiles
+        self.duration = duration
+        self.bin_width = bin_width
+        self.interval = interval
+        self.max_burst = max_burst
+        self.rng = np.random.default_rng(seed)
+        self.stats = dict()
+
+    async def run(self, fleet):
+        # The UEs come up with a PDU session, ps-establish would find no UE to work on
+        if "ps-establish" in self.profiles:
+            await self.release_all(fleet)
+        await asyncio.gather(*[self.drive(fleet, procedure, profile) for procedure, profile in self.profiles.items()])
+
+    async def release_all(self, fleet):
+        """Release the PDU sessions of all idle UEs before the profiles start."""
+        ues = [ue for ue in fleet.ues if ue.session and not ue.busy]
+        await asyncio.gather(*[self.release(fleet, ue) for ue in ues])
+        print(f"released the PDU sessions of {len(ues)} UEs for ps-establish")
+
+    async def release(self, fleet, ue):
+        ue.busy = True
+        try:
+            await self.apply(fleet, "ps-release", ue)
+        except Exception as e:
+            print(f"{ue.imsi}: ps-release failed: {e}")
+        finally:
+            ue.busy = False
+
+    async def apply(self, fleet, procedure, ue):
+        """Run procedure on the UE, returns whether it succeeded."""
+        async with fleet.inflight:
+            ue.dispatch_ns = time.monotonic_ns()
+            latency = None
+            if not fleet.conf["dry_run"]:
+                if procedure == "ps-establish":
+                    latency = await fleet.establish_command(ue)
+                else:
+                    latency = await fleet.ps_release_command(ue)
+
+        success = latency is None or latency["returncode"] == 0
+        if success and procedure == "ps-establish":
+            # PSI and address are looked up once the session is used
+            ue.session = True
+        elif success:
+            fleet.session_closed(ue)
+        fleet.log_event(ue, procedure, None, latency)
+        return success
+
+    def pick(self, fleet, procedure):
+        # The UEs a procedure applies to change all the time, probe a few at random
+        want_session = procedure == "ps-release"
+        for index in self.rng.integers(0, len(fleet.ues), 16).tolist():
+            ue = fleet.ues[index]
+            if not ue.busy and ue.session == want_session:
+                return ue
+        return None
+
+    async def drive(self, fleet, procedure, profile):
+        loop = asyncio.get_event_loop()
+        arrivals = profile.arrivals(self.duration, self.rng)
+        stats = self.stats[procedure] = ProcedureStats(arrivals, self.duration, self.bin_width)
+        operations = set()
+
+        start = loop.time()
+        while (now := loop.time() - start) < self.duration:
+            due = int(np.searchsorted(arrivals, now, side="right"))
+            deficit = due - stats.succeeded - stats.inflight
+            for _ in range(min(deficit, self.max_burst)):
+                ue = self.pick(fleet, procedure)
+                if ue is None:
+                    stats.starved += 1
+                    break
+
+                stats.issued[stats.bin(now)] += 1
+                task = asyncio.ensure_future(self.operate(fleet, procedure, ue, stats, start))
+                operations.add(task)
+                task.add_done_callback(operations.discard)
+
+            # Sleep until the next operation is due, but check back every interval
+            next_due = arrivals[due] - now if due < len(arrivals) else self.interval
+            await asyncio.sleep(self.interval if deficit > 0 else min(max(next_due, 0.0), self.interval))
+
+        if operations:
+            await asyncio.wait(operations)
+
+    async def operate(self, fleet, procedure, ue, stats, start):
+        loop = asyncio.get_event_loop()
+        ue.busy = True
+        stats.inflight += 1
+        issued = loop.time()
+        try:
+            success = await self.apply(fleet, procedure, ue)
+        except Exception as e:
+            print(f"{ue.imsi}: {procedure} failed: {e}")
+            success = False
+        finally:
+            ue.busy = False
+            stats.inflight -= 1
+
+        done = loop.time()
+        b = stats.bin(done - start)
+        if success:
+            stats.succeeded += 1
+            stats.completed[b] += 1
+            stats.latency_sum[b] += done - issued
+        else:
+            stats.failed[b] += 1
+
+    def report(self):
+        return {procedure: stats.report() for procedure, stats in self.stats.items()}
+
+
+def print_report(report):
+    print(f"{'procedure':<14} {'target':>8} {'completed':>10} {'failed':>8} {'starved':>8} {'mean |err| [1/s]':>17} {'max lag':>8}")
+    for procedure, r in report.items():
+        s = r["summary"]
+        print(f"{procedure:<14} {s['target']:>8} {s['completed']:>10} {s['failed']:>8} {s['starved']:>8} "
+              f"{s['mean_abs_error_per_s']:>17.3f} {s['max_lag']:>8}")
@@ -1,72 +1,105 @@
-import json
+import argparse
+import numpy as np
 from matplotlib import pyplot as plt
+from matplotlib.collections import LineCollection
 
-def load_json(path):
-    with open(path, "r") as fin:
-        data = json.load(fin)
-    
-    return data
+import eventlog
+
+# Event classes: label, color, line style and marker size of the stems
+g_event_classes = {
+    "pu": ("Periodic update", "C0", "-", 7),
+    "ed": ("Event detection", "C1", "-", 10),
+    "pe": ("Payload exchange", "C2", "--", 6),
+}
+
+def load_events(path):
+    """Read the pu, ed and pe events of an event log into timestamp and byte arrays per class.
+
+    Every burst of a PE becomes a point at the timestamp of its event.
+    """
+    timestamps = {event: list() for event in g_event_classes}
+    lengths = {event: list() for event in g_event_classes}
+
+    for e in eventlog.read_events(path):
+        if e["event"] == "pe":
+            timestamps["pe"].extend([e["ts"]] * len(e["bytes"]))
+            lengths["pe"].extend(e["bytes"])
+        elif e["event"] in timestamps:
+            timestamps[e["event"]].append(e["ts"])
+            lengths[e["event"]].append(e["bytes"])
+
+    return {event: (np.array(timestamps[event], dtype=float), np.array(lengths[event], dtype=float))
+            for event in g_event_classes}
 
 def normalize_timestamps(timestamps, offset):
-    norm_timestamps = list()
-
-    for ts in timestamps:
-        norm_timestamps.append((ts - offset) * 100)
-
-    return norm_timestamps    
-
-def plot_ssmm_traffic(timestamps_pu, bytes_pu, timestamps_ed, bytes_ed, timestamps_pe, bytes_pe):
-    markerline_pu, _, _ = plt.stem(timestamps_pu, bytes_pu, bottom=-3)
-    markerline_ed, _, _ = plt.stem(timestamps_ed, bytes_ed, bottom=-3, markerfmt="C1o", linefmt="C1-")
-    
-    e = 0
-    for pe in bytes_pe:
-        for b in pe:
-            markerline_pe, _, _ = plt.stem(timestamps_pe[e], b, bottom=-3, markerfmt="C2o", linefmt="C2--")
-            markerline_pe.set_markerfacecolor("none")
-            plt.setp(markerline_pe, markersize=6)
-        e += 1
-        
-    markerline_pu.set_markerfacecolor("none")
-    plt.setp(markerline_pu, markersize=7)
-    markerline_ed.set_markerfacecolor("none")
-    plt.setp(markerline_ed, markersize=10)
-
-    plt.ylim(0, 1500)
-    plt.xlabel("Time (s)")
-    plt.ylabel("Message length (bytes)")
-    plt.legend(["Periodic update", "Event detection", "Payload exchange"], ncol=3, loc="lower center", bbox_to_anchor=[0.5, -0.25])
-    plt.tight_layout()
-    plt.savefig("plot_ssmm.png")
-    plt.close()
+    return (np.asarray(timestamps) - offset) * 100
+
+def aggregate(timestamps, lengths, max_points):
+    """Reduce to at most max_points stems, the largest message of each time bin.
+
+    Keeps the envelope of the message lengths, which is what the plot shows
+    at this density anyway.
+    """
+    if len(timestamps) <= max_points:
+        return timestamps, lengths
+
+    edges = np.linspace(timestamps.min(), timestamps.max(), max_points + 1)
+    bins = np.clip(np.searchsorted(edges, timestamps, side="right") - 1, 0, max_points - 1)
+    envelope = np.full(max_points, -np.inf)
+    np.maximum.at(envelope, bins, lengths)
+    filled = np.isfinite(envelope)
+
+    return ((edges[:-1] + edges[1:]) / 2)[filled], envelope[filled]
+
+def plot_stems(ax, timestamps, lengths, color, linestyle, markersize, label, bottom=-3):
+    # One collection for all stems and one scatter for all markers instead of a plt.stem per event
+    segments = np.stack([np.column_stack([timestamps, np.full(len(timestamps), bottom)]),
+                         np.column_stack([timestamps, lengths])], axis=1)
+    ax.add_collection(LineCollection(segments, colors=color, linestyles=linestyle))
+    return ax.scatter(timestamps, lengths, s=markersize ** 2, facecolors="none", edgecolors=color, label=label, zorder=3)
+
+def plot_ssmm_traffic(events, outfile="plot_ssmm.png", max_points=5000):
+    fig, ax = plt.subplots()
+
+    handles = list()
+    for event, (label, color, linestyle, markersize) in g_event_classes.items():
+        timestamps, lengths = aggregate(*events[event], max_points)
+        handles.append(plot_stems(ax, timestamps, lengths, color, linestyle, markersize, label))
+
+    ax.autoscale_view(scaley=False)
+    ax.set_ylim(0, 1500)
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Message length (bytes)")
+    ax.legend(handles=handles, ncol=3, loc="lower center", bbox_to_anchor=[0.5, -0.25])
+    fig.tight_layout()
+    fig.savefig(outfile)
+    plt.close(fig)
 
 
 if __name__ == "__main__":
-    path = "events_ssmm.json"
-    
-    events = load_json(path)
-
-    timestamps_pu = list()
-    bytes_pu = list()
-    timestamps_ed = list()
-    bytes_ed = list()
-    timestamps_pe = list()
-    bytes_pe = list()
-    for e in events:
-        if e["event"] == "pe":
-            timestamps_pe.append(e["ts"])
-            bytes_pe.append(e["bytes"])
-        elif e["event"] == "pu":
-            timestamps_pu.append(e["ts"])
-            bytes_pu.append(e["bytes"])
-        else:
-            timestamps_ed.append(e["ts"])
-            bytes_ed.append(e["bytes"])
-
-    time_offset = timestamps_pu[0]
-
-    timestamps_pu = normalize_timestamps(timestamps_pu, time_offset)
-    timestamps_pe = normalize_timestamps(timestamps_pe, time_offset)
-    timestamps_ed = normalize_timestamps(timestamps_ed, time_offset)
-
-    plot_ssmm_traffic(timestamps_pu, bytes_pu, timestamps_ed, bytes_ed, timestamps_pe, bytes_pe)
+    parser = argparse.ArgumentParser(description="Plot the message lengths of a ssmm event log over time")
+
+    parser.add_argument("path",
+                        default="events_ssmm.ndjson",
+                        nargs="?",
+                        type=str,
+                        help="event log of ssmm.py or fleet.py (NDJSON or the JSON list of older runs)")
+    parser.add_argument("-o",
+                        default="plot_ssmm.png",
+                        type=str,
+                        help="path to the plot")
+    parser.add_argument("--max-points",
+                        default=5000,
+                        type=int,
+                        help="above this many stems per event class only the largest message per time bin is drawn")
+    args = parser.parse_args()
+
+    # Streamed, also reads the JSON list of older runs
+    events = load_events(args.path)
+    if not any(len(ts) for ts, _ in events.values()):
+        parser.exit(1, f"{args.path} holds no pu, ed or pe events, nothing to plot\n")
+
+    time_offset = events["pu"][0][0] if len(events["pu"][0]) else min(ts[0] for ts, _ in events.values() if len(ts))
+    events = {event: (normalize_timestamps(ts, time_offset), lengths) for event, (ts, lengths) in events.items()}
+
+    plot_ssmm_traffic(events, args.o, args.max_points)
@@ -1,12 +1,27 @@
 import os
 import sys
+import glob
+import pickle
+import hashlib
+import inspect
 import argparse
+import importlib
+import importlib.util
+import concurrent.futures
 import matplotlib
 import matplotlib.pyplot as plt
 from math import sqrt
 
 plot_files = []
 
+# Fast preview: Agg without LaTeX, the final figures keep ps and usetex
+g_preview = False
+
+# Part of every cache key, bump it when shared helpers the queries use change their results
+g_cache_version = 1
+g_cache_max_entries = 64
+g_cache_max_bytes = 1 << 30
+
 
 def save(figdir, path):
     abspath = os.path.join(figdir, path)
@@ -57,6 +72,13 @@ def setup(
         "errorbar.capsize": 2,
     }
     rc.update(params)
+    if g_preview:
+        rc.update({
+            "backend": "agg",
+            "text.usetex": False,
+            "savefig.dpi": 100,
+        })
+        del rc["text.latex.preamble"]
     matplotlib.rcParams.update(rc)
 
 
@@ -67,6 +89,158 @@ def legend(lines, width=1, height=None, span=False, **kwargs):
     return fig
 
 
+def input_fingerprint(input, hash_contents=False):
+    """Fingerprint of all files below input: path, size and mtime, or their contents."""
+    paths = [input] if os.path.isfile(input) else sorted(glob.glob(os.path.join(input, "**", "*"), recursive=True))
+    fingerprint = hashlib.sha1()
+    for path in paths:
+        if not os.path.isfile(path) or os.path.basename(path).startswith("."):
+            continue
+        stat = os.stat(path)
+        fingerprint.update(f"{os.path.relpath(path, input)}\0{stat.st_size}\0".encode())
+        if hash_contents:
+            with open(path, "rb") as fin:
+                while chunk := fin.read(1 << 20):
+                    fingerprint.update(chunk)
+        else:
+            fingerprint.update(str(stat.st_mtime_ns).encode())
+
+    return fingerprint.hexdigest()
+
+
+def query_helpers(query):
+    """query and the functions of its module it calls, directly or through one another."""
+    helpers = [query]
+    for function in helpers:
+        code = getattr(function, "__code__", None)
+        for name in code.co_names if code is not None else ():
+            helper = getattr(function, "__globals__", dict()).get(name)
+            if inspect.isfunction(helper) and helper.__module__ == query.__module__ and helper not in helpers:
+                helpers.append(helper)
+    return helpers
+
+
+def query_key(query, input, hash_contents=False):
+    # A changed query or helper of the figure script invalidates its results just like changed input files,
+    # g_cache_version covers the shared modules
+    key = hashlib.sha1(f"{g_cache_version}\0".encode())
+    for function in query_helpers(query):
+        try:
+            source = inspect.getsource(function)
+        except (OSError, TypeError):
+            source = f"{function.__module__}.{function.__qualname__}"
+        key.update(source.encode())
+
+    key.update(os.path.abspath(input).encode())
+    key.update(input_fingerprint(input, hash_contents).encode())
+    return key.hexdigest()
+
+
+def evict(cache_dir, max_entries=g_cache_max_entries, max_bytes=g_cache_max_bytes):
+    """Remove the least recently used results until the cache fits into its limits."""
+    entries = list()
+    for path in glob.glob(os.path.join(cache_dir, "*.pkl")):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    entries.sort(reverse=True)
+    total = 0
+    for i, (_, size, path) in enumerate(entries):
+        total += size
+        if i >= max_entries or total > max_bytes:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def cached_query(query, input, cache_dir, hash_contents=False):
+    """Result of query(input), cached in cache_dir as long as the query and the input files are unchanged."""
+    if cache_dir is None:
+        return query(input)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, query_key(query, input, hash_contents) + ".pkl")
+    try:
+        with open(path, "rb") as fin:
+            df = pickle.load(fin)
+        # Mark as recently used for the eviction
+        os.utime(path)
+        return df
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+
+    df = query(input)
+    # Write and rename, parallel renderers may store the same result
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fout:
+        pickle.dump(df, fout, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+    evict(cache_dir)
+    return df
+
+
+def load_figure_script(path):
+    """Import a figure script (defining query and plot) without running its main."""
+    name = "figure_" + hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    spec.loader.exec_module(module)
+    return module
+
+
+def render_figure(script, input, output, cache_dir, preview, hash_contents):
+    """Render the figures of one script, in a worker process of batch."""
+    # The scripts use the importable plotting module, which is not this one when run as a script
+    plotting = importlib.import_module("plotting")
+    plotting.g_preview = preview
+    plotting.plot_files.clear()
+
+    module = load_figure_script(script)
+    df = plotting.cached_query(module.query, input, cache_dir, hash_contents)
+    module.plot(df, output)
+    plt.close("all")
+    return list(plotting.plot_files)
+
+
+def batch(scripts, input, output, cache_dir, preview=False, hash_contents=False, jobs=None):
+    """Render the figure scripts in parallel worker processes, returns the written files per script."""
+    os.makedirs(output, exist_ok=True)
+    files = dict()
+    with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+        futures = {executor.submit(render_figure, script, input, output, cache_dir, preview, hash_contents): script
+                   for script in scripts}
+        for future in concurrent.futures.as_completed(futures):
+            script = futures[future]
+            try:
+                files[script] = future.result()
+            except Exception as e:
+                print(f"{script}: {type(e).__name__}: {e}", file=sys.stderr)
+                files[script] = None
+
+    return files
+
+
+def add_cache_arguments(parser, here):
+    parser.add_argument(
+        "--preview", help="Render fast without LaTeX (final figures use usetex)", action="store_true"
+    )
+    parser.add_argument(
+        "--cache", help="Directory of the query result cache",
+        default=os.path.join(here, "../.query-cache")
+    )
+    parser.add_argument(
+        "--no-cache", help="Always run the query", action="store_true"
+    )
+    parser.add_argument(
+        "--hash-inputs", help="Key the cache on the input file contents instead of their mtimes", action="store_true"
+    )
+
+
 def main(query, plot):
     here = os.path.dirname(sys.argv[0])
     parser = argparse.ArgumentParser()
@@ -82,12 +256,39 @@ def main(query, plot):
     parser.add_argument(
         "--output", help="Output directory", default=os.path.join(here, "../figures")
     )
+    add_cache_arguments(parser, here)
     args = parser.parse_args()
+    global g_preview
+    g_preview = args.preview
     os.system("mkdir -p '%s'" % args.output)
-    df = query(args.input)
+    df = cached_query(query, args.input, None if args.no_cache else args.cache, args.hash_inputs)
     if args.query:
         print(df)
     plot(df, args.output)
     if args.show:
         for fn in plot_files:
             os.system("xdg-open >/dev/null 2>/dev/null '%s'" % fn)
+
+
+if __name__ == "__main__":
+    here = os.path.dirname(sys.argv[0])
+    parser = argparse.ArgumentParser(description="Render the figures of several figure scripts in parallel")
+    parser.add_argument(
+        "scripts", nargs="+", help="Figure scripts defining query(input) and plot(df, output)"
+    )
+    parser.add_argument(
+        "--input", help="Input directory", default=os.path.join(here, "../data")
+    )
+    parser.add_argument(
+        "--output", help="Output directory", default=os.path.join(here, "../figures")
+    )
+    parser.add_argument(
+        "-j", "--jobs", help="Number of worker processes (default: number of CPUs)", type=int, default=None
+    )
+    add_cache_arguments(parser, here)
+    args = parser.parse_args()
+
+    files = batch(args.scripts, args.input, args.output, None if args.no_cache else args.cache,
+                  args.preview, args.hash_inputs, args.jobs)
+    if None in files.values():
+        sys.exit(1)
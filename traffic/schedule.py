@@ -0,0 +1,162 @@
+import json
+import pathlib
+import time
+
+import numpy as np
+
+import trajectory
+
+SCHEDULE_VERSION = 1
+
+g_state_names = ["off", "pu", "ed", "pe"]
+# Number of transmissions in the states off, pu, ed and pe
+g_schedule_bursts = np.array([0, 1, 1, 10])
+
+
+class Schedule:
+    """A compiled ssmm workload: what every UE does when, independent of the run.
+
+    offsets[ue, it] is the time of iteration it of a UE relative to the
+    start of the replay [s], rates[ue, it] its transmit rate [bit/s]. The
+    states and the byte counts of the transmissions (PU included) are kept
+    in a Trajectories object.
+    """
+
+    def __init__(self, trajectories, offsets, rates, meta):
+        self.trajectories = trajectories
+        self.offsets = offsets
+        self.rates = rates
+        self.meta = meta
+
+    @property
+    def num_ues(self):
+        return self.trajectories.num_ues
+
+    @property
+    def num_it(self):
+        return self.trajectories.num_it
+
+    def entries(self):
+        """Yield (offset, ue, iteration) of all UEs in dispatch order."""
+        ues, iterations = np.divmod(np.argsort(self.offsets, axis=None, kind="stable"), self.num_it)
+        for ue, it in zip(ues.tolist(), iterations.tolist()):
+            yield float(self.offsets[ue, it]), ue, it
+
+
+def compile_schedule(trajectories, conf, first_pu):
+    """Lay out the sampled trajectories in time.
+
+    first_pu holds the offset of the first PU of every UE. PUs happen on the
+    grid of sojourn_time_pu, an ED after its sojourn but never after the next
+    PU, off and PE right after the previous state. The actions themselves
+    are assumed to take no time.
+    """
+    states = trajectories.states
+    num_ues, num_it = states.shape
+    rate_table = np.array([0, conf["rate_pu"], conf["rate_ed"], conf["rate_pe"]], dtype=np.uint32)
+
+    offsets = np.empty(states.shape)
+    t = np.zeros(num_ues)
+    next_pu = np.asarray(first_pu, dtype=float).copy()
+    for it in range(num_it):
+        pu = states[:, it] == 1
+        ed = states[:, it] == 2
+        t = np.where(pu, np.maximum(t, next_pu), t)
+        next_pu = np.where(pu, next_pu + conf["sojourn_time_pu"], next_pu)
+        t = np.where(ed, t + np.clip(np.minimum(trajectories.sojourn_ed[:, it], next_pu - t), 0, None), t)
+        offsets[:, it] = t
+
+    # Same bursts as the trajectories, plus one burst of bytes_pu per PU
+    counts = g_schedule_bursts[states].ravel()
+    burst_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=burst_offsets[1:])
+    burst_bytes = np.empty(burst_offsets[-1], dtype=np.uint32)
+    pu_bursts = np.zeros(len(burst_bytes), dtype=bool)
+    pu_bursts[burst_offsets[:-1][states.ravel() == 1]] = True
+    burst_bytes[pu_bursts] = conf["bytes_pu"]
+    # ED and PE bursts come in the same order as in the trajectories
+    burst_bytes[~pu_bursts] = trajectories.burst_bytes
+
+    meta = {
+        "version": SCHEDULE_VERSION,
+        "num_ues": num_ues,
+        "num_it": num_it,
+        "sojourn_time_pu": conf["sojourn_time_pu"],
+        "lam_ed": conf["lam_ed"],
+        "seed": conf["seed"],
+    }
+    return Schedule(trajectory.Trajectories(states, np.zeros(states.shape, dtype=np.float32), burst_offsets, burst_bytes),
+                    offsets, rates=rate_table[states], meta=meta)
+
+
+def write_schedule(path, schedule):
+    """Store a schedule as compact binary (.npz) or as NDJSON (one line per entry in dispatch order)."""
+    path = pathlib.Path(path)
+    if path.suffix == ".npz":
+        np.savez_compressed(path, states=schedule.trajectories.states, offsets=schedule.offsets, rates=schedule.rates,
+                            burst_offsets=schedule.trajectories.burst_offsets,
+                            burst_bytes=schedule.trajectories.burst_bytes, meta=json.dumps(schedule.meta))
+        return
+
+    with path.open("w") as fout:
+        fout.write(json.dumps(schedule.meta) + "\n")
+        for offset, ue, it in schedule.entries():
+            fout.write(json.dumps({
+                "offset": offset,
+                "ue": ue,
+                "it": it,
+                "state": g_state_names[schedule.trajectories.states[ue, it]],
+                "rate": int(schedule.rates[ue, it]),
+                "bytes": schedule.trajectories.bursts(ue, it).tolist(),
+            }) + "\n")
+
+
+def check_version(meta):
+    if meta.get("version") != SCHEDULE_VERSION:
+        raise ValueError(f"unsupported schedule version {meta.get('version')}")
+
+
+def read_schedule(path):
+    path = pathlib.Path(path)
+    if path.suffix == ".npz":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            check_version(meta)
+            trajectories = trajectory.Trajectories(data["states"], np.zeros(data["states"].shape, dtype=np.float32),
+                                                   data["burst_offsets"], data["burst_bytes"])
+            return Schedule(trajectories, data["offsets"], data["rates"], meta)
+
+    with path.open() as fin:
+        meta = json.loads(fin.readline())
+        check_version(meta)
+        shape = (meta["num_ues"], meta["num_it"])
+        states = np.zeros(shape, dtype=np.int8)
+        offsets = np.zeros(shape)
+        rates = np.zeros(shape, dtype=np.uint32)
+        bursts = [None] * (shape[0] * shape[1])
+        for line in fin:
+            entry = json.loads(line)
+            ue, it = entry["ue"], entry["it"]
+            states[ue, it] = g_state_names.index(entry["state"])
+            offsets[ue, it] = entry["offset"]
+            rates[ue, it] = entry["rate"]
+            bursts[ue * shape[1] + it] = entry["bytes"]
+
+    burst_offsets = np.zeros(len(bursts) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in bursts], out=burst_offsets[1:])
+    burst_bytes = np.fromiter((n for b in bursts for n in b), dtype=np.uint32, count=burst_offsets[-1])
+    trajectories = trajectory.Trajectories(states, np.zeros(shape, dtype=np.float32), burst_offsets, burst_bytes)
+    return Schedule(trajectories, offsets, rates, meta)
+
+
+def sleep_until(deadline, spin=0.002):
+    """Sleep until the time.monotonic() deadline, returns the lateness [s].
+
+    The last spin seconds are busy waited, time.sleep alone may oversleep by
+    the scheduler's granularity.
+    """
+    while (remaining := deadline - time.monotonic()) > spin:
+        time.sleep(remaining - spin)
+    while (now := time.monotonic()) < deadline:
+        pass
+    return now - deadline
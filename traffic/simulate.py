@@ -0,0 +1,209 @@
+import argparse
+import json
+import math
+import time
+
+import numpy as np
+
+import eventlog
+import schedule
+import ssmm
+import trajectory
+
+
+class VirtualClock:
+    """Stand-in for the time module that only advances when slept on.
+
+    ssmm.run reads the time through ssmm.g_clock, with a VirtualClock the
+    state machine and its timers run unchanged but every sleep returns
+    immediately.
+    """
+
+    def __init__(self, start=None):
+        self.start = time.time() if start is None else start
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    def time(self):
+        return self.start + self.now
+
+    def time_ns(self):
+        return int(self.time() * 1e9)
+
+    def monotonic(self):
+        return self.now
+
+    def monotonic_ns(self):
+        return int(self.now * 1e9)
+
+
+def control_plane_events(sched, duration):
+    """Times of the registrations and releases of all UEs of a schedule before duration.
+
+    As in ssmm, a UE starts registered, off releases a registered UE and the
+    first PU, ED or PE after an off registers it again.
+    """
+    states = sched.trajectories.states
+    registered_before = np.ones(states.shape, dtype=bool)
+    registered_before[:, 1:] = states[:, :-1] != 0
+    within = sched.offsets < duration
+
+    return {
+        "registration": sched.offsets[(states != 0) & ~registered_before & within],
+        "release": sched.offsets[(states == 0) & registered_before & within],
+    }
+
+
+def iterations_for(duration, conf):
+    # Every PU period takes a PU, an off and a few ED/PE cycles, most often none
+    return int(math.ceil(duration / conf["sojourn_time_pu"] * 4)) + 8
+
+
+def sample_batch(P, conf, num_ues, duration, seed, stagger):
+    num_it = iterations_for(duration, conf)
+    while True:
+        trajectories = trajectory.sample_trajectories(P, num_ues, num_it, conf["lam_ed"], seed)
+        rng = np.random.default_rng(seed + [1])
+        first_pu = rng.uniform(0, 1, num_ues) * conf["sojourn_time_pu"] if stagger else np.full(num_ues, conf["sojourn_time_pu"])
+        sched = schedule.compile_schedule(trajectories, conf, first_pu)
+        # Every UE has to reach the end of the simulated time
+        if sched.offsets[:, -1].min() >= duration:
+            return sched
+        num_it *= 2
+
+
+def write_events(event_log, sched, duration, start, ue_base, conf):
+    """Write the events of a schedule like ssmm.log_event would in simulated time."""
+    for offset, ue, it in sched.entries():
+        if offset >= duration:
+            break
+
+        state = int(sched.trajectories.states[ue, it])
+        bursts = sched.trajectories.bursts(ue, it).tolist()
+        event_log.append({
+            "event": schedule.g_state_names[state],
+            "ts": start + offset,
+            "mono_ns": int(offset * 1e9),
+            "bytes": None if state == 0 else bursts if state == 3 else bursts[0],
+            "ue": f"imsi-{conf['imsi_base'] + ue_base + ue:015d}",
+        })
+
+
+def simulate(P, conf, num_ues, duration, bin_width=1.0, batch_size=10000, seed=0, stagger=True, event_log=None):
+    """Count registrations and releases per bin_width seconds for num_ues UEs over duration seconds.
+
+    The UEs are sampled and laid out in time in batches, so memory only
+    depends on the batch size. The actions take no time, as in the compiled
+    schedules.
+    """
+    num_bins = int(math.ceil(duration / bin_width))
+    load = {"registration": np.zeros(num_bins, dtype=np.int64), "release": np.zeros(num_bins, dtype=np.int64)}
+    start = time.time()
+
+    for batch, first in enumerate(range(0, num_ues, batch_size)):
+        sched = sample_batch(P, conf, min(batch_size, num_ues - first), duration, [seed, batch], stagger)
+        for kind, times in control_plane_events(sched, duration).items():
+            load[kind] += np.bincount((times / bin_width).astype(np.int64), minlength=num_bins)[:num_bins]
+        if event_log is not None:
+            write_events(event_log, sched, duration, start, first, conf)
+
+    return load
+
+
+def load_summary(counts, bin_width):
+    rates = counts / bin_width
+    return {
+        "total": int(counts.sum()),
+        "mean_per_s": float(rates.mean()) if len(rates) else 0.0,
+        "p99_per_s": float(np.quantile(rates, 0.99)) if len(rates) else 0.0,
+        "max_per_s": float(rates.max()) if len(rates) else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate the control plane load of many ssmm UEs in virtual time")
+
+    parser.add_argument("-n",
+                        default=1000,
+                        type=int,
+                        help="number of UEs")
+    parser.add_argument("--hours",
+                        default=24.0,
+                        type=float,
+                        help="simulated time [h]")
+    parser.add_argument("-t_pu",
+                        default=600.0,
+                        type=float,
+                        help="sojourn time between PUs [s]")
+    parser.add_argument("-l_ed",
+                        default=0.005,
+                        type=float,
+                        help="lambda for sojourn time before ED")
+    parser.add_argument("-b_pu",
+                        default=100,
+                        type=int,
+                        help="number of bytes to tranmit for a peridoc update")
+    parser.add_argument("--bin",
+                        default=1.0,
+                        type=float,
+                        help="width of the load bins [s]")
+    parser.add_argument("--batch",
+                        default=10000,
+                        type=int,
+                        help="UEs sampled at once, bounds the memory use")
+    parser.add_argument("--imsi-base",
+                        default=901700000000001,
+                        type=int,
+                        help="IMSI of the first UE in the event log")
+    parser.add_argument("--seed",
+                        default=None,
+                        type=int,
+                        help="seed of the UE trajectories (default: time)")
+    parser.add_argument("--no-stagger",
+                        action="store_true",
+                        help="start the PU timers of all UEs at the same time")
+    parser.add_argument("-o",
+                        default="cp_load.json",
+                        type=str,
+                        help="path to the registrations and releases per bin")
+    parser.add_argument("--events",
+                        default=None,
+                        type=str,
+                        help="also write the events of all UEs in simulated time to this NDJSON log")
+    args = parser.parse_args()
+
+    conf = {
+        "sojourn_time_pu": args.t_pu,
+        "lam_ed": args.l_ed,
+        "bytes_pu": args.b_pu,
+        # Rates don't matter without transmissions
+        "rate_pu": 0,
+        "rate_ed": 0,
+        "rate_pe": 0,
+        "imsi_base": args.imsi_base,
+        "seed": args.seed if args.seed is not None else time.time_ns(),
+    }
+
+    event_log = eventlog.EventLog(args.events) if args.events is not None else None
+    wall_start = time.monotonic()
+    try:
+        load = simulate(ssmm.g_transition_matrix, conf, args.n, args.hours * 3600, args.bin, args.batch, conf["seed"],
+                        not args.no_stagger, event_log)
+    finally:
+        if event_log is not None:
+            event_log.close()
+    wall = time.monotonic() - wall_start
+
+    summary = {kind: load_summary(counts, args.bin) for kind, counts in load.items()}
+    print(f"simulated {args.n * args.hours:.0f} UE-hours in {wall:.2f} s")
+    print(f"{'procedure':<14} {'total':>12} {'mean [1/s]':>12} {'p99 [1/s]':>12} {'max [1/s]':>12}")
+    for kind, s in summary.items():
+        print(f"{kind:<14} {s['total']:>12} {s['mean_per_s']:>12.3f} {s['p99_per_s']:>12.3f} {s['max_per_s']:>12.3f}")
+
+    with open(args.o, "w") as fout:
+        json.dump({"conf": conf, "ues": args.n, "hours": args.hours, "bin_width": args.bin, "summary": summary,
+                   "registration": load["registration"].tolist(), "release": load["release"].tolist()}, fout)
+        fout.write("\n")
@@ -7,24 +7,61 @@ import subprocess
 import numpy as np
 import psutil
 
+import control
+import eventlog
+import trafficgen
+import schedule
+import trajectory
+
 
 random.seed(time.time())
 
-event_json = list()
+# Clock of the state machine, the time module or a simulate.VirtualClock
+g_clock = time
+
+# Streaming event log and the time [ns, monotonic] the current state was dispatched
+g_event_log = None
+g_dispatch_ns = None
+
+# Persistent control channel into the containers, None forks a docker exec per command
+g_control = None
+# Native traffic sender, None starts an iperf3 client per transmission
+g_sender = None
+
+# Transition matrix between the states off, pu, ed and pe
+g_transition_matrix = np.array([[0, 0.9, 0.1, 0],
+                                [1, 0, 0, 0],
+                                [0.3, 0, 0, 0.7],
+                                [1, 0, 0, 0]])
 
 def store_list_as_json(filename, data):
     with open(filename, "w") as fout:
         json.dump(data, fout, indent=2)
         fout.write("\n")
 
-def log_event(event, bytes):
+def log_event(event, bytes, latency=None, packets=None, error=None):
+    mono_ns = g_clock.monotonic_ns()
     event_data = {
         "event": event,
-        "ts": time.time(),
+        "ts": g_clock.time(),
+        "mono_ns": mono_ns,
         "bytes": bytes
     }
-
-    event_json.append(event_data)
+    # Harness latency from dispatching the state until its event [s]
+    if g_dispatch_ns is not None:
+        event_data["dispatch_ns"] = g_dispatch_ns
+        event_data["harness_latency"] = (mono_ns - g_dispatch_ns) / 1e9
+    # Harness overhead of the commands behind the event [s]
+    if latency is not None:
+        event_data["latency"] = latency
+    # Send timestamps of the packets of the native traffic generator
+    if packets is not None:
+        event_data["packets"] = packets
+    if error is not None:
+        event_data["error"] = error
+
+    if g_event_log is not None:
+        g_event_log.append(event_data)
 
 def get_tun_ip():
     ifs = psutil.net_if_addrs()
@@ -38,35 +75,78 @@ def get_tun_ip():
     tun_if = ifs[g_tun_name]
     return tun_if[0].address
 
+def run_command(cmd, container=None, workdir=None):
+    """Run a shell command in a container (on the host if None).
+
+    Returns the dispatch latency and duration of the command. Without the
+    control channel the dispatch latency can't be told apart from the
+    duration, which then includes the docker exec.
+    """
+    if g_control is not None:
+        return g_control.run(container, cmd, workdir=workdir).latency()
+
+    if container is None:
+        args = shlex.split(cmd)
+    else:
+        args = ["docker", "exec"] + (["-w", workdir] if workdir is not None else []) + [container, "/bin/bash", "-c", cmd]
+
+    start = time.monotonic()
+    subprocess.run(args, cwd=workdir if container is None else None)
+    return {
+        "dispatch": None,
+        "duration": time.monotonic() - start,
+    }
+
 def register_ue(conf):
     if not conf["dry_run"] and not conf["ue_registered"]:
         global g_tun_ip
 
         cmd = "./nr-cli imsi-901700000000001 --exec 'ps-establish IPv4 --sst 1 --sd 1 --dnn internet'"
-        cmd = shlex.split(cmd)
-        ret = subprocess.run(cmd)
+        run_command(cmd)
         conf["ue_registered"] = True
 
         print("Waiting for tun interface...")
         g_tun_ip = get_tun_ip()
+        if g_sender is not None:
+            g_sender.bind_addr = g_tun_ip
+            g_sender.close()
+
+def transmit(transmit_rate, transmit_bytes):
+    """Send transmit_bytes, returns the harness latency and the packet send timestamps."""
+    if conf["dry_run"]:
+        return None, None
+
+    if g_sender is None:
+        return run_iperf(transmit_rate, transmit_bytes), None
+
+    start = time.monotonic()
+    try:
+        timestamps = g_sender.send(transmit_bytes, transmit_rate)
+    except OSError as e:
+        # E.g. ECONNREFUSED while the receiver restarts, the sender connects again on the next burst
+        print(f"ERR: sending {transmit_bytes} bytes failed: {e}")
+        g_sender.close()
+        log_event("send-error", transmit_bytes, error=str(e))
+        return None, None
+    return {"dispatch": None, "duration": time.monotonic() - start}, timestamps
 
 def run_iperf(transmit_rate, transmit_bytes=None, transmit_time=None):
     if conf["dry_run"]:
         return None
 
     if transmit_bytes is not None:
-        cmd = f"docker exec ue /bin/bash -c 'iperf3 -c {g_server_ip} -B {g_tun_ip} -n {transmit_bytes} -b {transmit_rate}'"
+        cmd = f"iperf3 -c {g_server_ip} -B {g_tun_ip} -n {transmit_bytes} -b {transmit_rate}"
     elif transmit_time is not None:
-        cmd = f"docker exec ue /bin/bash -c 'iperf3 -c {g_server_ip} -B {g_tun_ip} -t {transmit_time} -b {transmit_rate}'"
+        cmd = f"iperf3 -c {g_server_ip} -B {g_tun_ip} -t {transmit_time} -b {transmit_rate}"
     else:
         print("ERR: iperf3 needs either transmit_bytes or transmit_time to run")
+        return None
 
-    cmd = shlex.split(cmd)
-    return subprocess.run(cmd)
+    return run_command(cmd, container="ue")
 
 # Packet length distribution following IMIX
-def get_total_bytes():
-    num = random.random()
+def get_total_bytes(rng=random):
+    num = rng.random()
     if num < 0.58:
         return 64
     elif num < 0.91:
@@ -77,41 +157,41 @@ def get_total_bytes():
 
 # Higher layer UEs can trigger CM_IDLE by themself.
 # UERANSIM only allows this from the gNB
-def off(conf=None):
+def off(conf=None, bursts=None):
     print("\nState: off")
+    latency = None
     if not conf["dry_run"] and conf["ue_registered"]:
-        cmd = "docker exec -w /UERANSIM/build gnb /bin/bash -c \"./nr-cli UERANSIM-gnb-901-70-1 -e 'ue-release 1'\""
-        cmd = shlex.split(cmd)
-        ret = subprocess.run(cmd)
+        cmd = "./nr-cli UERANSIM-gnb-901-70-1 -e 'ue-release 1'"
+        latency = run_command(cmd, container="gnb", workdir="/UERANSIM/build")
         conf["ue_registered"] = False
 
-    log_event("off", None)
+    log_event("off", None, latency)
 
 # Let event detection happen after this state as well. Very small probability though
-def periodic_update(conf):
+def periodic_update(conf, bursts=None):
     conf["ue_registered"] = True
 
     transmit_rate = conf["rate_pu"]
-    transmit_bytes = conf["bytes_pu"]
+    transmit_bytes = int(bursts[0]) if bursts is not None and len(bursts) else conf["bytes_pu"]
 
     print(f"\nState: periodic update: rate {transmit_rate}, bytes: {transmit_bytes}")
-    run_iperf(transmit_rate, transmit_bytes)
+    latency, packets = transmit(transmit_rate, transmit_bytes)
 
-    log_event("pu", transmit_bytes)
+    log_event("pu", transmit_bytes, latency, packets)
 
 # Maybe try to modify bearer for fast transmission
-def event_driven(conf):
+def event_driven(conf, bursts=None):
     conf["ue_registered"] = True
 
     transmit_rate = conf["rate_ed"]
-    transmit_bytes = get_total_bytes()
+    transmit_bytes = int(bursts[0]) if bursts is not None else get_total_bytes()
 
     print(f"\nState: event driven: rate {transmit_rate}, bytes: {transmit_bytes}")
-    run_iperf(transmit_rate, transmit_bytes)
+    latency, packets = transmit(transmit_rate, transmit_bytes)
 
-    log_event("ed", transmit_bytes)
+    log_event("ed", transmit_bytes, latency, packets)
 
-def payload_exchange(conf):
+def payload_exchange(conf, bursts=None):
     conf["ue_registered"] = True
 
     transmit_rate = conf["rate_pe"]
@@ -119,12 +199,19 @@ def payload_exchange(conf):
     # Send several burst with payload sizes distributed according to IMIX
     print(f"\nState: payload exchange: rate {transmit_rate}")
     transmit_bytes_list = list()
+    latency_list = list()
+    packets_list = list()
     for burst in range(10):
-        transmit_bytes = get_total_bytes()
+        transmit_bytes = int(bursts[burst]) if bursts is not None else get_total_bytes()
         transmit_bytes_list.append(transmit_bytes)
-        run_iperf(transmit_rate, transmit_bytes)
+        latency, packets = transmit(transmit_rate, transmit_bytes)
+        latency_list.append(latency)
+        packets_list.append(packets)
 
-    log_event("pe", transmit_bytes_list)
+    if conf["dry_run"]:
+        log_event("pe", transmit_bytes_list)
+    else:
+        log_event("pe", transmit_bytes_list, latency_list, packets_list if g_sender is not None else None)
 
 g_state_table = {
     0: off,
@@ -133,59 +220,88 @@ g_state_table = {
     3: payload_exchange,
 }
 
-def multinomial(v):
-    r = np.random.uniform(0.0, 1.0)
-    CS = np.cumsum(v)
-    CS = np.insert(CS, 0, 0)
-    m = (np.where(CS<r))[0]
-    next_state=m[len(m)-1]
-    
-    return next_state
+def dispatch(state, conf, bursts=None):
+    global g_dispatch_ns
+    g_dispatch_ns = g_clock.monotonic_ns()
+    g_state_table[state](conf, bursts)
 
 def run(P, state, conf):
     start = (np.where(state>0))[1]
-    current_state = start[0]
-    state_hist = state
-    timestamp_next_pu = time.time() + conf["sojourn_time_pu"]
 
-    for x in range(conf["num_it"]):
-        current_row = np.ma.masked_values((P[current_state]), 0.0)
-        next_state = multinomial(current_row)
+    # The whole state sequence, ED sojourns and IMIX lengths are sampled up front,
+    # the loop below only replays them
+    trajectories = trajectory.sample_trajectories(P, 1, conf["num_it"], conf["lam_ed"], conf["seed"], start[0])
+
+    # History of the states (first the initial, last the final off) as indices
+    state_hist = np.zeros(conf["num_it"] + 2, dtype=np.int8)
+    state_hist[0] = start[0]
+    state_hist[1:conf["num_it"] + 1] = trajectories.states[0]
+    hist_len = conf["num_it"] + 1
 
-        state = np.array([[0, 0, 0, 0]])
-        state[0, next_state] = 1.0
+    timestamp_next_pu = g_clock.time() + conf["sojourn_time_pu"]
+
+    for x in range(conf["num_it"]):
+        next_state = int(trajectories.states[0, x])
 
         # Sojourn if we're in OFF state
         if next_state == 1:
-            time_to_sleep = timestamp_next_pu - time.time()
+            time_to_sleep = timestamp_next_pu - g_clock.time()
             if time_to_sleep > 0:
-                time.sleep(time_to_sleep)
+                g_clock.sleep(time_to_sleep)
             else:
                 print(f"Missed pu by {time_to_sleep * -1} seconds")
             timestamp_next_pu += conf["sojourn_time_pu"]
         elif next_state == 2:
-            sojourn_ed = random.expovariate(conf["lam_ed"])
-            time_until_pu = timestamp_next_pu - time.time()
+            sojourn_ed = float(trajectories.sojourn_ed[0, x])
+            time_until_pu = timestamp_next_pu - g_clock.time()
             # Don't miss an entire PU because of an ED
             if sojourn_ed > time_until_pu:
                 sojourn_ed = time_until_pu
 
             if sojourn_ed > 0:
-                time.sleep(sojourn_ed)
-
-        s = g_state_table[next_state]
-        s(conf)
+                g_clock.sleep(sojourn_ed)
 
-        state_hist = np.append(state_hist, state, axis=0)
-        current_state = next_state
+        dispatch(next_state, conf, trajectories.bursts(0, x))
 
     if conf["ue_registered"]:
-        off(conf)
-        state_hist = np.append(state_hist, np.array([[1.0, 0, 0, 0]]), axis=0)
+        dispatch(0, conf)
+        hist_len += 1
 
-    store_list_as_json(conf["filepath"], event_json)
+    print("state histogram\n", np.eye(len(P))[state_hist[:hist_len]])
 
-    print("state histogram\n", state_hist)
+def compile_run(P, state, conf):
+    """Compile the workload run would perform into a schedule."""
+    start = (np.where(state>0))[1]
+    trajectories = trajectory.sample_trajectories(P, 1, conf["num_it"], conf["lam_ed"], conf["seed"], start[0])
+    return schedule.compile_schedule(trajectories, conf, np.array([conf["sojourn_time_pu"]]))
+
+def replay(sched, conf, ue=0):
+    """Dispatch the iterations of one UE of a schedule at their offsets."""
+    rate_keys = {1: "rate_pu", 2: "rate_ed", 3: "rate_pe"}
+    lateness_max = 0.0
+
+    start = g_clock.monotonic()
+    for x in range(sched.num_it):
+        next_state = int(sched.trajectories.states[ue, x])
+
+        if g_clock is time:
+            lateness = schedule.sleep_until(start + sched.offsets[ue, x])
+        else:
+            g_clock.sleep(start + sched.offsets[ue, x] - g_clock.monotonic())
+            lateness = 0.0
+        lateness_max = max(lateness_max, lateness)
+        if lateness > 0.01:
+            print(f"Missed {schedule.g_state_names[next_state]} by {lateness} seconds")
+
+        if next_state in rate_keys:
+            conf[rate_keys[next_state]] = int(sched.rates[ue, x])
+
+        dispatch(next_state, conf, sched.trajectories.bursts(ue, x))
+
+    if conf["ue_registered"]:
+        dispatch(0, conf)
+
+    print(f"replayed {sched.num_it} iterations, max lateness {lateness_max * 1000:.3f} ms")
 
 
 # Todo: For real measurements change @-t_pu=600 (10min), @-l_ed=0.005
@@ -194,10 +310,7 @@ if __name__ == "__main__":
     global g_tun_ip
     global g_server_ip
 
-    P = np.array([[0, 0.9, 0.1, 0],
-                  [1, 0, 0, 0],
-                  [0.3, 0, 0, 0.7],
-                  [1, 0, 0, 0]])
+    P = g_transition_matrix
     state = np.array([[1.0, 0, 0, 0]])
 
     parser = argparse.ArgumentParser()
@@ -261,7 +374,19 @@ if __name__ == "__main__":
                         const="10.45.0.1",
                         nargs="?",
                         type=str,
-                        help="ipv4 address of the iperf3 server")
+                        help="ipv4 address of the traffic receiver (trafficgen.py or iperf3 server)")
+    parser.add_argument("-p",
+                        default=5201,
+                        const=5201,
+                        nargs="?",
+                        type=int,
+                        help="port of the traffic receiver")
+    parser.add_argument("--tcp",
+                        action='store_true',
+                        help="send the native traffic over TCP instead of UDP")
+    parser.add_argument("--iperf",
+                        action='store_true',
+                        help="start an iperf3 client per transmission instead of the native traffic generator")
     parser.add_argument("-c",
                         default="10.45.0.2",
                         const="10.45.0.2",
@@ -275,14 +400,36 @@ if __name__ == "__main__":
                         type=str,
                         help="device name of the tun interface")
     parser.add_argument("-o",
-                        default="events_ssmm.json",
-                        const="events_ssmm.json",
+                        default="events_ssmm.ndjson",
+                        const="events_ssmm.ndjson",
                         nargs="?",
                         type=str,
-                        help="path to the outfile")
+                        help="path to the event log (NDJSON, written while running)")
+    parser.add_argument("--seed",
+                        default=None,
+                        type=int,
+                        help="seed of the state sequence, ED sojourns and IMIX lengths (default: time)")
+    parser.add_argument("--export-schedule",
+                        default=None,
+                        type=str,
+                        help="only compile the workload into a schedule file (.npz or .ndjson) and exit")
+    parser.add_argument("--replay",
+                        default=None,
+                        type=str,
+                        help="replay a schedule file instead of sampling the workload")
+    parser.add_argument("--ue",
+                        default=0,
+                        type=int,
+                        help="UE of the schedule to replay")
     parser.add_argument("--dry-run",
                         action='store_true',
                         help="don't perform registration and transmission")
+    parser.add_argument("--simulate",
+                        action='store_true',
+                        help="dry run in virtual time, sojourns take no real time (see simulate.py for many UEs)")
+    parser.add_argument("--fork",
+                        action='store_true',
+                        help="start a docker exec per command instead of using persistent control sessions")
     args = parser.parse_args()
 
     conf = {
@@ -299,11 +446,38 @@ if __name__ == "__main__":
         "client_addr": args.c,
         "ue_registered": True,
         "filepath": args.o,
-        "dry_run": args.dry_run
+        "seed": args.seed if args.seed is not None else time.time_ns(),
+        "dry_run": args.dry_run or args.simulate
     }
 
     g_tun_name = args.d
     g_server_ip = args.s
     g_tun_ip = args.c
-    
-    run(P, state, conf)
+
+    if args.export_schedule is not None:
+        schedule.write_schedule(args.export_schedule, compile_run(P, state, conf))
+        print(f"wrote schedule to {args.export_schedule}")
+        raise SystemExit(0)
+
+    if args.simulate:
+        import simulate
+
+        g_clock = simulate.VirtualClock()
+
+    if not args.fork and not conf["dry_run"]:
+        g_control = control.ThreadedControlChannel()
+    if not args.iperf and not conf["dry_run"]:
+        g_sender = trafficgen.TrafficSender(g_tun_ip, g_server_ip, args.p, "tcp" if args.tcp else "udp")
+
+    g_event_log = eventlog.EventLog(args.o)
+    try:
+        if args.replay is not None:
+            replay(schedule.read_schedule(args.replay), conf, args.ue)
+        else:
+            run(P, state, conf)
+    finally:
+        if g_control is not None:
+            g_control.close()
+        if g_sender is not None:
+            g_sender.close()
+        g_event_log.close()
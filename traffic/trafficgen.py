@@ -0,0 +1,252 @@
+import argparse
+import json
+import selectors
+import signal
+import socket
+import struct
+import time
+
+# Every packet starts with its length, a sequence number per sender and the send time [ns]
+g_header = struct.Struct("!IIQ")
+g_max_payload = 1400
+
+
+class TrafficSender:
+    """Paced UDP or TCP sender bound to the address of the UE tun interface.
+
+    The socket is opened on the first send and kept for all following bursts,
+    so a burst costs no process start and, for TCP, no handshake. The send
+    time of every packet is recorded.
+    """
+
+    def __init__(self, bind_addr, server_addr, port=5201, protocol="udp", max_payload=g_max_payload):
+        self.bind_addr = bind_addr
+        self.server_addr = server_addr
+        self.port = port
+        self.protocol = protocol
+        self.max_payload = max_payload
+        self.sock = None
+        self.sequence = 0
+        self.padding = bytes(max_payload)
+
+    def connect(self):
+        kind = socket.SOCK_DGRAM if self.protocol == "udp" else socket.SOCK_STREAM
+        sock = socket.socket(socket.AF_INET, kind)
+        try:
+            sock.bind((self.bind_addr, 0))
+            sock.connect((self.server_addr, self.port))
+            if self.protocol == "tcp":
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            sock.close()
+            raise
+        self.sock = sock
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def packet_sizes(self, transmit_bytes):
+        sizes = [self.max_payload] * (transmit_bytes // self.max_payload)
+        if transmit_bytes % self.max_payload:
+            sizes.append(transmit_bytes % self.max_payload)
+        return [max(size, g_header.size) for size in sizes]
+
+    def send(self, transmit_bytes, transmit_rate):
+        """Send transmit_bytes at transmit_rate [bit/s], returns the send time of every packet [s]."""
+        return self.send_packets(self.packet_sizes(transmit_bytes), transmit_rate)
+
+    def send_packets(self, sizes, transmit_rate):
+        if self.sock is None:
+            self.connect()
+
+        timestamps = list()
+        start = time.monotonic()
+        sent_bits = 0
+        for size in sizes:
+            # Sleep until the packet's deadline at the configured rate
+            deadline = start + sent_bits / transmit_rate
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            send_ns = time.time_ns()
+            packet = g_header.pack(size, self.sequence, send_ns) + self.padding[:size - g_header.size]
+            try:
+                self.sock.sendall(packet)
+            except OSError:
+                # The tun interface may have gone with a release, reconnect once
+                self.close()
+                self.connect()
+                self.sock.sendall(packet)
+
+            timestamps.append(send_ns / 1e9)
+            self.sequence = (self.sequence + 1) & 0xffffffff
+            sent_bits += size * 8
+
+        return timestamps
+
+
+class SourceStats:
+    def __init__(self):
+        self.packets = 0
+        self.bytes = 0
+        self.lost = 0
+        self.next_sequence = None
+        self.delay_sum = 0.0
+        self.delay_max = 0.0
+
+    def add(self, size, sequence, send_ns, recv_ns):
+        if self.next_sequence is not None and sequence > self.next_sequence:
+            self.lost += sequence - self.next_sequence
+        self.next_sequence = sequence + 1
+        self.packets += 1
+        self.bytes += size
+        delay = (recv_ns - send_ns) / 1e9
+        self.delay_sum += delay
+        self.delay_max = max(self.delay_max, delay)
+
+    def to_dict(self):
+        return {
+            "packets": self.packets,
+            "bytes": self.bytes,
+            "lost": self.lost,
+            "mean_delay": self.delay_sum / self.packets if self.packets else None,
+            "max_delay": self.delay_max,
+        }
+
+
+class TrafficReceiver:
+    """Counterpart of TrafficSender, a lightweight replacement of iperf3 -s.
+
+    Serves UDP and TCP on the same port from one thread. Packets are counted
+    per source, lost sequence numbers and the one way delay (sender and
+    receiver share the clock of the emulation host) are tracked, and every
+    packet can be written to a NDJSON log.
+    """
+
+    def __init__(self, bind_addr, port=5201, logfile=None):
+        self.selector = selectors.DefaultSelector()
+        self.stats = dict()
+        self.log = open(logfile, "w", buffering=1 << 16) if logfile is not None else None
+
+        self.udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        self.udp.bind((bind_addr, port))
+        self.selector.register(self.udp, selectors.EVENT_READ, self.read_udp)
+
+        self.tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.tcp.bind((bind_addr, port))
+        self.tcp.listen(128)
+        self.tcp.setblocking(False)
+        self.selector.register(self.tcp, selectors.EVENT_READ, self.accept)
+
+    def record(self, source, protocol, packet, recv_ns):
+        size, sequence, send_ns = g_header.unpack_from(packet)
+        key = f"{protocol}:{source}"
+        if key not in self.stats:
+            self.stats[key] = SourceStats()
+        self.stats[key].add(size, sequence, send_ns, recv_ns)
+
+        if self.log is not None:
+            self.log.write(f'{{"source":"{key}","seq":{sequence},"bytes":{size},"send_ns":{send_ns},"recv_ns":{recv_ns}}}\n')
+
+    def read_udp(self, sock):
+        packet, (source, _) = sock.recvfrom(65535)
+        if len(packet) >= g_header.size:
+            self.record(source, "udp", packet, time.time_ns())
+
+    def accept(self, sock):
+        conn, (source, _) = sock.accept()
+        conn.setblocking(False)
+        self.selector.register(conn, selectors.EVENT_READ, self.reader(source))
+
+    def reader(self, source):
+        buffer = bytearray()
+
+        def read_tcp(conn):
+            try:
+                data = conn.recv(1 << 16)
+            except ConnectionError:
+                data = b""
+            if not data:
+                self.selector.unregister(conn)
+                conn.close()
+                return
+
+            recv_ns = time.time_ns()
+            buffer.extend(data)
+            while len(buffer) >= g_header.size:
+                size = g_header.unpack_from(buffer)[0]
+                if size < g_header.size:
+                    # Not a TrafficSender stream
+                    self.selector.unregister(conn)
+                    conn.close()
+                    return
+                if len(buffer) < size:
+                    break
+                self.record(source, "tcp", bytes(buffer[:g_header.size]), recv_ns)
+                del buffer[:size]
+
+        return read_tcp
+
+    def serve(self, duration=None):
+        end = None if duration is None else time.monotonic() + duration
+        self.running = True
+        while self.running and (end is None or time.monotonic() < end):
+            for key, _ in self.selector.select(timeout=0.5):
+                key.data(key.fileobj)
+
+    def stop(self, *args):
+        self.running = False
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+        if self.log is not None:
+            self.log.close()
+
+    def summary(self):
+        return {source: stats.to_dict() for source, stats in self.stats.items()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Receiver for the traffic of ssmm.py and fleet.py (replaces iperf3 -s)")
+
+    parser.add_argument("-B",
+                        default="10.45.0.1",
+                        type=str,
+                        help="address to listen on")
+    parser.add_argument("-p",
+                        default=5201,
+                        type=int,
+                        help="UDP and TCP port")
+    parser.add_argument("-o",
+                        default=None,
+                        type=str,
+                        help="write every received packet to this NDJSON file")
+    parser.add_argument("--summary",
+                        default=None,
+                        type=str,
+                        help="write the per source statistics as JSON on exit")
+    parser.add_argument("-t",
+                        default=None,
+                        type=float,
+                        help="stop after this many seconds")
+    args = parser.parse_args()
+
+    receiver = TrafficReceiver(args.B, args.p, args.o)
+    signal.signal(signal.SIGTERM, receiver.stop)
+    signal.signal(signal.SIGINT, receiver.stop)
+    try:
+        receiver.serve(args.t)
+    finally:
+        receiver.close()
+        summary = receiver.summary()
+        print(json.dumps(summary, indent=2))
+        if args.summary is not None:
+            with open(args.summary, "w") as fout:
+                json.dump(summary, fout, indent=2)
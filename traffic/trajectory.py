@@ -0,0 +1,72 @@
+import numpy as np
+
+# IMIX packet lengths and their cumulative probabilities, as in ssmm.get_total_bytes
+g_imix_bytes = np.array([64, 580, 1400], dtype=np.uint16)
+g_imix_cdf = np.array([0.58, 0.91])
+
+# Number of transmissions (bursts) in the states off, pu, ed and pe that draw an IMIX length
+g_imix_bursts = np.array([0, 0, 1, 10])
+
+
+class Trajectories:
+    """Pre-sampled state sequences of many UEs.
+
+    states[ue, it] is the state entered in iteration it, sojourn_ed[ue, it]
+    the exponential sojourn before it if that state is ED. The IMIX lengths
+    of all iterations are kept in one flat array, the bursts of iteration it
+    of a UE are burst_bytes[burst_offsets[k]:burst_offsets[k + 1]] with
+    k = ue * num_it + it.
+    """
+
+    def __init__(self, states, sojourn_ed, burst_offsets, burst_bytes):
+        self.states = states
+        self.sojourn_ed = sojourn_ed
+        self.burst_offsets = burst_offsets
+        self.burst_bytes = burst_bytes
+
+    @property
+    def num_ues(self):
+        return self.states.shape[0]
+
+    @property
+    def num_it(self):
+        return self.states.shape[1]
+
+    def bursts(self, ue, it):
+        k = ue * self.num_it + it
+        return self.burst_bytes[self.burst_offsets[k]:self.burst_offsets[k + 1]]
+
+
+def sample_imix(rng, size):
+    return g_imix_bytes[np.searchsorted(g_imix_cdf, rng.random(size), side="right")]
+
+
+def sample_states(P, num_ues, num_it, rng, initial_state=0):
+    """Markov chain states of num_ues UEs for num_it iterations, as int8 array."""
+    cdf = np.cumsum(P, axis=1)
+    # Rounding may leave the last entry a bit below 1
+    cdf[:, -1] = 1.0
+
+    uniforms = rng.random((num_it, num_ues))
+    states = np.empty((num_it, num_ues), dtype=np.int8)
+    current = np.full(num_ues, initial_state, dtype=np.int64)
+    for it in range(num_it):
+        # Vectorized over the UEs: first state whose cumulative probability exceeds the uniform
+        current = (uniforms[it][:, None] >= cdf[current]).sum(axis=1)
+        states[it] = current
+
+    return np.ascontiguousarray(states.T)
+
+
+def sample_trajectories(P, num_ues, num_it, lam_ed, seed=None, initial_state=0):
+    """Sample states, ED sojourns and IMIX lengths of all UEs and iterations in bulk."""
+    rng = np.random.default_rng(seed)
+    states = sample_states(np.asarray(P, dtype=float), num_ues, num_it, rng, initial_state)
+    sojourn_ed = np.where(states == 2, rng.exponential(1 / lam_ed, states.shape), 0.0).astype(np.float32)
+
+    counts = g_imix_bursts[states].ravel()
+    burst_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=burst_offsets[1:])
+    burst_bytes = sample_imix(rng, burst_offsets[-1])
+
+    return Trajectories(states, sojourn_ed, burst_offsets, burst_bytes)
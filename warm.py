@@ -0,0 +1,81 @@
+"""
+About: Reset a running emulation for the next experiment run (topo.py --warm).
+
+Containers, links and the long-running helpers of the core (MongoDB, WebUI,
+traffic receiver) stay up. Only the NF, gNB and UE processes are stopped
+and the MongoDB state is rolled back to the snapshot taken when the first
+run was ready.
+"""
+
+import os
+import time
+
+import boot
+
+# pkill/pgrep patterns of the processes of a run, the brackets keep them from matching the shell running them
+g_processes = {
+    "core": "[i]nstall/bin/open5gs-",
+    "gnb": "[n]r-gnb",
+    "ue": "[n]r-ue",
+}
+g_nf_logs = boot.g_nrf_nfs + ("nrf", "upf")
+
+# Copy every collection of the open5gs database to <name>_baseline and back, $out replaces the target collection.
+# Collections created after the snapshot have no baseline and are dropped on restore.
+g_db = "open5gs"
+g_snapshot_js = ('db.getCollectionNames().filter(c => !c.startsWith("system.") && !c.endsWith("_baseline"))'
+                 '.forEach(c => db[c].aggregate([{$out: c + "_baseline"}]))')
+g_restore_js = ('var names = db.getCollectionNames();'
+                'names.filter(c => !c.startsWith("system.") && !c.endsWith("_baseline") && !names.includes(c + "_baseline"))'
+                '.forEach(c => db[c].drop());'
+                'names.filter(c => c.endsWith("_baseline"))'
+                '.forEach(c => db[c].aggregate([{$out: c.slice(0, -"_baseline".length)}]))')
+
+
+def run_mongo(container, js):
+    if boot.container_run(container, f"mongo {g_db} --quiet --eval '{js}'") != 0:
+        raise RuntimeError(f"mongo in {container} failed: {js}")
+
+
+def snapshot_db(container):
+    run_mongo(container, g_snapshot_js)
+
+
+def restore_db(container):
+    run_mongo(container, g_restore_js)
+
+
+def stop(container, kind):
+    boot.container_run(container, f"pkill -f '{g_processes[kind]}'")
+
+
+def stopped_probe(container, kind):
+    return lambda: not boot.container_succeeds(container, f"pgrep -f '{g_processes[kind]}'")
+
+
+def clear_logs(log_dir, names):
+    for name in names:
+        path = os.path.join(log_dir, f"{name}.log")
+        if os.path.exists(path):
+            open(path, "w").close()
+
+
+def reset(timer, hosts, core, log_dir, timeout=60, logs=None):
+    """Stop the processes of the last run on hosts ((host, kind) pairs) and roll back the database.
+
+    The hosts' shells are free for the next sendCmd afterwards. logs names
+    the logs in log_dir to truncate, by default they keep growing and the
+    log parser separates the runs.
+    """
+    for host, kind in hosts:
+        stop(host.name, kind)
+    timer.wait("stop", {host.name: stopped_probe(host.name, kind) for host, kind in hosts}, timeout)
+    for host, _ in hosts:
+        if host.waiting:
+            host.waitOutput()
+
+    start = time.monotonic()
+    restore_db(core.name)
+    if logs:
+        clear_logs(log_dir, logs)
+    timer.record("reset", start)